@@ -0,0 +1,38 @@
+"""ISO tracker dates
+
+Revision ID: 02de016bd0d8
+Revises: 4910626a5885
+Create Date: 2026-10-18 12:35:38.089409
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '02de016bd0d8'
+down_revision = '4910626a5885'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # trackers.date was written as DD-MM-YYYY text on SQLite,
+    # rewrite it as ISO YYYY-MM-DD so dates sort and compare correctly
+    if op.get_bind().dialect.name != "sqlite":
+        return
+    op.execute(
+        "UPDATE trackers "
+        "SET date = substr(date, 7, 4) || '-' || substr(date, 4, 2) || '-' || substr(date, 1, 2) "
+        "WHERE date LIKE '__-__-____'"
+    )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "sqlite":
+        return
+    op.execute(
+        "UPDATE trackers "
+        "SET date = substr(date, 9, 2) || '-' || substr(date, 6, 2) || '-' || substr(date, 1, 4) "
+        "WHERE date LIKE '____-__-__'"
+    )
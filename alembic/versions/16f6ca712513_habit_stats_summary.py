@@ -0,0 +1,74 @@
+"""Habit stats summary
+
+Revision ID: 16f6ca712513
+Revises: d0903f446f81
+Create Date: 2026-10-18 12:43:02.136835
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '16f6ca712513'
+down_revision = 'd0903f446f81'
+branch_labels = None
+depends_on = None
+
+# Day number of a date, a snapshot of stats.DIALECT_DAY
+DIALECT_DAY = {
+    'sqlite': 'CAST(julianday(date) AS INTEGER)',
+    'postgresql': "(CAST(date AS DATE) - DATE '2000-01-01')",
+}
+# habit_stats backfill from trackers, a snapshot of stats.rebuild_query
+BACKFILL = """
+    INSERT INTO habit_stats
+        (habit_id, current_streak, longest_streak, last_checkin, total_completions)
+    WITH islands AS (
+        SELECT habit_id, date,
+            {day} - ROW_NUMBER() OVER (PARTITION BY habit_id ORDER BY date) AS island
+        FROM trackers
+        WHERE status = 1
+    ),
+    streaks AS (
+        SELECT habit_id, COUNT(*) AS length, MAX(date) AS last_date
+        FROM islands GROUP BY habit_id, island
+    ),
+    habit_streaks AS (
+        SELECT habit_id, length, last_date,
+            MAX(last_date) OVER (PARTITION BY habit_id) AS last_checkin
+        FROM streaks
+    ),
+    totals AS (
+        SELECT habit_id,
+            MAX(CASE WHEN last_date = last_checkin THEN length ELSE 0 END)
+                AS current_streak,
+            MAX(length) AS longest_streak,
+            MAX(last_checkin) AS last_checkin,
+            SUM(length) AS total_completions
+        FROM habit_streaks GROUP BY habit_id
+    )
+    SELECT h.id,
+        COALESCE(t.current_streak, 0),
+        COALESCE(t.longest_streak, 0),
+        t.last_checkin,
+        COALESCE(t.total_completions, 0)
+    FROM habits h LEFT JOIN totals t ON t.habit_id = h.id
+    """
+
+
+def upgrade() -> None:
+    op.create_table('habit_stats',
+    sa.Column('habit_id', sa.Integer(), nullable=False),
+    sa.Column('current_streak', sa.Integer(), nullable=False),
+    sa.Column('longest_streak', sa.Integer(), nullable=False),
+    sa.Column('last_checkin', sa.Date(), nullable=True),
+    sa.Column('total_completions', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['habit_id'], ['habits.id'], ),
+    sa.PrimaryKeyConstraint('habit_id')
+    )
+    op.execute(BACKFILL.format(day=DIALECT_DAY[op.get_bind().dialect.name]))
+
+
+def downgrade() -> None:
+    op.drop_table('habit_stats')
@@ -0,0 +1,28 @@
+"""User shards directory
+
+Revision ID: 3f8d1a6c2b47
+Revises: 7c2e5b9a4f31
+Create Date: 2026-10-18 15:21:07.334610
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f8d1a6c2b47'
+down_revision = '7c2e5b9a4f31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('user_shards',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('shard', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('user_shards')
@@ -0,0 +1,28 @@
+"""User shards moving state
+
+Revision ID: 5b7e3c9d1a24
+Revises: 9a4e7d2c1b58
+Create Date: 2026-10-18 16:48:31.520914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b7e3c9d1a24'
+down_revision = '9a4e7d2c1b58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'user_shards',
+        sa.Column('moving', sa.Boolean(), server_default=sa.false(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('user_shards') as batch_op:
+        batch_op.drop_column('moving')
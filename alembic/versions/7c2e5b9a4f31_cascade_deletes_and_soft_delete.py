@@ -0,0 +1,64 @@
+"""Cascade deletes and soft delete
+
+Revision ID: 7c2e5b9a4f31
+Revises: 16f6ca712513
+Create Date: 2026-10-18 13:02:41.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c2e5b9a4f31'
+down_revision = '16f6ca712513'
+branch_labels = None
+depends_on = None
+
+TABLES = ('trackers', 'habit_bitmaps', 'habit_stats')
+# SQLite foreign keys are unnamed, name them to drop them in batch mode
+NAMING_CONVENTION = {
+    'fk': 'fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s',
+}
+
+
+def _replace_foreign_keys(ondelete) -> None:
+    if op.get_bind().dialect.name == 'sqlite':
+        for table in TABLES:
+            name = f'fk_{table}_habit_id_habits'
+            with op.batch_alter_table(
+                table,
+                naming_convention=NAMING_CONVENTION,
+                recreate='always',
+            ) as batch_op:
+                batch_op.drop_constraint(name, type_='foreignkey')
+                batch_op.create_foreign_key(
+                    name, 'habits', ['habit_id'], ['id'], ondelete=ondelete
+                )
+        return
+    for table in TABLES:
+        name = f'{table}_habit_id_fkey'
+        op.drop_constraint(name, table, type_='foreignkey')
+        op.create_foreign_key(
+            name, table, 'habits', ['habit_id'], ['id'], ondelete=ondelete
+        )
+
+
+def upgrade() -> None:
+    _replace_foreign_keys('CASCADE')
+    op.add_column('habits', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.create_index(
+        'ix_habits_deleted_at',
+        'habits',
+        ['deleted_at'],
+        unique=False,
+        postgresql_where=sa.text('deleted_at IS NOT NULL'),
+        sqlite_where=sa.text('deleted_at IS NOT NULL'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_habits_deleted_at', table_name='habits')
+    with op.batch_alter_table('habits') as batch_op:
+        batch_op.drop_column('deleted_at')
+    _replace_foreign_keys(None)
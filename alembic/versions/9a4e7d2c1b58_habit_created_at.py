@@ -0,0 +1,57 @@
+"""Habit created_at
+
+Revision ID: 9a4e7d2c1b58
+Revises: 3f8d1a6c2b47
+Create Date: 2026-10-18 16:05:12.907431
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4e7d2c1b58'
+down_revision = '3f8d1a6c2b47'
+branch_labels = None
+depends_on = None
+
+# Existing habits started no later than their first tracker
+BACKFILL = """
+    UPDATE habits SET created_at = COALESCE(
+        (SELECT MIN(date) FROM trackers WHERE trackers.habit_id = habits.id),
+        CURRENT_DATE
+    )
+    """
+
+
+def _create_deleted_at_index() -> None:
+    op.create_index(
+        'ix_habits_deleted_at',
+        'habits',
+        ['deleted_at'],
+        unique=False,
+        postgresql_where=sa.text('deleted_at IS NOT NULL'),
+        sqlite_where=sa.text('deleted_at IS NOT NULL'),
+    )
+
+
+def upgrade() -> None:
+    op.add_column('habits', sa.Column('created_at', sa.Date(), nullable=True))
+    op.execute(BACKFILL)
+    # SQLite rebuilds the table, its partial index would come back as a full one
+    op.drop_index('ix_habits_deleted_at', table_name='habits')
+    with op.batch_alter_table('habits') as batch_op:
+        batch_op.alter_column(
+            'created_at',
+            existing_type=sa.Date(),
+            nullable=False,
+            server_default=sa.text('CURRENT_DATE'),
+        )
+    _create_deleted_at_index()
+
+
+def downgrade() -> None:
+    op.drop_index('ix_habits_deleted_at', table_name='habits')
+    with op.batch_alter_table('habits') as batch_op:
+        batch_op.drop_column('created_at')
+    _create_deleted_at_index()
@@ -0,0 +1,45 @@
+"""Shard id ranges
+
+Revision ID: c4a9e2f7b613
+Revises: 5b7e3c9d1a24
+Create Date: 2026-10-18 17:32:54.118203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4a9e2f7b613'
+down_revision = '5b7e3c9d1a24'
+branch_labels = None
+depends_on = None
+
+# SQLite next id bump, a snapshot of models.habits.NEXT_ID_TRIGGER
+NEXT_ID_TRIGGER = """
+    CREATE TRIGGER {table}_next_id AFTER INSERT ON {table}
+    WHEN NEW.id >= (SELECT next_id FROM id_ranges WHERE table_name = '{table}')
+        AND NEW.id < (SELECT ceiling FROM id_ranges WHERE table_name = '{table}')
+    BEGIN
+        UPDATE id_ranges SET next_id = NEW.id + 1 WHERE table_name = '{table}';
+    END
+    """
+
+
+def upgrade() -> None:
+    op.create_table('id_ranges',
+    sa.Column('table_name', sa.String(), nullable=False),
+    sa.Column('next_id', sa.Integer(), nullable=False),
+    sa.Column('ceiling', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('table_name')
+    )
+    if op.get_bind().dialect.name == 'sqlite':
+        for table in ('habits', 'trackers'):
+            op.execute(NEXT_ID_TRIGGER.format(table=table))
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'sqlite':
+        for table in ('habits', 'trackers'):
+            op.execute(f'DROP TRIGGER {table}_next_id')
+    op.drop_table('id_ranges')
@@ -0,0 +1,30 @@
+"""Habit bitmaps
+
+Revision ID: d0903f446f81
+Revises: da76e58cbc6e
+Create Date: 2026-10-18 12:40:03.663267
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd0903f446f81'
+down_revision = 'da76e58cbc6e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('habit_bitmaps',
+    sa.Column('habit_id', sa.Integer(), nullable=False),
+    sa.Column('year', sa.Integer(), nullable=False),
+    sa.Column('bits', sa.LargeBinary(), nullable=False),
+    sa.ForeignKeyConstraint(['habit_id'], ['habits.id'], ),
+    sa.PrimaryKeyConstraint('habit_id', 'year')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('habit_bitmaps')
@@ -0,0 +1,31 @@
+"""Habits and trackers lookup indexes
+
+Revision ID: da76e58cbc6e
+Revises: 02de016bd0d8
+Create Date: 2026-10-18 12:36:18.339341
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'da76e58cbc6e'
+down_revision = '02de016bd0d8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # keep the latest tracker per (habit_id, date) before enforcing uniqueness
+    op.execute(
+        "DELETE FROM trackers WHERE id NOT IN "
+        "(SELECT MAX(id) FROM trackers GROUP BY habit_id, date)"
+    )
+    op.create_index('ix_habits_user_id_id', 'habits', ['user_id', 'id'], unique=False)
+    op.create_index('ix_trackers_habit_id_date', 'trackers', ['habit_id', 'date'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_trackers_habit_id_date', table_name='trackers')
+    op.drop_index('ix_habits_user_id_id', table_name='habits')
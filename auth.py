@@ -0,0 +1,319 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+import jwt
+from fastapi import HTTPException, status
+
+import metrics
+from settings import Settings
+
+settings = Settings()
+
+
+class TokenCache:
+    """
+    In-process token -> user cache with TTL and LRU eviction.
+    Rejected tokens are stored as None with their own (shorter) TTL.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        negative_ttl: float,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._timer = timer
+        self._entries: "OrderedDict[str, Tuple[float, Optional[dict]]]" = OrderedDict()
+
+    def get(self, key: str) -> Tuple[bool, Optional[dict]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, user = entry
+        if expires_at <= self._timer():
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, user
+
+    def set(self, key: str, user: Optional[dict]) -> None:
+        ttl = self.ttl if user is not None else self.negative_ttl
+        if ttl <= 0:
+            return
+        self._entries[key] = (self._timer() + ttl, user)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+HMAC_ALGORITHMS = {"HS256", "HS384", "HS512"}
+
+
+def load_keys(path: str, algorithms: List[str]) -> Dict[Optional[str], tuple]:
+    """
+    kid -> (public key, algorithms) from a JWKS or a PEM public key file,
+    a PEM key has no kid
+    """
+    with open(path, "rb") as file:
+        data = file.read()
+    if not data.lstrip().startswith(b"{"):
+        return {None: (data, [a for a in algorithms if a not in HMAC_ALGORITHMS])}
+    keys: Dict[Optional[str], tuple] = {}
+    for jwk in json.loads(data)["keys"]:
+        if jwk.get("kty") == "oct":
+            continue
+        key = jwt.PyJWK(jwk)
+        keys[jwk.get("kid")] = (key.key, [key.algorithm_name])
+    return keys
+
+
+def user_from_claims(claims: dict) -> dict:
+    """
+    UserDB shaped dict from the claims of a verified token, the issuer is trusted
+    so the email is not validated again
+    """
+    email = claims.get("email")
+    username = claims.get("username", claims.get("preferred_username"))
+    if not isinstance(email, str) or not isinstance(username, str):
+        raise ValueError("email and username claims required")
+    return {
+        "id": int(claims.get("id", claims.get("sub"))),
+        "email": email,
+        "username": username,
+    }
+
+
+class JWTVerifier:
+    """
+    Local verification of JWT bearer tokens, HS* with the shared secret and
+    asymmetric algorithms with the keys file. The keys file is re-read when it
+    changes, checked every reload_interval seconds and on an unknown kid.
+    verify returns None for tokens to check with the auth service:
+    opaque tokens and tokens signed with a key not known here.
+    """
+
+    def __init__(
+        self,
+        secret: Optional[str] = None,
+        keys_file: Optional[str] = None,
+        algorithms: Optional[List[str]] = None,
+        audience: Optional[str] = None,
+        issuer: Optional[str] = None,
+        leeway: float = 0,
+        reload_interval: float = 60,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if secret is None and keys_file is None:
+            raise ValueError("JWT verification needs a secret or a keys file")
+        self.secret = secret
+        self.keys_file = keys_file
+        self.algorithms = algorithms or ["HS256", "RS256", "ES256"]
+        self.audience = audience
+        self.issuer = issuer
+        self.leeway = leeway
+        self.reload_interval = reload_interval
+        self._timer = timer
+        self._keys: Dict[Optional[str], tuple] = {}
+        self._mtime: Optional[int] = None
+        self._checked_at: Optional[float] = None
+
+    def keys(self, reload: bool = False) -> Dict[Optional[str], tuple]:
+        if self.keys_file is None:
+            return self._keys
+        now = self._timer()
+        if (
+            reload
+            or self._checked_at is None
+            or now - self._checked_at >= self.reload_interval
+        ):
+            self._checked_at = now
+            mtime = os.stat(self.keys_file).st_mtime_ns
+            if mtime != self._mtime:
+                self._keys = load_keys(self.keys_file, self.algorithms)
+                self._mtime = mtime
+        return self._keys
+
+    def _key(self, header: dict) -> Optional[tuple]:
+        algorithm = header.get("alg")
+        if algorithm in HMAC_ALGORITHMS:
+            if self.secret is None or algorithm not in self.algorithms:
+                return None
+            return self.secret, [algorithm]
+        kid = header.get("kid")
+        for reload in (False, True):
+            keys = self.keys(reload)
+            if kid in keys:
+                return keys[kid]
+            if kid is None and len(keys) == 1:
+                return next(iter(keys.values()))
+        return None
+
+    def verify(self, token: str) -> Optional[dict]:
+        """
+        User data from the claims of a JWT, raise 401 if it does not verify
+        """
+        if token[:7].lower() == "bearer ":
+            token = token[7:]
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.DecodeError:
+            return None
+        key = self._key(header)
+        if key is None:
+            return None
+        try:
+            claims = jwt.decode(
+                token,
+                key[0],
+                algorithms=key[1],
+                audience=self.audience,
+                issuer=self.issuer,
+                leeway=self.leeway,
+                options={"require": ["exp"]},
+            )
+            return user_from_claims(claims)
+        except (jwt.InvalidTokenError, TypeError, ValueError):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+
+
+class AuthClient:
+    """
+    Async, connection-pooled client for the auth service check-token endpoint.
+    Concurrent lookups of the same token share a single request.
+    With a verifier, JWTs are verified locally and only opaque tokens
+    reach the auth service.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        cache: TokenCache,
+        timeout: float = 5,
+        max_connections: int = 100,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        verifier: Optional[JWTVerifier] = None,
+    ) -> None:
+        self.base_url = base_url
+        self.verifier = verifier
+        self.cache = cache
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._inflight: Dict[str, "asyncio.Future[Optional[dict]]"] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections),
+                transport=self._transport,
+            )
+        return self._client
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def check_token(self, token: str) -> dict:
+        """
+        Return user data for token, raise 401 if the auth service rejects it
+        """
+        if self.verifier is not None:
+            started = time.perf_counter()
+            try:
+                local_user = self.verifier.verify(token)
+            except HTTPException:
+                metrics.auth_duration.observe(
+                    time.perf_counter() - started, "local_rejected"
+                )
+                raise
+            if local_user is not None:
+                metrics.auth_duration.observe(time.perf_counter() - started, "local")
+                return local_user
+        key = hashlib.sha256(token.encode()).hexdigest()
+        found, user = self.cache.get(key)
+        if not found:
+            future = self._inflight.get(key)
+            if future is None:
+                future = asyncio.ensure_future(self._fetch(key, token))
+                self._inflight[key] = future
+            user = await asyncio.shield(future)
+        if user is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+        return user
+
+    async def _fetch(self, key: str, token: str) -> Optional[dict]:
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            try:
+                r = await self.client.post(
+                    "/users/check-token", headers={"Authorization": token}
+                )
+            except httpx.HTTPError:
+                raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+            if r.status_code == 401:
+                user = None
+                outcome = "rejected"
+            elif r.is_success:
+                user = r.json()
+                outcome = "ok"
+            else:
+                raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.cache.set(key, user)
+            return user
+        finally:
+            metrics.auth_duration.observe(time.perf_counter() - started, outcome)
+            self._inflight.pop(key, None)
+
+
+def create_verifier() -> Optional[JWTVerifier]:
+    if settings.AUTH_MODE != "jwt":
+        return None
+    return JWTVerifier(
+        secret=settings.AUTH_JWT_SECRET,
+        keys_file=settings.AUTH_JWT_KEYS_FILE,
+        algorithms=settings.AUTH_JWT_ALGORITHMS,
+        audience=settings.AUTH_JWT_AUDIENCE,
+        issuer=settings.AUTH_JWT_ISSUER,
+        leeway=settings.AUTH_JWT_LEEWAY,
+        reload_interval=settings.AUTH_JWT_KEYS_RELOAD,
+    )
+
+
+auth_client = AuthClient(
+    str(settings.AUTH_SERVICE),
+    TokenCache(
+        maxsize=settings.AUTH_CACHE_SIZE,
+        ttl=settings.AUTH_CACHE_TTL,
+        negative_ttl=settings.AUTH_NEGATIVE_CACHE_TTL,
+    ),
+    timeout=settings.AUTH_TIMEOUT,
+    max_connections=settings.AUTH_MAX_CONNECTIONS,
+    verifier=create_verifier(),
+)
+
+
+# Dependency
+def get_auth_client() -> AuthClient:
+    return auth_client
@@ -0,0 +1,97 @@
+"""
+Tracker rows vs habit bitmaps: table size and read latency.
+
+    python benchmarks/bitmap_storage.py --habits 200 --years 3
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import sqlalchemy
+from databases import Database
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bitmaps  # noqa: E402
+from db import metadata  # noqa: E402
+from models import habits  # noqa: E402,F401
+
+
+def seed(path: str, habits_count: int, days: int) -> None:
+    metadata.create_all(sqlalchemy.create_engine(f"sqlite:///{path}"))
+    con = sqlite3.connect(path)
+    today_day = date.today()
+    con.executemany(
+        "INSERT INTO habits(id, user_id, title) VALUES (?, 1, ?)",
+        [(i, f"habit_{i}") for i in range(1, habits_count + 1)],
+    )
+    con.executemany(
+        "INSERT INTO trackers(habit_id, date, status) VALUES (?, ?, ?)",
+        (
+            (i, (today_day - timedelta(days=day)).isoformat(), (i + day) % 3 != 0)
+            for i in range(1, habits_count + 1)
+            for day in range(days)
+        ),
+    )
+    con.commit()
+    con.close()
+
+
+def table_size(path: str, table: str) -> int:
+    con = sqlite3.connect(path)
+    con.execute("VACUUM")
+    size = con.execute(
+        "SELECT SUM(pgsize) FROM dbstat WHERE name = ? OR name IN "
+        "(SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?)",
+        (table, table),
+    ).fetchone()[0]
+    con.close()
+    return size or 0
+
+
+async def read_latency(database: Database, mode: str, habit_ids, days: int) -> float:
+    date_from = date.today() - timedelta(days=days - 1)
+    started = time.perf_counter()
+    for habit_id in habit_ids:
+        if mode == "bitmap":
+            await bitmaps.fetch_trackers(database, [habit_id], date_from, date.max)
+        else:
+            await database.fetch_all(
+                "SELECT * FROM trackers WHERE habit_id = :id AND date >= :date_from",
+                values={"id": habit_id, "date_from": date_from},
+            )
+    return (time.perf_counter() - started) / len(habit_ids) * 1000
+
+
+async def main(habits_count: int, years: int) -> None:
+    days = years * 365
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "habits.db")
+        seed(path, habits_count, days)
+        database = Database(f"sqlite:///{path}")
+        await database.connect()
+        await bitmaps.migrate(database)
+        habit_ids = list(range(1, habits_count + 1))
+        print(f"{habits_count} habits x {days} days")
+        print(
+            f"{'storage':<10}{'size, KiB':>12}{'30d read, ms':>15}{'365d read, ms':>15}"
+        )
+        for mode, table in (("rows", "trackers"), ("bitmap", "habit_bitmaps")):
+            size = table_size(path, table) / 1024
+            month = await read_latency(database, mode, habit_ids, 30)
+            year = await read_latency(database, mode, habit_ids, 365)
+            print(f"{mode:<10}{size:>12.1f}{month:>15.3f}{year:>15.3f}")
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--habits", type=int, default=200)
+    parser.add_argument("--years", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(main(args.habits, args.years))
@@ -0,0 +1,96 @@
+"""
+Habits list serialization: HabitFull models with jsonable_encoder and JSONResponse
+vs plain dicts from the database records with ORJSONResponse.
+
+    python benchmarks/serialization.py --habits 100 --days 30
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import sqlalchemy
+from databases import Database
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import metadata  # noqa: E402
+from models.habits import HabitFull, habit_full  # noqa: E402
+
+
+async def fetch(database: Database, habits_count: int, days: int):
+    today_day = date.today()
+    await database.execute_many(
+        "INSERT INTO habits(id, user_id, title) VALUES (:id, 1, :title)",
+        values=[{"id": i, "title": f"habit_{i}"} for i in range(1, habits_count + 1)],
+    )
+    await database.execute_many(
+        "INSERT INTO trackers(habit_id, date, status) VALUES (:habit_id, :date, :status)",
+        values=[
+            {
+                "habit_id": i,
+                "date": (today_day - timedelta(days=day)).isoformat(),
+                "status": day % 2,
+            }
+            for i in range(1, habits_count + 1)
+            for day in range(days)
+        ],
+    )
+    habits_db = await database.fetch_all("SELECT * FROM habits ORDER BY id")
+    trackers_db = await database.fetch_all(
+        "SELECT id, habit_id, date, status FROM trackers ORDER BY habit_id, date"
+    )
+    habit_trackers: dict = {habit["id"]: [] for habit in habits_db}
+    for tracker in trackers_db:
+        habit_trackers[tracker["habit_id"]].append(tracker)
+    return habits_db, habit_trackers
+
+
+def model_path(habits_db, habit_trackers) -> bytes:
+    output = [
+        HabitFull(**habit, tracker=habit_trackers[habit["id"]]) for habit in habits_db
+    ]
+    return JSONResponse(jsonable_encoder(output)).body
+
+
+def fast_path(habits_db, habit_trackers) -> bytes:
+    output = [habit_full(habit, habit_trackers[habit["id"]]) for habit in habits_db]
+    return ORJSONResponse(output).body
+
+
+def timeit(func, *args, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func(*args)
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+async def main(habits_count: int, days: int, repeat: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "habits.db")
+        metadata.create_all(sqlalchemy.create_engine(f"sqlite:///{path}"))
+        database = Database(f"sqlite:///{path}")
+        await database.connect()
+        habits_db, habit_trackers = await fetch(database, habits_count, days)
+        await database.disconnect()
+    assert model_path(habits_db, habit_trackers) == fast_path(habits_db, habit_trackers)
+    print(f"{habits_count} habits x {days} trackers")
+    print(f"{'path':<10}{'ms per response':>18}")
+    for name, func in (("models", model_path), ("fast", fast_path)):
+        print(
+            f"{name:<10}{timeit(func, habits_db, habit_trackers, repeat=repeat):>18.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--habits", type=int, default=100)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.habits, args.days, args.repeat))
@@ -0,0 +1,153 @@
+"""
+Concurrent writes on one SQLite file: API check-ins next to the recieve.py
+deletion consumer, default sqlite3 connections vs the db.py pragmas.
+
+    python benchmarks/sqlite_load.py --writers 50 --seconds 10
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import httpx
+import sqlalchemy
+from databases import Database
+from fastapi import Header
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import LRUBackend, ResponseCache, get_response_cache  # noqa: E402
+from db import database_options, get_database, metadata  # noqa: E402
+from main import app  # noqa: E402
+from recieve import delete_users  # noqa: E402
+from routers.habits import get_current_user  # noqa: E402
+from shards import ShardRouter, get_shard_router  # noqa: E402
+
+USERS = 20
+HABITS = 5
+LEAVING_USERS = range(1000, 1500)
+
+
+def seed(path: str) -> dict:
+    metadata.create_all(sqlalchemy.create_engine(f"sqlite:///{path}"))
+    con = sqlite3.connect(path)
+    today_day = date.today()
+    user_habits: dict = {}
+    for user_id in [*range(1, USERS + 1), *LEAVING_USERS]:
+        for i in range(HABITS):
+            habit_id = con.execute(
+                "INSERT INTO habits(user_id, title) VALUES (?, ?)",
+                (user_id, f"habit_{i}"),
+            ).lastrowid
+            user_habits.setdefault(user_id, []).append(habit_id)
+            con.executemany(
+                "INSERT INTO trackers(habit_id, date, status) VALUES (?, ?, ?)",
+                [
+                    (habit_id, (today_day - timedelta(days=day)).isoformat(), 1)
+                    for day in range(30)
+                ],
+            )
+    con.commit()
+    con.close()
+    return user_habits
+
+
+async def writer(client, user_habits, deadline, latencies, results) -> None:
+    while time.perf_counter() < deadline:
+        user_id = random.randint(1, USERS)
+        day = date.today() - timedelta(days=random.randint(0, 365))
+        entries = [
+            {"habit_id": habit_id, "date": str(day), "status": random.randint(0, 1)}
+            for habit_id in user_habits[user_id]
+        ]
+        started = time.perf_counter()
+        r = await client.put(
+            "/habits/trackers",
+            json={"trackers": entries},
+            headers={"X-User": str(user_id)},
+        )
+        latencies.append(time.perf_counter() - started)
+        results[r.status_code] = results.get(r.status_code, 0) + 1
+
+
+async def consumer(database, deadline, deleted) -> None:
+    leaving = list(LEAVING_USERS)
+    while leaving and time.perf_counter() < deadline:
+        batch, leaving = leaving[:10], leaving[10:]
+        try:
+            await delete_users(database, batch)
+            deleted["users"] += len(batch)
+        except sqlite3.OperationalError:
+            deleted["errors"] += 1
+        await asyncio.sleep(0.05)
+
+
+async def run(mode: str, writers: int, seconds: float) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "habits.db")
+        user_habits = seed(path)
+        url = f"sqlite:///{path}"
+        options = database_options(url) if mode == "tuned" else {}
+        api_database = Database(url, **options)
+        consumer_database = Database(url, **options)
+        await api_database.connect()
+        await consumer_database.connect()
+
+        def current_user(x_user: int = Header(...)) -> dict:
+            return {"id": x_user}
+
+        app.dependency_overrides[get_database] = lambda: api_database
+        shards = ShardRouter([api_database])
+        app.dependency_overrides[get_shard_router] = lambda: shards
+        app.dependency_overrides[get_current_user] = current_user
+        cache = ResponseCache(LRUBackend(maxsize=1000), ttl=60)
+        app.dependency_overrides[get_response_cache] = lambda: cache
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        latencies: list = []
+        results: dict = {}
+        deleted = {"users": 0, "errors": 0}
+        deadline = time.perf_counter() + seconds
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+            await asyncio.gather(
+                consumer(consumer_database, deadline, deleted),
+                *(
+                    writer(c, user_habits, deadline, latencies, results)
+                    for _ in range(writers)
+                ),
+            )
+        app.dependency_overrides.clear()
+        await api_database.disconnect()
+        await consumer_database.disconnect()
+    ok = results.get(200, 0)
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(
+        f"{mode:<8}{ok / seconds:>12.1f}{len(latencies) - ok:>9}"
+        f"{quantiles[49] * 1000:>10.1f}{quantiles[98] * 1000:>10.1f}"
+        f"{deleted['users']:>10}{deleted['errors']:>9}"
+    )
+
+
+async def main(writers: int, seconds: float) -> None:
+    print(f"{writers} API writers + deletion consumer, {seconds:g} s")
+    print(
+        f"{'mode':<8}{'writes/s':>12}{'errors':>9}{'p50, ms':>10}{'p99, ms':>10}"
+        f"{'deleted':>10}{'failed':>9}"
+    )
+    for mode in ("default", "tuned"):
+        await run(mode, writers, seconds)
+
+
+if __name__ == "__main__":
+    logging.disable(logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+    asyncio.run(main(args.writers, args.seconds))
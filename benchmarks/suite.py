@@ -0,0 +1,431 @@
+"""
+Every habits route driven in-process by concurrent clients, on a seeded SQLite
+database, with a local stand-in for the auth service check-token endpoint.
+Reports p50/p99 latency, throughput and database queries per request, and
+writes them as JSON to diff across commits.
+
+    python benchmarks/suite.py --users 20 --habits 20 --days 730 --output before.json
+    python benchmarks/suite.py --output after.json --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+import sqlalchemy
+from fastapi import FastAPI, Header, HTTPException
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics  # noqa: E402
+import stats  # noqa: E402
+from auth import AuthClient, TokenCache, get_auth_client  # noqa: E402
+from cache import LRUBackend, ResponseCache, get_response_cache  # noqa: E402
+from db import create_database, get_database, metadata  # noqa: E402
+from main import app  # noqa: E402
+from shards import ShardRouter, get_shard_router  # noqa: E402
+
+
+def auth_stub(latency: float = 0) -> FastAPI:
+    """
+    Auth service stand-in, "Bearer user-<id>" is the token of user <id>
+    """
+    stub = FastAPI()
+    stub.state.calls = 0
+
+    @stub.post("/users/check-token")
+    async def check_token(authorization: str = Header("")) -> dict:
+        stub.state.calls += 1
+        await asyncio.sleep(latency)
+        prefix = "Bearer user-"
+        if not authorization.startswith(prefix):
+            raise HTTPException(status_code=401)
+        user_id = int(authorization[len(prefix) :])
+        return {
+            "id": user_id,
+            "email": f"user{user_id}@example.com",
+            "username": f"user{user_id}",
+        }
+
+    return stub
+
+
+def seed(
+    path: str, users: int, habits: int, days: int, spare: int, rng: random.Random
+) -> dict:
+    """
+    users with habits each and days of trackers per habit, plus spare habits
+    for the delete route. Returns user id -> habit, tracker and spare habit ids
+    """
+    metadata.create_all(sqlalchemy.create_engine(f"sqlite:///{path}"))
+    con = sqlite3.connect(path)
+    today_day = date.today()
+    seeded: dict = {}
+    for user_id in range(1, users + 1):
+        user: Dict[str, list] = {"habits": [], "trackers": [], "spare": []}
+        for i in range(habits + spare):
+            habit_id = con.execute(
+                "INSERT INTO habits(user_id, title, description) VALUES (?, ?, ?)",
+                (user_id, f"habit_{i}", f"description_{i}"),
+            ).lastrowid
+            user["habits" if i < habits else "spare"].append(habit_id)
+            con.executemany(
+                "INSERT INTO trackers(habit_id, date, status) VALUES (?, ?, ?)",
+                [
+                    (
+                        habit_id,
+                        (today_day - timedelta(days=day)).isoformat(),
+                        int(rng.random() < 0.7),
+                    )
+                    for day in range(days if i < habits else 1)
+                ],
+            )
+        user["trackers"] = [
+            row[0]
+            for row in con.execute(
+                "SELECT id FROM trackers WHERE habit_id = ? LIMIT 100",
+                (user["habits"][0],),
+            )
+        ]
+        seeded[user_id] = user
+    con.commit()
+    con.close()
+    return seeded
+
+
+Request = Tuple[str, str, dict]
+
+
+def scenarios(seeded: dict, rng: random.Random) -> Dict[str, Callable[[], Request]]:
+    """
+    Route name -> factory of (method, url, httpx request kwargs) for a random user
+    """
+    today_day = date.today()
+
+    def user() -> Tuple[int, dict]:
+        user_id = rng.choice(list(seeded))
+        return user_id, seeded[user_id]
+
+    def request(method: str, url: str, user_id: int, **kwargs: Any) -> Request:
+        kwargs["headers"] = {"Authorization": f"Bearer user-{user_id}"}
+        return method, url, kwargs
+
+    def habit_get() -> Request:
+        user_id, data = user()
+        return request("GET", f"/habits/habit/{rng.choice(data['habits'])}", user_id)
+
+    def habits_list() -> Request:
+        return request("GET", "/habits/list", user()[0])
+
+    def trackers_range() -> Request:
+        user_id, data = user()
+        date_from = today_day - timedelta(days=rng.randint(30, 365))
+        return request(
+            "GET",
+            "/habits/trackers",
+            user_id,
+            params={"habit_id": rng.choice(data["habits"]), "from": str(date_from)},
+        )
+
+    def habits_stats() -> Request:
+        return request("GET", "/habits/stats", user()[0])
+
+    def habits_summary() -> Request:
+        return request("GET", "/habits/summary", user()[0])
+
+    def habits_export() -> Request:
+        return request("GET", "/habits/export", user()[0])
+
+    def habit_create() -> Request:
+        return request("POST", "/habits/habit", user()[0], json={"title": "new"})
+
+    def habits_create() -> Request:
+        habits = [{"title": f"new_{i}"} for i in range(10)]
+        return request("POST", "/habits/habits", user()[0], json={"habits": habits})
+
+    def habit_update() -> Request:
+        user_id, data = user()
+        return request(
+            "PUT",
+            f"/habits/habit/{rng.choice(data['habits'])}",
+            user_id,
+            json={"title": "updated", "description": "updated"},
+        )
+
+    def tracker_update() -> Request:
+        user_id, data = user()
+        tracker_id = rng.choice(data["trackers"])
+        url = f"/habits/tracker/{tracker_id}/{rng.randint(0, 1)}"
+        return request("PUT", url, user_id)
+
+    def trackers_check_in() -> Request:
+        user_id, data = user()
+        day = today_day - timedelta(days=rng.randint(0, 30))
+        entries = [
+            {"habit_id": habit_id, "date": str(day), "status": rng.randint(0, 1)}
+            for habit_id in data["habits"]
+        ]
+        return request("PUT", "/habits/trackers", user_id, json={"trackers": entries})
+
+    def habit_delete() -> Request:
+        user_id = rng.choice([key for key, data in seeded.items() if data["spare"]])
+        habit_id = seeded[user_id]["spare"].pop()
+        return request("DELETE", f"/habits/habit/{habit_id}", user_id)
+
+    def habits_import() -> Request:
+        rows = [
+            {
+                "title": "imported",
+                "date": str(today_day - timedelta(days=day)),
+                "status": day % 2,
+            }
+            for day in range(100)
+        ]
+        content = "\n".join(json.dumps(row) for row in rows).encode()
+        return request("POST", "/habits/import", user()[0], content=content)
+
+    return {
+        "GET /habits/habit/{id}": habit_get,
+        "GET /habits/list": habits_list,
+        "GET /habits/trackers": trackers_range,
+        "GET /habits/stats": habits_stats,
+        "GET /habits/summary": habits_summary,
+        "GET /habits/export": habits_export,
+        "POST /habits/habit": habit_create,
+        "POST /habits/habits": habits_create,
+        "PUT /habits/habit/{id}": habit_update,
+        "PUT /habits/tracker/{tracker_id}/{status}": tracker_update,
+        "PUT /habits/trackers": trackers_check_in,
+        "DELETE /habits/habit/{id}": habit_delete,
+        "POST /habits/import": habits_import,
+    }
+
+
+async def drive(
+    client: httpx.AsyncClient,
+    make_request: Callable[[], Request],
+    requests: int,
+    concurrency: int,
+) -> Tuple[List[float], Dict[int, int], float]:
+    """
+    requests issued by concurrency clients, returns latencies, status counts
+    and the wall time
+    """
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    remaining = [requests]
+
+    async def worker() -> None:
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            method, url, kwargs = make_request()
+            started = time.perf_counter()
+            r = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - started)
+            statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, statuses, time.perf_counter() - started
+
+
+def summary(
+    latencies: List[float], statuses: Dict[int, int], seconds: float, queries: float
+) -> dict:
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else []
+    ok = sum(count for code, count in statuses.items() if code < 400)
+    return {
+        "requests": len(latencies),
+        "errors": len(latencies) - ok,
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "requests_per_second": round(len(latencies) / seconds, 1),
+        "p50_ms": round(quantiles[49] * 1000, 2) if quantiles else None,
+        "p99_ms": round(quantiles[98] * 1000, 2) if quantiles else None,
+        "queries_per_request": round(queries, 2),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(
+    users: int = 20,
+    habits: int = 20,
+    days: int = 730,
+    requests: int = 500,
+    concurrency: int = 20,
+    auth_latency: float = 0.002,
+    only: Optional[List[str]] = None,
+    seed_value: int = 0,
+    progress: Callable[[str, dict], Any] = lambda name, result: None,
+) -> dict:
+    """
+    Seed a fresh database and drive every route, returns the report
+    """
+    rng = random.Random(seed_value)
+    report: dict = {
+        "commit": git_commit(),
+        "config": {
+            "users": users,
+            "habits": habits,
+            "days": days,
+            "requests": requests,
+            "concurrency": concurrency,
+            "auth_latency": auth_latency,
+            "seed": seed_value,
+        },
+        "routes": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "habits.db")
+        started = time.perf_counter()
+        seeded = seed(path, users, habits, days, requests // users + 1, rng)
+        url = f"sqlite:///{path}"
+        # databases keeps the connection in a context variable, one used here
+        # would be inherited and shared by every client task
+        seed_database = create_database(url)
+        await seed_database.connect()
+        await stats.rebuild_habit_stats(seed_database)
+        await seed_database.disconnect()
+        report["seed_seconds"] = round(time.perf_counter() - started, 2)
+
+        database = metrics.InstrumentedDatabase(create_database(url))
+        await database.connect()
+
+        stub = auth_stub(auth_latency)
+        auth_client = AuthClient(
+            "http://auth",
+            TokenCache(maxsize=10000, ttl=60, negative_ttl=10),
+            transport=httpx.ASGITransport(app=stub),
+        )
+        cache = ResponseCache(LRUBackend(maxsize=10000), ttl=60)
+        app.dependency_overrides[get_database] = lambda: database
+        shards = ShardRouter([database])  # type: ignore
+        app.dependency_overrides[get_shard_router] = lambda: shards
+        app.dependency_overrides[get_auth_client] = lambda: auth_client
+        app.dependency_overrides[get_response_cache] = lambda: cache
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        try:
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://test", timeout=60
+            ) as client:
+                for name, make_request in scenarios(seeded, rng).items():
+                    if only and not any(part in name for part in only):
+                        continue
+                    method, route = name.split(" ", 1)
+                    queries_before = metrics.request_queries.totals(method, route)
+                    hits, misses = cache.hits, cache.misses
+                    latencies, statuses, seconds = await drive(
+                        client, make_request, requests, concurrency
+                    )
+                    queries_sum, queries_count = metrics.request_queries.totals(
+                        method, route
+                    )
+                    result = summary(
+                        latencies,
+                        statuses,
+                        seconds,
+                        (queries_sum - queries_before[0])
+                        / max(queries_count - queries_before[1], 1),
+                    )
+                    result["cache_hits"] = cache.hits - hits
+                    result["cache_misses"] = cache.misses - misses
+                    report["routes"][name] = result
+                    progress(name, result)
+        finally:
+            app.dependency_overrides.clear()
+            await auth_client.close()
+            await database.disconnect()
+        report["auth_calls"] = stub.state.calls
+    return report
+
+
+def compare(report: dict, baseline: dict) -> None:
+    print(f"\nvs {baseline.get('commit') or 'baseline'}")
+    if baseline.get("config") != report["config"]:
+        print(f"config differs: {baseline.get('config')}")
+    print(f"{'route':<44}{'p50':>10}{'p99':>10}{'req/s':>10}{'queries':>10}")
+    for name, result in report["routes"].items():
+        before = baseline.get("routes", {}).get(name)
+        if before is None:
+            continue
+        changes = []
+        for key in ("p50_ms", "p99_ms", "requests_per_second"):
+            if result[key] is None or not before[key]:
+                changes.append(f"{'-':>10}")
+            else:
+                changes.append(f"{(result[key] / before[key] - 1) * 100:>+9.1f}%")
+        queries = result["queries_per_request"] - before["queries_per_request"]
+        print(f"{name:<44}{''.join(changes)}{queries:>+10.2f}")
+
+
+def print_result(name: str, result: dict) -> None:
+    print(
+        f"{name:<44}{result['p50_ms'] or 0:>10.2f}{result['p99_ms'] or 0:>10.2f}"
+        f"{result['requests_per_second']:>10.1f}"
+        f"{result['queries_per_request']:>10.2f}{result['errors']:>8}"
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    print(
+        f"{args.users} users x {args.habits} habits x {args.days} days, "
+        f"{args.requests} requests per route, {args.concurrency} clients"
+    )
+    print(
+        f"{'route':<44}{'p50, ms':>10}{'p99, ms':>10}{'req/s':>10}"
+        f"{'queries':>10}{'errors':>8}"
+    )
+    report = await run(
+        users=args.users,
+        habits=args.habits,
+        days=args.days,
+        requests=args.requests,
+        concurrency=args.concurrency,
+        auth_latency=args.auth_latency / 1000,
+        only=args.only,
+        seed_value=args.seed,
+        progress=print_result,
+    )
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"report written to {args.output}")
+    if args.compare:
+        with open(args.compare) as file:
+            compare(report, json.load(file))
+
+
+if __name__ == "__main__":
+    logging.disable(logging.WARNING)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--habits", type=int, default=20)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--auth-latency", type=float, default=2, help="ms")
+    parser.add_argument("--only", nargs="*", help="routes containing any of these")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", help="previous report to diff against")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,183 @@
+"""
+Compact tracker storage: one bitmap per habit per year, bit N is day N of the year.
+
+    python bitmaps.py migrate    # pack existing trackers rows into habit_bitmaps
+"""
+import asyncio
+import sys
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Tuple
+
+from databases import Database
+
+from shards import get_shard_router
+
+
+YEAR_BYTES = 46  # 366 days
+
+
+def day_index(day: date) -> int:
+    return day.timetuple().tm_yday - 1
+
+
+def set_bit(bits: bytes, index: int, value: int) -> bytes:
+    buffer = bytearray(bits.ljust(YEAR_BYTES, b"\0"))
+    if value:
+        buffer[index // 8] |= 1 << (index % 8)
+    else:
+        buffer[index // 8] &= ~(1 << (index % 8)) & 0xFF
+    return bytes(buffer)
+
+
+def done_days(year: int, bits: bytes) -> List[date]:
+    """
+    Days of the year whose bit is set, in order
+    """
+    value = int.from_bytes(bits, "little")
+    first_day = date(year, 1, 1)
+    days = []
+    while value:
+        days.append(first_day + timedelta(days=(value & -value).bit_length() - 1))
+        value &= value - 1
+    return days
+
+
+def decode(
+    habit_id: int, years: Dict[int, bytes], date_from: date, date_to: date
+) -> List[dict]:
+    """
+    Every day of the window as a TrackerBase shaped dict
+    """
+    values = {year: int.from_bytes(bits, "little") for year, bits in years.items()}
+    trackers = []
+    day = date_from
+    while day <= date_to:
+        value = values.get(day.year, 0)
+        trackers.append(
+            {
+                "habit_id": habit_id,
+                "date": day.isoformat(),
+                "status": (value >> day_index(day)) & 1,
+            }
+        )
+        day += timedelta(days=1)
+    return trackers
+
+
+def _in_clause(prefix: str, items: Iterable) -> Tuple[str, dict]:
+    values = {f"{prefix}_{i}": item for i, item in enumerate(items)}
+    return ", ".join(f":{key}" for key in values), values
+
+
+async def fetch_trackers(
+    database: Database, habit_ids: List[int], date_from: date, date_to: date
+) -> Dict[int, List[dict]]:
+    """
+    Decoded trackers of many habits for a date window, one query
+    """
+    date_to = min(date_to, date.today())
+    habit_ids_in, values = _in_clause("habit_id", habit_ids)
+    query = f"""
+        SELECT habit_id, year, bits FROM habit_bitmaps
+        WHERE habit_id IN ({habit_ids_in}) AND year >= :year_from AND year <= :year_to
+        """
+    values.update({"year_from": date_from.year, "year_to": date_to.year})
+    bitmaps_db = await database.fetch_all(query=query, values=values)
+    years: Dict[int, Dict[int, bytes]] = {habit_id: {} for habit_id in habit_ids}
+    for bitmap in bitmaps_db:
+        years[bitmap["habit_id"]][bitmap["year"]] = bytes(bitmap["bits"])
+    return {
+        habit_id: decode(habit_id, habit_years, date_from, date_to)
+        for habit_id, habit_years in years.items()
+    }
+
+
+async def set_statuses(
+    database: Database, entries: Dict[Tuple[int, date], int]
+) -> List[dict]:
+    """
+    Flip the bits of (habit_id, date) entries, call inside a transaction
+    """
+    keys = sorted({(habit_id, day.year) for habit_id, day in entries})
+    keys_in = " OR ".join(
+        f"(habit_id = :habit_id_{i} AND year = :year_{i})" for i in range(len(keys))
+    )
+    values: dict = {}
+    for i, (habit_id, year) in enumerate(keys):
+        values.update({f"habit_id_{i}": habit_id, f"year_{i}": year})
+    query = f"SELECT habit_id, year, bits FROM habit_bitmaps WHERE {keys_in}"
+    if database.url.dialect == "postgresql":
+        query += " FOR UPDATE"
+    bitmaps_db = await database.fetch_all(query=query, values=values)
+    bitmaps = {key: b"" for key in keys}
+    bitmaps.update(
+        {(row["habit_id"], row["year"]): bytes(row["bits"]) for row in bitmaps_db}
+    )
+    for (habit_id, day), status in entries.items():
+        key = (habit_id, day.year)
+        bitmaps[key] = set_bit(bitmaps[key], day_index(day), status)
+    rows = []
+    for i, key in enumerate(keys):
+        rows.append(f"(:habit_id_{i}, :year_{i}, :bits_{i})")
+        values[f"bits_{i}"] = bitmaps[key]
+    query = """
+        INSERT INTO habit_bitmaps(habit_id, year, bits) VALUES {}
+        ON CONFLICT (habit_id, year) DO UPDATE SET bits = excluded.bits
+        """.format(
+        ", ".join(rows)
+    )
+    await database.execute(query=query, values=values)
+    return [
+        {"habit_id": habit_id, "date": day.isoformat(), "status": status}
+        for (habit_id, day), status in entries.items()
+    ]
+
+
+async def migrate(database: Database, batch_size: int = 100) -> int:
+    """
+    Pack trackers rows into habit_bitmaps, batch_size habits per transaction,
+    returns the number of habits migrated
+    """
+    migrated = 0
+    last_id = 0
+    while True:
+        query = "SELECT id FROM habits WHERE id > :after ORDER BY id LIMIT :limit"
+        habits_db = await database.fetch_all(
+            query=query, values={"after": last_id, "limit": batch_size}
+        )
+        if not habits_db:
+            return migrated
+        query = """
+            SELECT habit_id, date FROM trackers
+            WHERE habit_id IN (SELECT id FROM habits WHERE id > :after AND id <= :last_id)
+            AND status = 1
+            """
+        trackers_db = await database.fetch_all(
+            query=query, values={"after": last_id, "last_id": habits_db[-1]["id"]}
+        )
+        entries = {}
+        for tracker in trackers_db:
+            day = tracker["date"]
+            if isinstance(day, str):
+                day = date.fromisoformat(day)
+            entries[(tracker["habit_id"], day)] = 1
+        if entries:
+            async with database.transaction():
+                await set_statuses(database, entries)
+        migrated += len(habits_db)
+        last_id = habits_db[-1]["id"]
+
+
+async def main(command: str) -> None:
+    shards = get_shard_router()
+    await shards.connect()
+    try:
+        if command == "migrate":
+            for shard, database in enumerate(shards.databases):
+                print(f"Habits migrated on shard {shard}: {await migrate(database)}")
+    finally:
+        await shards.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "migrate"))
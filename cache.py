@@ -0,0 +1,177 @@
+import hashlib
+import json
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fastapi.responses import ORJSONResponse, Response
+
+from settings import Settings
+
+
+settings = Settings()
+
+
+class LRUBackend:
+    """
+    In-process cache backend with TTL and LRU eviction
+    """
+
+    def __init__(self, maxsize: int, timer: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        # Counters restart with the process, ETags must not repeat across restarts
+        self.instance = uuid.uuid4().hex
+        self._timer = timer
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._counters: Dict[str, int] = {}
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= self._timer():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._entries[key] = (self._timer() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def incr(self, key: str) -> int:
+        self._counters[key] = self._counters.get(key, 0) + 1
+        return self._counters[key]
+
+    async def get_counter(self, key: str) -> int:
+        return self._counters.get(key, 0)
+
+
+class RedisBackend:
+    """
+    Cache backend over a Redis-compatible asyncio client (redis.asyncio API)
+    """
+
+    def __init__(self, client: Any) -> None:
+        self.client = client
+        self.instance = "redis"
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await self.client.set(key, value, ex=int(ttl))
+
+    async def incr(self, key: str) -> int:
+        return await self.client.incr(key)
+
+    async def get_counter(self, key: str) -> int:
+        return int(await self.client.get(key) or 0)
+
+
+class ResponseCache:
+    """
+    Per-user read-through cache of serialized JSON responses.
+    Entries are stored under the user's epoch, every write of a user bumps it
+    so older entries, even ones stored after the bump, are never read again
+    and expire with their TTL. Writes are remembered for write_window seconds,
+    see written_recently.
+    """
+
+    def __init__(self, backend: Any, ttl: float, write_window: float = 0) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self.write_window = write_window
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(user_id: int, *parts: Any) -> str:
+        return ":".join(["habits", str(user_id), *map(str, parts)])
+
+    async def get(self, key: str, epoch: int) -> Optional[Response]:
+        value = await self.backend.get(f"{key}@{epoch}")
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        headers, _, body = bytes(value).partition(b"\n")
+        return Response(
+            content=body, headers=json.loads(headers), media_type="application/json"
+        )
+
+    async def epoch(self, user_id: int) -> int:
+        return await self.backend.get_counter(self.key(user_id, "epoch"))
+
+    def etag(self, key: str, epoch: int) -> str:
+        """
+        Weak ETag of the response under key while the user's epoch holds
+        """
+        digest = hashlib.sha1(f"{self.backend.instance}:{epoch}:{key}".encode())
+        return f'W/"{digest.hexdigest()[:20]}"'
+
+    async def set(
+        self,
+        key: str,
+        epoch: int,
+        content: Any,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Response:
+        """
+        Serialize content of plain dicts and lists as a JSON response,
+        cache it under the epoch read before computing it
+        """
+        response = ORJSONResponse(content, headers=headers)
+        value = json.dumps(headers or {}).encode() + b"\n" + response.body
+        await self.backend.set(f"{key}@{epoch}", value, self.ttl)
+        return response
+
+    async def invalidate(self, user_id: int) -> None:
+        await self.backend.incr(self.key(user_id, "epoch"))
+        if self.write_window:
+            await self.backend.set(
+                self.key(user_id, "written"), b"1", self.write_window
+            )
+
+    async def written_recently(self, user_id: int) -> bool:
+        """
+        The user wrote in the last write_window seconds, a lagging replica
+        may not have the write yet
+        """
+        return await self.backend.get(self.key(user_id, "written")) is not None
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def etag_matches(etag: str, if_none_match: Optional[str]) -> bool:
+    """
+    If-None-Match holds etag, weakly compared. "*" is not a match, it would
+    answer 304 before the handler knows the resource exists
+    """
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in tags or etag[2:] in tags
+
+
+def create_backend() -> Any:
+    if settings.CACHE_BACKEND == "redis":
+        import redis.asyncio as redis  # optional dependency
+
+        return RedisBackend(redis.from_url(settings.CACHE_URL))
+    return LRUBackend(settings.CACHE_SIZE)
+
+
+response_cache = ResponseCache(
+    create_backend(), settings.CACHE_TTL, settings.REPLICA_MAX_LAG
+)
+
+
+# Dependency
+def get_response_cache() -> ResponseCache:
+    return response_cache
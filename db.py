@@ -1,17 +1,172 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from typing import Callable, Dict, List
+
 import sqlalchemy
-from databases import Database
+from databases import Database, DatabaseURL
+
+from metrics import InstrumentedDatabase
 from settings import Settings
 
 
 settings = Settings()
+logger = logging.getLogger("habits.db")
+
+
+def sqlite_connection_factory() -> type:
+    """
+    sqlite3 connection class applying the SQLITE_* pragmas on connect,
+    transactions opened as BEGIN IMMEDIATE
+    """
+    pragmas = [
+        f"PRAGMA journal_mode = {settings.SQLITE_JOURNAL_MODE}",
+        f"PRAGMA synchronous = {settings.SQLITE_SYNCHRONOUS}",
+        f"PRAGMA mmap_size = {settings.SQLITE_MMAP_SIZE}",
+        # Off by default in SQLite, needed for ON DELETE CASCADE
+        f"PRAGMA foreign_keys = {'ON' if settings.SQLITE_FOREIGN_KEYS else 'OFF'}",
+    ]
+
+    class SQLiteConnection(sqlite3.Connection):
+        def __init__(self, *args, **kwargs) -> None:
+            super().__init__(*args, **kwargs)
+            for pragma in pragmas:
+                self.execute(pragma)
+
+        def execute(self, sql: str, *args):
+            # A deferred transaction upgrading to a write lock under WAL fails
+            # with SQLITE_BUSY without waiting, take the write lock up front
+            if sql == "BEGIN":
+                try:
+                    return super().execute("BEGIN IMMEDIATE", *args)
+                except sqlite3.OperationalError:
+                    # Still locked after the busy timeout. databases leaks the
+                    # connection when BEGIN raises, let the first write fail instead
+                    pass
+            return super().execute(sql, *args)
+
+    return SQLiteConnection
+
+
+def database_options(url: str) -> dict:
+    """
+    Connection options of the databases backend for url:
+    asyncpg pool settings or sqlite3.connect arguments
+    """
+    if url.startswith("sqlite"):
+        # timeout is the busy timeout, seconds to wait for a locked database
+        return {
+            "timeout": settings.SQLITE_BUSY_TIMEOUT,
+            "factory": sqlite_connection_factory(),
+        }
+    if url.startswith("postgres"):
+        return {
+            "min_size": settings.DB_POOL_MIN_SIZE,
+            "max_size": settings.DB_POOL_MAX_SIZE,
+            "timeout": settings.DB_CONNECT_TIMEOUT,
+            "command_timeout": settings.DB_COMMAND_TIMEOUT,
+            "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+        }
+    return {}
+
+
+def database_url(url: str) -> str:
+    """
+    url with the "postgres" alias spelled "postgresql", the dialect name
+    queries and stats compile for is database.url.dialect
+    """
+    parsed = DatabaseURL(url)
+    if parsed.dialect == "postgres":
+        return str(parsed.replace(dialect="postgresql"))
+    return url
+
+
+def create_database(url: str) -> Database:
+    url = database_url(url)
+    return Database(url, **database_options(url))
+
+
+def create_engine(url: str) -> sqlalchemy.engine.Engine:
+    url = database_url(url)
+    return sqlalchemy.create_engine(
+        url, connect_args=database_options(url) if url.startswith("sqlite") else {}
+    )
+
+
+class ReplicaPool:
+    """
+    Primary database with read replicas picked round-robin, replicas failing
+    the SELECT 1 health check are skipped until the next check, reads go to
+    the primary when no replica is healthy
+    """
+
+    def __init__(
+        self,
+        primary: Database,
+        replicas: List[Database],
+        interval: float = 5,
+        timeout: float = 1,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.primary = primary
+        self.replicas = replicas
+        self.interval = interval
+        self.timeout = timeout
+        self._timer = timer
+        self._next = 0
+        self._healthy: Dict[int, bool] = {}
+        self._checked_at: Dict[int, float] = {}
+
+    async def connect(self) -> None:
+        await self.primary.connect()
+        for index in range(len(self.replicas)):
+            # A replica down at startup is retried by the health check
+            await self.healthy(index)
+
+    async def disconnect(self) -> None:
+        await self.primary.disconnect()
+        for replica in self.replicas:
+            if replica.is_connected:
+                await replica.disconnect()
+
+    async def check(self, index: int) -> bool:
+        replica = self.replicas[index]
+        try:
+            if not replica.is_connected:
+                await asyncio.wait_for(replica.connect(), self.timeout)
+            await asyncio.wait_for(replica.fetch_val("SELECT 1"), self.timeout)
+        except Exception as error:
+            if self._healthy.get(index, True):
+                logger.warning("Replica %s unhealthy: %r", replica.url, error)
+            return False
+        if not self._healthy.get(index, True):
+            logger.info("Replica %s healthy", replica.url)
+        return True
+
+    async def healthy(self, index: int) -> bool:
+        checked_at = self._checked_at.get(index)
+        if checked_at is None or self._timer() - checked_at >= self.interval:
+            self._checked_at[index] = self._timer()
+            self._healthy[index] = await self.check(index)
+        return self._healthy[index]
+
+    async def read(self) -> Database:
+        for attempt in range(len(self.replicas)):
+            index = (self._next + attempt) % len(self.replicas)
+            if await self.healthy(index):
+                self._next = index + 1
+                return self.replicas[index]
+        return self.primary
 
 
-DATABASE_URL = str(settings.database_habits)
-database = Database(DATABASE_URL)
-sqlalchemy_engine = sqlalchemy.create_engine(DATABASE_URL)
+# The first shard when sharded, see shards.py
+DATABASE_URL = (settings.DATABASE_SHARDS or [str(settings.database_habits)])[0]
+database = InstrumentedDatabase(create_database(DATABASE_URL))
+sqlalchemy_engine = create_engine(DATABASE_URL)
 
 metadata = sqlalchemy.MetaData()
 
 # Dependency
 def get_database() -> Database:
-    return database
\ No newline at end of file
+    return database  # type: ignore
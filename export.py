@@ -0,0 +1,84 @@
+"""
+Streaming export of a user's habits and trackers, straight from the database cursor.
+"""
+import csv
+import io
+import json
+from datetime import date, timedelta
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from databases import Database
+
+
+EXPORT_COLUMNS = ("habit_id", "title", "description", "date", "status")
+
+
+async def export_rows(
+    database: Database,
+    user_id: int,
+    storage: str = "rows",
+    check: Optional[Callable[[], Awaitable[None]]] = None,
+) -> AsyncIterator[dict]:
+    """
+    One dict per tracker, habits without trackers once with empty date and status.
+    check is awaited after the last row and raises to fail the export
+    """
+    if storage == "bitmap":
+        query = """
+            SELECT h.id AS habit_id, h.title, h.description, b.year, b.bits
+            FROM habits h LEFT JOIN habit_bitmaps b ON b.habit_id = h.id
+            WHERE h.user_id = :user_id AND h.deleted_at IS NULL ORDER BY h.id, b.year
+            """
+        async for row in database.iterate(query=query, values={"user_id": user_id}):
+            habit = {key: row[key] for key in ("habit_id", "title", "description")}
+            if row["bits"] is None:
+                yield {**habit, "date": None, "status": None}
+                continue
+            value = int.from_bytes(bytes(row["bits"]), "little")
+            first_day = date(row["year"], 1, 1)
+            while value:
+                index = (value & -value).bit_length() - 1
+                day = first_day + timedelta(days=index)
+                yield {**habit, "date": day.isoformat(), "status": 1}
+                value &= value - 1
+    else:
+        query = """
+            SELECT h.id AS habit_id, h.title, h.description, t.date, t.status
+            FROM habits h LEFT JOIN trackers t ON t.habit_id = h.id
+            WHERE h.user_id = :user_id AND h.deleted_at IS NULL ORDER BY h.id, t.date
+            """
+        async for row in database.iterate(query=query, values={"user_id": user_id}):
+            yield {key: row[key] for key in EXPORT_COLUMNS}
+    if check is not None:
+        await check()
+
+
+async def encode_ndjson(
+    rows: AsyncIterator[dict], chunk_rows: int = 500
+) -> AsyncIterator[bytes]:
+    lines = []
+    async for row in rows:
+        lines.append(json.dumps(row, default=str))
+        if len(lines) >= chunk_rows:
+            yield ("\n".join(lines) + "\n").encode()
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode()
+
+
+async def encode_csv(
+    rows: AsyncIterator[dict], chunk_rows: int = 500
+) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+    count = 0
+    async for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % chunk_rows == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
@@ -0,0 +1,322 @@
+"""
+Bulk import of tracker history from a streamed NDJSON or CSV file.
+
+Rows are {"title", "description", "date", "status"}, the export format works as is.
+Habits are matched by title and created when missing, a row without date creates
+the habit only. Trackers are upserted by (habit_id, date), the last row wins, so an
+interrupted import can be run again. An import of a user that rebalance.py starts
+moving stops before its next chunk. The import invalidates the user's cached
+responses in the cache the API workers share, it needs CACHE_BACKEND=redis.
+
+    python importer.py <user_id> <path> [ndjson|csv]
+"""
+import asyncio
+import codecs
+import csv
+import io
+import json
+import sys
+import time
+from datetime import date
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from databases import Database
+from pydantic import ValidationError
+
+import bitmaps
+import queries
+from cache import get_response_cache
+import stats
+from shards import get_shard_router
+from models.habits import TrackerImport, latest_checkin_day
+
+
+CHUNK_ROWS = 5000
+# Rows per executemany call and per bitmap upsert statement
+BATCH_ROWS = 1000
+MAX_ERRORS = 20
+
+
+def _json_row(line: str):
+    try:
+        return json.loads(line)
+    except ValueError:
+        # Reported as an invalid row by validate
+        return line
+
+
+async def parse_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[dict]:
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    tail = ""
+    async for chunk in chunks:
+        lines = (tail + decoder.decode(chunk)).split("\n")
+        tail = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield _json_row(line)
+    tail += decoder.decode(b"", final=True)
+    if tail.strip():
+        yield _json_row(tail)
+
+
+async def parse_csv(chunks: AsyncIterator[bytes]) -> AsyncIterator[dict]:
+    """
+    CSV rows with a header line, empty fields are left out
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    header: Optional[List[str]] = None
+    tail = ""
+    final = False
+    chunks_iter = chunks.__aiter__()
+    while not final:
+        try:
+            text = tail + decoder.decode(await chunks_iter.__anext__())
+        except StopAsyncIteration:
+            text = tail + decoder.decode(b"", final=True)
+            final = True
+        # Cut after the last line ending outside of a quoted field
+        cut = 0
+        position = 0
+        quotes = 0
+        for line in text.splitlines(keepends=True):
+            position += len(line)
+            quotes += line.count('"')
+            if quotes % 2 == 0 and line.endswith(("\n", "\r")):
+                cut = position
+        if final:
+            cut = len(text)
+        text, tail = text[:cut], text[cut:]
+        for row in csv.reader(io.StringIO(text, newline="")):
+            if header is None:
+                header = row
+            elif row:
+                yield {key: value for key, value in zip(header, row) if value != ""}
+
+
+def _fast_row(row) -> Optional[TrackerImport]:
+    """
+    Well-formed rows without a pydantic validation pass, None for anything else
+    """
+    try:
+        title = row["title"]
+        status = int(row.get("status", 0))
+        day = row.get("date")
+        if day is not None:
+            day = date.fromisoformat(day)
+            # Left to TrackerImport to report
+            if day > latest_checkin_day():
+                return None
+    except (TypeError, KeyError, ValueError, AttributeError):
+        return None
+    description = row.get("description")
+    if type(title) is not str or status not in (0, 1):
+        return None
+    if description is not None and type(description) is not str:
+        return None
+    return TrackerImport.construct(
+        title=title, description=description, day=day, status=status
+    )
+
+
+async def validate(
+    rows: AsyncIterator[dict], report: dict, chunk_rows: int = CHUNK_ROWS
+) -> AsyncIterator[List[TrackerImport]]:
+    """
+    Chunks of valid rows, invalid rows are counted and the first MAX_ERRORS kept
+    """
+    chunk = []
+    async for row in rows:
+        report["rows"] += 1
+        try:
+            chunk.append(_fast_row(row) or TrackerImport(**row))
+        except (ValidationError, TypeError) as error:
+            report["invalid"] += 1
+            if len(report["errors"]) < MAX_ERRORS:
+                report["errors"].append({"row": report["rows"], "error": str(error)})
+        if len(chunk) >= chunk_rows:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def create_habits(
+    database: Database, user_id: int, new_habits: Dict[str, Optional[str]]
+) -> Dict[str, int]:
+    """
+    Insert habits with their habit_stats rows, returns title -> habit id
+    """
+    columns = "user_id, title, description, created_at"
+    rows = []
+    values: dict = {"user_id": user_id, "created_at": date.today()}
+    for i, (title, description) in enumerate(new_habits.items()):
+        row = f":user_id, :title_{i}, :description_{i}, :created_at"
+        if database.url.dialect == "sqlite":
+            row = f"{queries.NEXT_ID.format(table='habits', offset=i)}, {row}"
+        rows.append(f"({row})")
+        values.update({f"title_{i}": title, f"description_{i}": description})
+    if database.url.dialect == "sqlite":
+        columns = f"id, {columns}"
+    query = """
+        INSERT INTO habits({}) VALUES {}
+        RETURNING id, title
+        """.format(
+        columns, ", ".join(rows)
+    )
+    habits_db = await database.fetch_all(query=query, values=values)
+    query = """
+        INSERT INTO habit_stats
+            (habit_id, current_streak, longest_streak, total_completions)
+        VALUES {}
+        """.format(
+        ", ".join(f"(:habit_id_{i}, 0, 0, 0)" for i in range(len(habits_db)))
+    )
+    await database.execute(
+        query=query,
+        values={f"habit_id_{i}": habit["id"] for i, habit in enumerate(habits_db)},
+    )
+    return {habit["title"]: habit["id"] for habit in habits_db}
+
+
+async def upsert_trackers(
+    database: Database, entries: Dict[Tuple[int, date], int]
+) -> None:
+    """
+    Driver executemany of the trackers upsert in BATCH_ROWS batches,
+    call inside a transaction
+    """
+    # Binding thousands of parameters through text() dominates the import time
+    raw_connection = database.connection().raw_connection
+    if database.url.dialect == "postgresql":
+        columns, placeholders = "habit_id, date, status", "$1, $2, $3"
+        rows = [(habit_id, day, status) for (habit_id, day), status in entries.items()]
+    else:
+        columns = "id, habit_id, date, status"
+        placeholders = queries.NEXT_ID.format(table="trackers", offset=0) + ", ?, ?, ?"
+        rows = [
+            (habit_id, day.isoformat(), status)
+            for (habit_id, day), status in entries.items()
+        ]
+    query = f"""
+        INSERT INTO trackers({columns}) VALUES ({placeholders})
+        ON CONFLICT (habit_id, date) DO UPDATE SET status = excluded.status
+        """
+    for start in range(0, len(rows), BATCH_ROWS):
+        await raw_connection.executemany(query, rows[start : start + BATCH_ROWS])
+
+
+async def import_trackers(
+    database: Database,
+    user_id: int,
+    rows: AsyncIterator[dict],
+    storage: str = "rows",
+    chunk_rows: int = CHUNK_ROWS,
+    check: Optional[Callable[[], Awaitable[None]]] = None,
+) -> dict:
+    """
+    Import rows for user_id, one transaction per chunk, returns the import report.
+    check is awaited before every chunk and raises to stop the import
+    """
+    started = time.perf_counter()
+    report: dict = {
+        "rows": 0,
+        "imported": 0,
+        "invalid": 0,
+        "habits_created": 0,
+        "errors": [],
+    }
+    query = """
+        SELECT id, title FROM habits WHERE user_id = :user_id AND deleted_at IS NULL
+        ORDER BY id DESC
+        """
+    habits_db = await database.fetch_all(query=query, values={"user_id": user_id})
+    # Oldest habit wins for repeated titles
+    habit_ids = {habit["title"]: habit["id"] for habit in habits_db}
+    touched = set()
+    async for chunk in validate(rows, report, chunk_rows):
+        new_habits: Dict[str, Optional[str]] = {}
+        for row in chunk:
+            if row.title not in habit_ids:
+                new_habits.setdefault(row.title, row.description)
+        if check is not None:
+            await check()
+        async with database.transaction():
+            if new_habits:
+                habit_ids.update(await create_habits(database, user_id, new_habits))
+                report["habits_created"] += len(new_habits)
+            entries = {
+                (habit_ids[row.title], row.day): row.status
+                for row in chunk
+                if row.day is not None
+            }
+            if entries:
+                if storage == "bitmap":
+                    items = list(entries.items())
+                    for start in range(0, len(items), BATCH_ROWS):
+                        batch = dict(items[start : start + BATCH_ROWS])
+                        await bitmaps.set_statuses(database, batch)
+                else:
+                    await upsert_trackers(database, entries)
+        report["imported"] += len(entries)
+        touched.update(habit_id for habit_id, _ in entries)
+    if touched and storage != "bitmap":
+        await stats.rebuild_habit_stats(database, sorted(touched))
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    report["rows_per_second"] = (
+        round(report["rows"] / report["seconds"]) if report["seconds"] else 0
+    )
+    return report
+
+
+async def read_file(path: str, chunk_size: int = 1 << 16) -> AsyncIterator[bytes]:
+    with open(path, "rb") as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+async def main(user_id: int, path: str, format: str) -> None:
+    from settings import Settings
+
+    shards = get_shard_router()
+
+    async def check() -> None:
+        # Chunks written to the old shard after the move's final copy are lost
+        if await shards.moving(user_id):
+            sys.exit(f"User {user_id} is being moved to another shard, retry later")
+
+    await shards.connect()
+    try:
+        await check()
+        database = await shards.database(user_id)
+        parse = parse_csv if format == "csv" else parse_ndjson
+        try:
+            report = await import_trackers(
+                database,
+                user_id,
+                parse(read_file(path)),
+                Settings().TRACKER_STORAGE,
+                check=check,
+            )
+        finally:
+            # Chunks committed before a failure are visible too
+            await get_response_cache().invalidate(user_id)
+        print(json.dumps(report, indent=2))
+    finally:
+        await shards.disconnect()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        sys.exit(__doc__)
+    from settings import Settings
+
+    if Settings().CACHE_BACKEND != "redis":
+        # The memory backend is per process, the API workers would keep the
+        # user's cached responses
+        sys.exit("import needs the cache the API workers share, CACHE_BACKEND=redis")
+    asyncio.run(
+        main(int(sys.argv[1]), sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else "")
+    )
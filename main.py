@@ -1,21 +1,49 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
+from fastapi.responses import ORJSONResponse, PlainTextResponse
 import uvicorn
 
-from db import get_database, metadata, sqlalchemy_engine
+import metrics
+from auth import get_auth_client
+from cache import ResponseCache, get_response_cache
+from db import create_engine, metadata
 from routers.habits import habits_router
+from shards import get_shard_router
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
+app.add_middleware(metrics.MetricsMiddleware)
 
 
 @app.on_event("startup")
 async def startup():
-    await get_database().connect()
-    metadata.create_all(sqlalchemy_engine)
+    shards = get_shard_router()
+    await shards.connect()
+    for shard_database in shards.databases:
+        metadata.create_all(create_engine(str(shard_database.url)))
 
 
 @app.on_event("shutdown")
 async def shutdown():
-    await get_database().disconnect()
+    await get_shard_router().disconnect()
+    await get_auth_client().close()
+
+
+@app.get("/cache/stats")
+async def cache_stats(cache: ResponseCache = Depends(get_response_cache)):
+    return cache.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics_text(cache: ResponseCache = Depends(get_response_cache)):
+    cache_stats = cache.stats()
+    return PlainTextResponse(
+        metrics.render(
+            {
+                "habits_response_cache_hits_total": cache_stats["hits"],
+                "habits_response_cache_misses_total": cache_stats["misses"],
+            }
+        ),
+        media_type=metrics.CONTENT_TYPE,
+    )
 
 
 app.include_router(habits_router, prefix="/habits", tags=["habits"])
@@ -23,4 +51,3 @@ app.include_router(habits_router, prefix="/habits", tags=["habits"])
 
 if __name__ == "__main__":
     uvicorn.run(app, host="127.0.0.1", port=8888)
-
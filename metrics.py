@@ -0,0 +1,229 @@
+"""
+In-process request, database query and auth call metrics,
+rendered in the Prometheus text exposition format on /metrics.
+"""
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from databases import Database
+
+from settings import Settings
+
+
+settings = Settings()
+logger = logging.getLogger("habits.metrics")
+
+SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNTS = (0, 1, 2, 3, 4, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    """
+    Cumulative histogram per label values, Prometheus style
+    """
+
+    def __init__(
+        self, name: str, help: str, labels: Sequence[str], buckets: Sequence[float]
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        # bucket counts, then sum and count
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0.0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def totals(self, *label_values: str) -> Tuple[float, float]:
+        """
+        Sum and count of the observations with label_values
+        """
+        series = self._series.get(label_values)
+        return (series[-2], series[-1]) if series else (0.0, 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, series in sorted(self._series.items()):
+            labels = [f'{k}="{v}"' for k, v in zip(self.labels, label_values)]
+            for bound, count in zip(self.buckets, series):
+                le = ",".join(labels + [f'le="{bound:g}"'])
+                lines.append(f"{self.name}_bucket{{{le}}} {count:g}")
+            le = ",".join(labels + ['le="+Inf"'])
+            lines.append(f"{self.name}_bucket{{{le}}} {series[-1]:g}")
+            suffix = "{" + ",".join(labels) + "}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {series[-2]:g}")
+            lines.append(f"{self.name}_count{suffix} {series[-1]:g}")
+        return lines
+
+
+request_duration = Histogram(
+    "habits_request_duration_seconds",
+    "HTTP request latency by route",
+    ("method", "route", "status"),
+    SECONDS,
+)
+request_queries = Histogram(
+    "habits_request_queries",
+    "Database queries issued per HTTP request",
+    ("method", "route"),
+    COUNTS,
+)
+query_duration = Histogram(
+    "habits_query_duration_seconds",
+    "Database query latency by operation",
+    ("operation",),
+    SECONDS,
+)
+auth_duration = Histogram(
+    "habits_auth_request_duration_seconds",
+    "Auth service check-token latency by outcome",
+    ("outcome",),
+    SECONDS,
+)
+HISTOGRAMS = (request_duration, request_queries, query_duration, auth_duration)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class RequestStats:
+    def __init__(self) -> None:
+        self.queries = 0
+        self.query_seconds = 0.0
+
+
+request_stats: ContextVar[Optional[RequestStats]] = ContextVar(
+    "request_stats", default=None
+)
+
+
+def observe_query(operation: str, query: Any, seconds: float) -> None:
+    query_duration.observe(seconds, operation)
+    stats = request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.query_seconds += seconds
+    if seconds * 1000 >= settings.SLOW_QUERY_MS:
+        logger.warning(
+            "Slow query %.1f ms: %s", seconds * 1000, " ".join(str(query).split())
+        )
+
+
+class InstrumentedDatabase:
+    """
+    databases.Database proxy timing every query into the metrics
+    """
+
+    def __init__(self, database: Database) -> None:
+        self.database = database
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.database, name)
+
+    async def _timed(self, operation: str, query: Any, *args, **kwargs) -> Any:
+        started = time.perf_counter()
+        try:
+            return await getattr(self.database, operation)(query, *args, **kwargs)
+        finally:
+            observe_query(operation, query, time.perf_counter() - started)
+
+    async def fetch_all(self, query: Any, values: Optional[dict] = None) -> Any:
+        return await self._timed("fetch_all", query, values)
+
+    async def fetch_one(self, query: Any, values: Optional[dict] = None) -> Any:
+        return await self._timed("fetch_one", query, values)
+
+    async def fetch_val(
+        self, query: Any, values: Optional[dict] = None, column: Any = 0
+    ) -> Any:
+        return await self._timed("fetch_val", query, values, column)
+
+    async def execute(self, query: Any, values: Optional[dict] = None) -> Any:
+        return await self._timed("execute", query, values)
+
+    async def execute_many(self, query: Any, values: list) -> Any:
+        return await self._timed("execute_many", query, values)
+
+    async def iterate(self, query: Any, values: Optional[dict] = None):
+        started = time.perf_counter()
+        try:
+            async for record in self.database.iterate(query, values):
+                yield record
+        finally:
+            observe_query("iterate", query, time.perf_counter() - started)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency and query count of every HTTP request,
+    requests over SLOW_REQUEST_MS are logged
+    """
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+        self._routes: Dict[Any, str] = {}
+
+    def _route(self, scope: dict) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if endpoint not in self._routes:
+            paths = [
+                route.path
+                for route in scope["app"].routes
+                if getattr(route, "endpoint", None) is endpoint
+            ]
+            self._routes[endpoint] = paths[0] if paths else endpoint.__name__
+        return self._routes[endpoint]
+
+    async def __call__(self, scope: dict, receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        status_code = [500]
+
+        async def send_status(message: dict) -> None:
+            if message["type"] == "http.response.start":
+                status_code[0] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            seconds = time.perf_counter() - started
+            request_stats.reset(token)
+            method, route = scope["method"], self._route(scope)
+            request_duration.observe(seconds, method, route, str(status_code[0]))
+            request_queries.observe(stats.queries, method, route)
+            if seconds * 1000 >= settings.SLOW_REQUEST_MS:
+                logger.warning(
+                    "Slow request %.1f ms: %s %s, %d queries in %.1f ms",
+                    seconds * 1000,
+                    method,
+                    scope["path"],
+                    stats.queries,
+                    stats.query_seconds * 1000,
+                )
+
+
+def render(counters: Optional[Dict[str, float]] = None) -> str:
+    """
+    All histograms plus counters kept elsewhere, as name -> value
+    """
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    for name, value in sorted((counters or {}).items()):
+        lines.extend([f"# TYPE {name} counter", f"{name} {value:g}"])
+    return "\n".join(lines) + "\n"
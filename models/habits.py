@@ -1,8 +1,8 @@
 import time
 
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from typing import List, Union, Optional
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, Field, EmailStr, conlist, validator
 import sqlalchemy
 from db import metadata
 
@@ -30,6 +30,10 @@ class HabitCreate(BaseModel):
         orm_mode = True
 
 
+class HabitCreateBatch(BaseModel):
+    habits: conlist(HabitCreate, min_items=1, max_items=100)  # type: ignore
+
+
 class HabitBase(HabitCreate):
     user_id: int
 
@@ -53,17 +57,97 @@ class HabitUpdate(BaseModel):
 
 class TrackerBase(BaseModel):
     habit_id: int
-    date: str
+    date: date
+    status: int
+
+    class Config:
+        orm_mode = True
+
+
+# Clients a timezone ahead of the server check in on its tomorrow
+CHECKIN_LEEWAY_DAYS = 1
+
+
+def latest_checkin_day() -> date:
+    return date.today() + timedelta(days=CHECKIN_LEEWAY_DAYS)
+
+
+def not_in_future(day: Optional[date]) -> Optional[date]:
+    if day is not None and day > latest_checkin_day():
+        raise ValueError("date is in the future")
+    return day
+
+
+class TrackerCheckIn(BaseModel):
+    habit_id: int
+    date: date
+    status: int = Field(..., ge=0, le=1)
+
+    _date_not_in_future = validator("date", allow_reuse=True)(not_in_future)
+
+
+class TrackerImport(BaseModel):
+    title: str
+    description: Optional[str] = None
+    # A field named date with a default shadows the type in the class body
+    day: Optional[date] = Field(None, alias="date")
+    status: int = Field(0, ge=0, le=1)
+
+    _day_not_in_future = validator("day", allow_reuse=True)(not_in_future)
+
+
+class TrackerDB(BaseModel):
+    id: Optional[int]
+    habit_id: int
+    date: date
     status: int
 
     class Config:
         orm_mode = True
 
 
+class TrackerCheckInBatch(BaseModel):
+    trackers: conlist(TrackerCheckIn, min_items=1, max_items=1000)  # type: ignore
+
+
 class HabitFull(HabitDB):
     tracker: Optional[List[TrackerBase]]
 
 
+def habit_full(habit, tracker) -> dict:
+    """
+    HabitFull shaped dict straight from trusted database rows, no validation
+    """
+    return {
+        "title": habit["title"],
+        "description": habit["description"],
+        "user_id": habit["user_id"],
+        "id": habit["id"],
+        "tracker": [
+            {"habit_id": t["habit_id"], "date": str(t["date"]), "status": t["status"]}
+            for t in tracker
+        ],
+    }
+
+
+class HabitSummary(BaseModel):
+    habit_id: int
+    current_streak: int
+    longest_streak: int
+    last_checkin: Optional[date]
+    total_completions: int
+
+
+class HabitStats(BaseModel):
+    habit_id: int
+    current_streak: int
+    longest_streak: int
+    completion_7: float
+    completion_30: float
+    completion_365: float
+    weekdays: conlist(int, min_items=7, max_items=7)  # type: ignore
+
+
 habits = sqlalchemy.Table(
     "habits",
     metadata,
@@ -71,6 +155,22 @@ habits = sqlalchemy.Table(
     sqlalchemy.Column("user_id", sqlalchemy.Integer, nullable=False),
     sqlalchemy.Column("title", sqlalchemy.String, nullable=False),
     sqlalchemy.Column("description", sqlalchemy.String),
+    # Start of the completion rates, see stats.stats_query
+    sqlalchemy.Column(
+        "created_at",
+        sqlalchemy.Date,
+        nullable=False,
+        server_default=sqlalchemy.text("CURRENT_DATE"),
+    ),
+    # Set by soft deletes, the purger removes the rows later
+    sqlalchemy.Column("deleted_at", sqlalchemy.DateTime),
+    sqlalchemy.Index("ix_habits_user_id_id", "user_id", "id"),
+    sqlalchemy.Index(
+        "ix_habits_deleted_at",
+        "deleted_at",
+        postgresql_where=sqlalchemy.text("deleted_at IS NOT NULL"),
+        sqlite_where=sqlalchemy.text("deleted_at IS NOT NULL"),
+    ),
 )
 
 
@@ -78,7 +178,84 @@ trackers = sqlalchemy.Table(
     "trackers",
     metadata,
     sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True, autoincrement=True),
-    sqlalchemy.Column("habit_id", sqlalchemy.ForeignKey("habits.id"), nullable=False),
+    sqlalchemy.Column(
+        "habit_id",
+        sqlalchemy.ForeignKey("habits.id", ondelete="CASCADE"),
+        nullable=False,
+    ),
     sqlalchemy.Column("date", sqlalchemy.Date(), nullable=False),
     sqlalchemy.Column("status", sqlalchemy.Integer, default=False),
+    sqlalchemy.Index("ix_trackers_habit_id_date", "habit_id", "date", unique=True),
+)
+
+
+habit_bitmaps = sqlalchemy.Table(
+    "habit_bitmaps",
+    metadata,
+    sqlalchemy.Column(
+        "habit_id",
+        sqlalchemy.ForeignKey("habits.id", ondelete="CASCADE"),
+        primary_key=True,
+        nullable=False,
+    ),
+    sqlalchemy.Column("year", sqlalchemy.Integer, primary_key=True, nullable=False),
+    sqlalchemy.Column("bits", sqlalchemy.LargeBinary, nullable=False),
 )
+
+
+habit_stats = sqlalchemy.Table(
+    "habit_stats",
+    metadata,
+    sqlalchemy.Column(
+        "habit_id",
+        sqlalchemy.ForeignKey("habits.id", ondelete="CASCADE"),
+        primary_key=True,
+        nullable=False,
+    ),
+    sqlalchemy.Column("current_streak", sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Column("longest_streak", sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Column("last_checkin", sqlalchemy.Date()),
+    sqlalchemy.Column("total_completions", sqlalchemy.Integer, nullable=False),
+)
+
+
+# Users moved off their home shard by rebalance.py, kept in the first shard
+user_shards = sqlalchemy.Table(
+    "user_shards",
+    metadata,
+    sqlalchemy.Column("user_id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("shard", sqlalchemy.Integer, nullable=False),
+    # Writes rejected while rebalance.py copies the user to another shard
+    sqlalchemy.Column(
+        "moving", sqlalchemy.Boolean, nullable=False, server_default=sqlalchemy.false()
+    ),
+)
+
+
+# Ids of the shard's new habits and trackers, set by rebalance.py ranges
+id_ranges = sqlalchemy.Table(
+    "id_ranges",
+    metadata,
+    sqlalchemy.Column("table_name", sqlalchemy.String, primary_key=True),
+    sqlalchemy.Column("next_id", sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Column("ceiling", sqlalchemy.Integer, nullable=False),
+)
+
+# SQLite has no sequences, queries.next_id reads next_id and the trigger moves
+# it past every id the shard's inserts take in its range
+NEXT_ID_TRIGGER = """
+    CREATE TRIGGER {table}_next_id AFTER INSERT ON {table}
+    WHEN NEW.id >= (SELECT next_id FROM id_ranges WHERE table_name = '{table}')
+        AND NEW.id < (SELECT ceiling FROM id_ranges WHERE table_name = '{table}')
+    BEGIN
+        UPDATE id_ranges SET next_id = NEW.id + 1 WHERE table_name = '{table}';
+    END
+    """
+for table in (habits, trackers):
+    sqlalchemy.event.listen(
+        table,
+        "after_create",
+        sqlalchemy.DDL(NEXT_ID_TRIGGER.format(table=table.name)).execute_if(
+            dialect="sqlite"
+        ),
+    )
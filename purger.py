@@ -0,0 +1,81 @@
+"""
+Purge of soft-deleted habits (DELETE_MODE=soft) in bounded batches.
+
+Every statement deletes at most PURGE_BATCH_ROWS rows and commits on its own,
+trackers first and then the habits with their bitmaps and stats by cascade,
+with a PURGE_PAUSE sleep in between so API writes get the write lock.
+
+    python purger.py [once]
+"""
+import asyncio
+import logging
+import sys
+
+from databases import Database
+
+from shards import get_shard_router
+from settings import Settings
+
+
+settings: Settings = Settings()
+logging.basicConfig(level=logging.INFO)
+
+PURGE_TRACKERS = """
+    DELETE FROM trackers WHERE id IN (
+        SELECT t.id FROM habits h JOIN trackers t ON t.habit_id = h.id
+        WHERE h.deleted_at IS NOT NULL LIMIT :limit
+    )
+    RETURNING id
+    """
+PURGE_HABITS = """
+    DELETE FROM habits WHERE id IN (
+        SELECT id FROM habits WHERE deleted_at IS NOT NULL LIMIT :limit
+    )
+    RETURNING id
+    """
+
+
+async def purge_batch(database: Database, batch_rows: int) -> int:
+    """
+    Delete up to batch_rows rows of soft-deleted habits, returns the rows deleted
+    """
+    for query in (PURGE_TRACKERS, PURGE_HABITS):
+        rows = await database.fetch_all(query=query, values={"limit": batch_rows})
+        if rows:
+            return len(rows)
+    return 0
+
+
+async def purge(database: Database, batch_rows: int, pause: float = 0) -> int:
+    """
+    Purge every soft-deleted habit, returns the rows deleted
+    """
+    total = 0
+    while True:
+        deleted = await purge_batch(database, batch_rows)
+        if not deleted:
+            return total
+        total += deleted
+        await asyncio.sleep(pause)
+
+
+async def main(command: str) -> None:
+    shards = get_shard_router()
+    await shards.connect()
+    try:
+        while True:
+            for shard, database in enumerate(shards.databases):
+                deleted = await purge(
+                    database, settings.PURGE_BATCH_ROWS, settings.PURGE_PAUSE
+                )
+                if deleted:
+                    logging.info("Purged rows on shard %s: %s", shard, deleted)
+            if command == "once":
+                break
+            await asyncio.sleep(settings.PURGE_INTERVAL)
+    finally:
+        await shards.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else ""))
@@ -0,0 +1,307 @@
+"""
+SQL of the habits router, built from the models Table definitions and compiled
+once per dialect. Every statement shape keeps one text with :name placeholders,
+so asyncpg serves repeated requests from its prepared statement cache.
+Statements taking n rows or ids are cached per n.
+"""
+from functools import lru_cache
+from typing import Any, Dict
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models.habits import habit_stats, habits, trackers, user_shards
+
+
+DIALECTS: Dict[str, Any] = {
+    "sqlite": sqlite.dialect(paramstyle="named"),
+    "postgresql": postgresql.dialect(paramstyle="named"),
+}
+# Row counts are bounded by the batch models, ids by request limits
+SIZED_CACHE = 1024
+# Soft-deleted habits wait for the purger, every read skips them
+live = habits.c.deleted_at.is_(None)
+# Id of a new SQLite row in the shard's id range, NULL without one
+NEXT_ID = "(SELECT next_id + {offset} FROM id_ranges WHERE table_name = '{table}')"
+
+
+def compile_sql(statement: Any, dialect: str) -> str:
+    # SQLAlchemy 1.4 does not render RETURNING for SQLite, the PostgreSQL
+    # syntax is the same since SQLite 3.35
+    if getattr(statement, "_returning", None) and dialect == "sqlite":
+        dialect = "postgresql"
+    return str(statement.compile(dialect=DIALECTS[dialect]))
+
+
+def _limit(statement: Any) -> Any:
+    # SQLite renders an anonymous OFFSET parameter for LIMIT without OFFSET
+    return statement.limit(sa.bindparam("limit")).offset(sa.literal_column("0"))
+
+
+def _rows(columns, n: int) -> list:
+    return [{c: sa.bindparam(f"{c}_{i}") for c in columns} for i in range(n)]
+
+
+def _ids(name: str, n: int) -> list:
+    return [sa.bindparam(f"{name}_{i}") for i in range(n)]
+
+
+def _with_next_ids(rows: list, table: sa.Table, dialect: str) -> list:
+    """
+    rows with ids from the shard's id range, see rebalance.py ranges.
+    SQLite takes MAX(id) + 1 for a NULL id, past the rows moved in from
+    higher ranges. PostgreSQL sequences start at the range
+    """
+    if dialect != "sqlite":
+        return rows
+    # Distinct offsets, whether the range moves between the rows or not
+    return [
+        {"id": sa.literal_column(NEXT_ID.format(table=table.name, offset=i)), **row}
+        for i, row in enumerate(rows)
+    ]
+
+
+@lru_cache()
+def habit(dialect: str) -> str:
+    statement = sa.select(habits).where(
+        habits.c.user_id == sa.bindparam("user_id"),
+        habits.c.id == sa.bindparam("id"),
+        live,
+    )
+    return compile_sql(statement, dialect)
+
+
+@lru_cache()
+def habit_trackers_page(dialect: str) -> str:
+    statement = (
+        sa.select(trackers)
+        .where(
+            trackers.c.habit_id == sa.bindparam("id"),
+            trackers.c.date >= sa.bindparam("date_from"),
+            trackers.c.date <= sa.bindparam("date_to"),
+        )
+        .order_by(trackers.c.date)
+    )
+    return compile_sql(_limit(statement), dialect)
+
+
+@lru_cache(maxsize=SIZED_CACHE)
+def insert_habits(dialect: str, n: int) -> str:
+    rows = [
+        {
+            "user_id": sa.bindparam("user_id"),
+            "title": sa.bindparam(f"title_{i}"),
+            "description": sa.bindparam(f"description_{i}"),
+            "created_at": sa.bindparam("created_at"),
+        }
+        for i in range(n)
+    ]
+    statement = (
+        habits.insert()
+        .values(_with_next_ids(rows, habits, dialect))
+        .returning(*habits.c)
+    )
+    return compile_sql(statement, dialect)
+
+
+@lru_cache(maxsize=SIZED_CACHE)
+def insert_habit_stats(dialect: str, n: int) -> str:
+    """
+    Empty habit_stats rows for new habits, habit_id_{i} parameters
+    """
+    zero = sa.literal_column("0")
+    rows = [
+        {
+            "habit_id": sa.bindparam(f"habit_id_{i}"),
+            "current_streak": zero,
+            "longest_streak": zero,
+            "total_completions": zero,
+        }
+        for i in range(n)
+    ]
+    return compile_sql(habit_stats.insert().values(rows), dialect)
+
+
+@lru_cache()
+def update_habit(dialect: str) -> str:
+    statement = (
+        habits.update()
+        .where(habits.c.id == sa.bindparam("habit_id"))
+        .values(title=sa.bindparam("title"), description=sa.bindparam("description"))
+    )
+    return compile_sql(statement, dialect)
+
+
+@lru_cache()
+def tracker(dialect: str) -> str:
+    statement = sa.select(trackers).where(trackers.c.id == sa.bindparam("id"))
+    return compile_sql(statement, dialect)
+
+
+@lru_cache()
+def habit_owner(dialect: str) -> str:
+    statement = sa.select(habits.c.user_id).where(
+        habits.c.id == sa.bindparam("id"), live
+    )
+    return compile_sql(statement, dialect)
+
+
+@lru_cache()
+def update_tracker_status(dialect: str) -> str:
+    statement = (
+        trackers.update()
+        .where(trackers.c.id == sa.bindparam("tracker_id"))
+        .values(status=sa.bindparam("status"))
+    )
+    return compile_sql(statement, dialect)
+
+
+@lru_cache(maxsize=SIZED_CACHE)
+def owned_habit_ids(dialect: str, n: int) -> str:
+    statement = sa.select(habits.c.id).where(
+        habits.c.user_id == sa.bindparam("user_id"),
+        habits.c.id.in_(_ids("habit_id", n)),
+        live,
+    )
+    return compile_sql(statement, dialect)
+
+
+@lru_cache(maxsize=SIZED_CACHE)
+def upsert_trackers(dialect: str, n: int) -> str:
+    """
+    Insert or update n trackers by (habit_id, date), returning the rows
+    """
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    rows = _rows(("habit_id", "date", "status"), n)
+    statement = insert(trackers).values(_with_next_ids(rows, trackers, dialect))
+    statement = statement.on_conflict_do_update(
+        index_elements=[trackers.c.habit_id, trackers.c.date],
+        set_={"status": statement.excluded.status},
+    ).returning(trackers.c.id, trackers.c.habit_id, trackers.c.date, trackers.c.status)
+    return compile_sql(statement, dialect)
+
+
+def _user_habit_ids(one_habit: bool) -> Any:
+    statement = sa.select(habits.c.id).where(
+        habits.c.user_id == sa.bindparam("user_id"), live
+    )
+    if one_habit:
+        statement = statement.where(habits.c.id == sa.bindparam("habit_id"))
+    return statement
+
+
+@lru_cache()
+def user_habit_ids(dialect: str, one_habit: bool) -> str:
+    return compile_sql(_user_habit_ids(one_habit), dialect)
+
+
+@lru_cache()
+def user_trackers(dialect: str, one_habit: bool) -> str:
+    """
+    Trackers of the user habits, or of one user habit, in the date window
+    """
+    statement = (
+        sa.select(trackers)
+        .where(
+            trackers.c.habit_id.in_(_user_habit_ids(one_habit)),
+            trackers.c.date >= sa.bindparam("date_from"),
+            trackers.c.date <= sa.bindparam("date_to"),
+        )
+        .order_by(trackers.c.habit_id, trackers.c.date)
+    )
+    return compile_sql(statement, dialect)
+
+
+@lru_cache()
+def delete_habit(dialect: str, soft: bool) -> str:
+    """
+    Delete of a user habit by habit_id returning its id, dependent rows go by
+    ON DELETE CASCADE. A soft delete only marks the habit for the purger
+    """
+    condition = sa.and_(
+        habits.c.id == sa.bindparam("habit_id"),
+        habits.c.user_id == sa.bindparam("user_id"),
+        live,
+    )
+    if soft:
+        statement = habits.update().where(condition)
+        statement = statement.values(deleted_at=sa.func.current_timestamp())
+    else:
+        statement = habits.delete().where(condition)
+    return compile_sql(statement.returning(habits.c.id), dialect)
+
+
+@lru_cache()
+def habits_page(dialect: str) -> str:
+    statement = (
+        sa.select(habits)
+        .where(
+            habits.c.user_id == sa.bindparam("user_id"),
+            habits.c.id > sa.bindparam("after"),
+            live,
+        )
+        .order_by(habits.c.id)
+    )
+    return compile_sql(_limit(statement), dialect)
+
+
+@lru_cache()
+def habits_page_trackers(dialect: str) -> str:
+    """
+    Trackers in the date window of the habits page ending at last_id
+    """
+    page = sa.select(habits.c.id).where(
+        habits.c.user_id == sa.bindparam("user_id"),
+        habits.c.id > sa.bindparam("after"),
+        habits.c.id <= sa.bindparam("last_id"),
+        live,
+    )
+    statement = (
+        sa.select(trackers)
+        .where(
+            trackers.c.habit_id.in_(page),
+            trackers.c.date >= sa.bindparam("date_from"),
+            trackers.c.date <= sa.bindparam("date_to"),
+        )
+        .order_by(trackers.c.habit_id, trackers.c.date)
+    )
+    return compile_sql(statement, dialect)
+
+
+@lru_cache()
+def habit_summaries(dialect: str) -> str:
+    statement = (
+        sa.select(habit_stats)
+        .join(habits, habits.c.id == habit_stats.c.habit_id)
+        .where(habits.c.user_id == sa.bindparam("user_id"), live)
+        .order_by(habit_stats.c.habit_id)
+    )
+    return compile_sql(statement, dialect)
+
+
+@lru_cache()
+def user_shards_map(dialect: str) -> str:
+    return compile_sql(sa.select(user_shards), dialect)
+
+
+@lru_cache()
+def set_user_shard(dialect: str) -> str:
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    statement = insert(user_shards).values(
+        user_id=sa.bindparam("user_id"),
+        shard=sa.bindparam("shard"),
+        moving=sa.bindparam("moving"),
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[user_shards.c.user_id],
+        set_={"shard": statement.excluded.shard, "moving": statement.excluded.moving},
+    )
+    return compile_sql(statement, dialect)
+
+
+@lru_cache()
+def delete_user_shard(dialect: str) -> str:
+    statement = user_shards.delete().where(
+        user_shards.c.user_id == sa.bindparam("user_id")
+    )
+    return compile_sql(statement, dialect)
@@ -0,0 +1,314 @@
+"""
+Move a user's habit data between shards, see shards.py.
+
+The user's live habits are copied to the target shard under the same habit and
+tracker ids while the API keeps serving the user from the old shard. Then the
+user_shards directory marks the user moving: after SHARD_MAP_REFRESH seconds
+every process answers the user's writes with 503, the copy is redone over the
+first one and the directory points at the target. The old shard's rows are
+deleted once every process has seen the switch, a failed copy puts the user
+back on the old shard. Cached responses are invalidated in the cache the API
+workers share, moves need CACHE_BACKEND=redis.
+
+Ids stay unique across shards once `ranges` gave shard k the ids from
+(k + 1) * SHARD_ID_RANGE, run it before the shards take writes. Ids are 32-bit
+on PostgreSQL, (N + 1) * SHARD_ID_RANGE must stay below 2**31.
+
+Adding a shard changes the home shard user_id % N of most users, `pin` records
+the users whose home moves in the directory so they stay where their habits are:
+
+    1. create the new database, alembic upgrade head
+    2. python rebalance.py pin <N + 1>, with the current DATABASE_SHARDS
+    3. append the database to DATABASE_SHARDS, python rebalance.py ranges
+    4. restart every process with the new DATABASE_SHARDS
+    5. python rebalance.py pin <N + 1> again, it pins the users whose first
+       habits went to their old home meanwhile and lists under "split" the
+       users with habits on two shards, to merge by hand
+    6. move users to the new shard
+
+    python rebalance.py ranges
+    python rebalance.py pin <shards>
+    python rebalance.py move <user_id> <shard>
+    python rebalance.py stats
+"""
+import asyncio
+import json
+import sys
+from typing import Any, Dict, List, Optional
+
+from databases import Database
+
+import queries
+import stats
+from cache import get_response_cache
+from recieve import delete_users
+from settings import Settings
+from shards import ShardRouter, get_shard_router
+
+
+settings: Settings = Settings()
+
+USER_HABITS = """
+    SELECT id, title, description, created_at FROM habits
+    WHERE user_id = :user_id AND deleted_at IS NULL
+    ORDER BY id
+    """
+USER_TRACKERS = """
+    SELECT t.id, t.habit_id, t.date, t.status
+    FROM habits h JOIN trackers t ON t.habit_id = h.id
+    WHERE h.user_id = :user_id AND h.deleted_at IS NULL
+    """
+USER_BITMAPS = """
+    SELECT b.habit_id, b.year, b.bits
+    FROM habits h JOIN habit_bitmaps b ON b.habit_id = h.id
+    WHERE h.user_id = :user_id AND h.deleted_at IS NULL
+    """
+USER_STATS = """
+    SELECT s.habit_id, s.current_streak, s.longest_streak, s.last_checkin,
+        s.total_completions
+    FROM habits h JOIN habit_stats s ON s.habit_id = h.id
+    WHERE h.user_id = :user_id AND h.deleted_at IS NULL
+    """
+SHARD_USERS = "SELECT DISTINCT user_id FROM habits"
+SHARD_STATS = """
+    SELECT COUNT(DISTINCT user_id) AS users, COUNT(*) AS habits
+    FROM habits WHERE deleted_at IS NULL
+    """
+
+
+def _in_clause(items: List[int]) -> tuple:
+    values = {f"id_{i}": item for i, item in enumerate(items)}
+    return ", ".join(f":{key}" for key in values), values
+
+
+async def copy_user(source: Database, target: Database, user_id: int) -> List[int]:
+    """
+    Copy user_id's live habits from source to target under the same ids,
+    over the rows copied before. Returns the habit ids
+    """
+    habits_db = await source.fetch_all(query=USER_HABITS, values={"user_id": user_id})
+    habit_ids = [habit["id"] for habit in habits_db]
+    async with target.transaction():
+        copied = await target.fetch_all(
+            query="SELECT id FROM habits WHERE user_id = :user_id",
+            values={"user_id": user_id},
+        )
+        vanished = [row["id"] for row in copied if row["id"] not in habit_ids]
+        if vanished:
+            habit_ids_in, values = _in_clause(vanished)
+            await target.execute(
+                query=f"DELETE FROM habits WHERE id IN ({habit_ids_in})", values=values
+            )
+        if habits_db:
+            await target.execute_many(
+                query="""
+                    INSERT INTO habits(id, user_id, title, description, created_at)
+                    VALUES (:id, :user_id, :title, :description, :created_at)
+                    ON CONFLICT (id) DO UPDATE
+                    SET title = excluded.title, description = excluded.description
+                    """,
+                values=[
+                    {**dict(habit._mapping), "user_id": user_id} for habit in habits_db
+                ],
+            )
+        copies = (
+            (
+                USER_TRACKERS,
+                "INSERT INTO trackers(id, habit_id, date, status)"
+                " VALUES (:id, :habit_id, :date, :status)"
+                " ON CONFLICT (habit_id, date) DO UPDATE SET status = excluded.status",
+            ),
+            (
+                USER_BITMAPS,
+                "INSERT INTO habit_bitmaps(habit_id, year, bits)"
+                " VALUES (:habit_id, :year, :bits)"
+                " ON CONFLICT (habit_id, year) DO UPDATE SET bits = excluded.bits",
+            ),
+            (
+                USER_STATS,
+                "INSERT INTO habit_stats(habit_id, current_streak, longest_streak,"
+                " last_checkin, total_completions) VALUES (:habit_id,"
+                " :current_streak, :longest_streak, :last_checkin, :total_completions)"
+                " ON CONFLICT (habit_id) DO UPDATE SET"
+                " current_streak = excluded.current_streak,"
+                " longest_streak = excluded.longest_streak,"
+                " last_checkin = excluded.last_checkin,"
+                " total_completions = excluded.total_completions",
+            ),
+        )
+        for select, insert in copies:
+            rows = await source.fetch_all(query=select, values={"user_id": user_id})
+            if not rows:
+                continue
+            await target.execute_many(
+                query=insert, values=[dict(row._mapping) for row in rows]
+            )
+    return habit_ids
+
+
+async def move_user(
+    shards: ShardRouter, user_id: int, shard: int, grace: Optional[float] = None
+) -> dict:
+    """
+    Move user_id's habits to shard, grace defaults to the shard map refresh.
+    Returns the move report with the moved habit ids
+    """
+    if not 0 <= shard < shards.size:
+        raise ValueError(f"No shard {shard}, shards: {shards.size}")
+    source_shard = await shards.shard(user_id)
+    if source_shard == shard:
+        raise ValueError(f"User {user_id} is on shard {shard} already")
+    source, target = shards.databases[source_shard], shards.databases[shard]
+    if await target.fetch_val(query=USER_HABITS, values={"user_id": user_id}):
+        raise ValueError(f"Shard {shard} holds habits of user {user_id} already")
+    habits_db = await source.fetch_all(query=USER_HABITS, values={"user_id": user_id})
+    if habits_db:
+        habit_ids_in, values = _in_clause([habit["id"] for habit in habits_db])
+        taken = await target.fetch_all(
+            query=f"SELECT id FROM habits WHERE id IN ({habit_ids_in})", values=values
+        )
+        if taken:
+            raise ValueError(
+                f"Habit ids {[row['id'] for row in taken]} are taken on shard {shard},"
+                " see rebalance.py ranges"
+            )
+    grace = shards.refresh if grace is None else grace
+    habit_ids = await copy_user(source, target, user_id)
+    await shards.set_shard(user_id, source_shard, moving=True)
+    try:
+        await asyncio.sleep(grace)
+        # No process writes the user now, the old shard is final
+        habit_ids = await copy_user(source, target, user_id)
+    except BaseException:
+        await delete_users(target, [user_id])
+        await shards.set_shard(user_id, source_shard)
+        raise
+    await shards.set_shard(user_id, shard)
+    # Processes routing the user to the old shard still read from it
+    await asyncio.sleep(grace)
+    await delete_users(source, [user_id])
+    if settings.TRACKER_STORAGE != "bitmap":
+        await stats.rebuild_habit_stats(target, habit_ids)
+    await get_response_cache().invalidate(user_id)
+    return {
+        "user_id": user_id,
+        "from": source_shard,
+        "to": shard,
+        "habit_ids": habit_ids,
+    }
+
+
+async def set_id_ranges(shards: ShardRouter, size: int) -> List[dict]:
+    """
+    Start the habit and tracker ids of shard k at (k + 1) * size, ids taken
+    before stay below the first range. Shards with a range keep it
+    """
+    if (shards.size + 1) * size > 2**31 - 1:
+        raise ValueError(f"{shards.size} shards of {size} ids overflow 32-bit ids")
+    report = []
+    for shard, database in enumerate(shards.databases):
+        floor = (shard + 1) * size
+        for table in ("habits", "trackers"):
+            values = {"table_name": table, "next_id": floor, "ceiling": floor + size}
+            await database.execute(
+                query="""
+                    INSERT INTO id_ranges(table_name, next_id, ceiling)
+                    VALUES (:table_name, :next_id, :ceiling)
+                    ON CONFLICT (table_name) DO NOTHING
+                    """,
+                values=values,
+            )
+            if database.url.dialect == "postgresql":
+                # Explicit ids of moved rows never move a sequence
+                sequence = f"pg_get_serial_sequence('{table}', 'id')"
+                await database.execute(
+                    query=f"""
+                        SELECT setval({sequence}, :next_id, false)
+                        WHERE COALESCE(pg_sequence_last_value({sequence}::regclass), 0)
+                            < :next_id
+                        """,
+                    values={"next_id": floor},
+                )
+            next_id = await database.fetch_val(
+                query="SELECT next_id FROM id_ranges WHERE table_name = :table_name",
+                values={"table_name": table},
+            )
+            report.append({"shard": shard, "table": table, "next_id": next_id})
+    return report
+
+
+async def pin_users(shards: ShardRouter, size: int) -> dict:
+    """
+    Record in the directory the users without an entry whose habits are on
+    a shard other than user_id % size, before there are size shards.
+    Returns the pinned users per shard and the users found on several shards,
+    left unpinned
+    """
+    if size < shards.size:
+        raise ValueError(f"Shards can not be removed, shards: {shards.size}")
+    dialect = shards.directory.url.dialect
+    entries = await shards.directory.fetch_all(query=queries.user_shards_map(dialect))
+    listed = {entry["user_id"] for entry in entries}
+    found: Dict[int, List[int]] = {}
+    for shard, database in enumerate(shards.databases):
+        for row in await database.fetch_all(query=SHARD_USERS):
+            if row["user_id"] not in listed:
+                found.setdefault(row["user_id"], []).append(shard)
+    pinned = []
+    for shard in range(shards.size):
+        pins = [
+            user_id
+            for user_id, at in found.items()
+            if at == [shard] and user_id % size != shard
+        ]
+        if pins:
+            await shards.directory.execute_many(
+                query=queries.set_user_shard(dialect),
+                values=[
+                    {"user_id": user_id, "shard": shard, "moving": False}
+                    for user_id in pins
+                ],
+            )
+        pinned.append({"shard": shard, "users": len(pins)})
+    await shards.load_map()
+    return {
+        "pinned": pinned,
+        "split": sorted(user_id for user_id, at in found.items() if len(at) > 1),
+    }
+
+
+async def shard_stats(shards: ShardRouter) -> List[dict]:
+    report = []
+    for shard, database in enumerate(shards.databases):
+        row = await database.fetch_one(query=SHARD_STATS)
+        report.append({"shard": shard, "users": row["users"], "habits": row["habits"]})
+    return report
+
+
+async def main(args: List[str]) -> None:
+    shards = get_shard_router()
+    await shards.connect()
+    report: Any
+    try:
+        if args[0] == "move":
+            report = await move_user(shards, int(args[1]), int(args[2]))
+        elif args[0] == "pin":
+            report = await pin_users(shards, int(args[1]))
+        elif args[0] == "ranges":
+            report = await set_id_ranges(shards, settings.SHARD_ID_RANGE)
+        else:
+            report = await shard_stats(shards)
+        print(json.dumps(report, indent=2))
+    finally:
+        await shards.disconnect()
+
+
+if __name__ == "__main__":
+    arguments = {"move": 2, "pin": 1}
+    if not sys.argv[1:] or len(sys.argv) < 2 + arguments.get(sys.argv[1], 0):
+        sys.exit(__doc__)
+    if sys.argv[1] == "move" and settings.CACHE_BACKEND != "redis":
+        # The memory backend is per process, the API workers would keep the
+        # user's cached responses
+        sys.exit("move needs the cache the API workers share, CACHE_BACKEND=redis")
+    asyncio.run(main(sys.argv[1:]))
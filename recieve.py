@@ -1,55 +1,185 @@
 import sys
 import os
 import json
+import asyncio
 import logging
-import sqlite3
+from typing import Any, Dict, List, Set
 
-import pika
+import aio_pika
+from databases import Database
 
 from settings import Settings
+from shards import ShardRouter, get_shard_router
 
 
 settings: Settings = Settings()
 logging.basicConfig(level=logging.INFO)
 
 
-def main() -> None:
-    connection = pika.BlockingConnection(
-        pika.ConnectionParameters(host=str(settings.Rabbit_host))
-    )
-    channel = connection.channel()
+async def delete_users(
+    database: Database, user_ids: List[int], soft: bool = False
+) -> None:
+    """
+    Delete habits of many users in one statement, trackers, bitmaps and stats
+    go by ON DELETE CASCADE. A soft delete only marks the habits for purger.py
+    """
+    values = {f"user_id_{i}": user_id for i, user_id in enumerate(user_ids)}
+    user_ids_in = ", ".join(f":{key}" for key in values)
+    if soft:
+        query = f"""
+            UPDATE habits SET deleted_at = CURRENT_TIMESTAMP
+            WHERE user_id IN ({user_ids_in}) AND deleted_at IS NULL
+            """
+    else:
+        query = f"DELETE FROM habits WHERE user_id IN ({user_ids_in})"
+    await database.execute(query=query, values=values)
 
-    channel.queue_declare(queue=str(settings.Rabbit_chanel))
 
-    def delete_user(user_id: int):
-        con = sqlite3.connect("habits.db")
-        cur = con.cursor()
-        habits_db = cur.execute(
-            "SELECT id FROM habits WHERE user_id = ?", (user_id,)
-        ).fetchall()
-        habits_list = [i[0] for i in habits_db]
-        for i in habits_list:
-            cur.execute("DELETE FROM trackers WHERE habit_id = ?", (i,))
-        cur.execute("DELETE FROM habits WHERE user_id = ?", (user_id,))
-        con.commit()
-        logging.info("Habits | user_id: %s, status: deleted", user_id)
+class DeletionConsumer:
+    """
+    Drains user deletion messages in micro-batches, one delete per shard,
+    acks a batch only after the deletes of every shard commit. A failed batch
+    is retried message by message, failing messages are requeued after an
+    exponential backoff and rejected after max_attempts, to the queue's dead
+    letter exchange when it has one
+    """
 
-    def callback(ch, method, properties, body):
-        logging.info("Received message: %s", body)
-        data = json.loads(body)
-        delete_user(int(data["deleted"]))
+    def __init__(
+        self,
+        shards: ShardRouter,
+        batch_size: int,
+        batch_timeout: float,
+        soft: bool = False,
+        max_attempts: int = 5,
+        retry_backoff: float = 1,
+        retry_backoff_max: float = 60,
+    ) -> None:
+        self.shards = shards
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.soft = soft
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self._messages: asyncio.Queue = asyncio.Queue()
+        self._attempts: Dict[int, int] = {}
+        self._retries: Set[asyncio.Task] = set()
 
-    channel.basic_consume(
-        queue=str(settings.Rabbit_chanel), on_message_callback=callback, auto_ack=True
-    )
+    async def on_message(self, message: Any) -> None:
+        await self._messages.put(message)
 
-    logging.info("Waiting for messages.")
-    channel.start_consuming()
+    async def next_batch(self) -> list:
+        batch = [await self._messages.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_timeout
+        while len(batch) < self.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._messages.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def handle_batch(self, batch: list) -> None:
+        messages = []
+        user_ids = []
+        for message in batch:
+            logging.info("Received message: %s", message.body)
+            try:
+                user_ids.append(int(json.loads(message.body)["deleted"]))
+            except (ValueError, KeyError, TypeError):
+                logging.error("Rejected message: %s", message.body)
+                await message.reject(requeue=False)
+                continue
+            messages.append(message)
+        if not messages:
+            return
+        try:
+            await self.delete(user_ids)
+        except Exception:
+            logging.exception("Habits | user_ids: %s, status: failed", user_ids)
+            if len(messages) == 1:
+                await self.retry_later(messages[0], user_ids[0])
+                return
+            # One failing user must not hold back the rest of the batch
+            for message, user_id in zip(messages, user_ids):
+                try:
+                    await self.delete([user_id])
+                except Exception:
+                    logging.exception("Habits | user_id: %s, status: failed", user_id)
+                    await self.retry_later(message, user_id)
+                    continue
+                await self.done(message, user_id)
+            return
+        for message, user_id in zip(messages, user_ids):
+            await self.done(message, user_id)
+        logging.info("Habits | user_ids: %s, status: deleted", user_ids)
+
+    async def delete(self, user_ids: List[int]) -> None:
+        for database, shard_user_ids in await self.shards.group(user_ids):
+            await delete_users(database, shard_user_ids, self.soft)
+
+    async def done(self, message: Any, user_id: int) -> None:
+        self._attempts.pop(user_id, None)
+        await message.ack()
+
+    async def retry_later(self, message: Any, user_id: int) -> None:
+        attempts = self._attempts[user_id] = self._attempts.get(user_id, 0) + 1
+        if attempts >= self.max_attempts:
+            del self._attempts[user_id]
+            logging.error(
+                "Habits | user_id: %s, status: dead-lettered after %s attempts",
+                user_id,
+                attempts,
+            )
+            await message.reject(requeue=False)
+            return
+        delay = min(self.retry_backoff * 2 ** (attempts - 1), self.retry_backoff_max)
+        # The message stays unacked, so not redelivered, until the backoff ends
+        task = asyncio.create_task(self._requeue(message, delay))
+        self._retries.add(task)
+        task.add_done_callback(self._retries.discard)
+
+    async def _requeue(self, message: Any, delay: float) -> None:
+        await asyncio.sleep(delay)
+        await message.nack(requeue=True)
+
+    async def run(self, queue: Any) -> None:
+        await queue.consume(self.on_message)
+        while True:
+            await self.handle_batch(await self.next_batch())
+
+
+async def main() -> None:
+    shards = get_shard_router()
+    await shards.connect()
+    connection = await aio_pika.connect_robust(host=str(settings.Rabbit_host))
+    try:
+        channel = await connection.channel()
+        await channel.set_qos(prefetch_count=settings.Rabbit_prefetch)
+        queue = await channel.declare_queue(str(settings.Rabbit_chanel))
+
+        logging.info("Waiting for messages.")
+        consumer = DeletionConsumer(
+            shards,
+            settings.Rabbit_batch_size,
+            settings.Rabbit_batch_timeout,
+            soft=settings.DELETE_MODE == "soft",
+            max_attempts=settings.Rabbit_max_attempts,
+            retry_backoff=settings.Rabbit_retry_backoff,
+            retry_backoff_max=settings.Rabbit_retry_backoff_max,
+        )
+        await consumer.run(queue)
+    finally:
+        await connection.close()
+        await shards.disconnect()
 
 
 if __name__ == "__main__":
     try:
-        main()
+        asyncio.run(main())
     except KeyboardInterrupt:
         print("Interrupted")
         try:
@@ -1,14 +1,23 @@
 import logging
-from datetime import datetime
-from typing import Any, Type
+from datetime import date, timedelta
+from typing import Any, List, Optional, Tuple, Type
 
-from fastapi import APIRouter, HTTPException, status, Depends, Body
+from fastapi import (
+    APIRouter,
+    HTTPException,
+    status,
+    Depends,
+    Body,
+    Header,
+    Query,
+    Request,
+)
+from fastapi.responses import Response, StreamingResponse
 from fastapi.security import (
     OAuth2PasswordBearer,
     OAuth2PasswordRequestForm,
     APIKeyHeader,
 )
-import requests
 
 from models.habits import (
     habits,
@@ -16,38 +25,158 @@ from models.habits import (
     HabitBase,
     UserDB,
     HabitCreate,
+    HabitCreateBatch,
     HabitUpdate,
     HabitDB,
     HabitFull,
+    HabitStats,
+    HabitSummary,
+    TrackerCheckInBatch,
+    TrackerDB,
+    habit_full,
 )  # type: ignore
 
+import bitmaps  # type: ignore
+import export  # type: ignore
+import importer  # type: ignore
+import queries  # type: ignore
+import stats  # type: ignore
+from auth import AuthClient, get_auth_client  # type: ignore
+from cache import ResponseCache, etag_matches, get_response_cache  # type: ignore
 from db import get_database  # type: ignore
 from databases import Database
 from settings import Settings  # type: ignore
+from shards import ShardRouter, get_shard_router  # type: ignore
 
 settings: Any = Settings()
 habits_router: Any = APIRouter()
 api_key_header: Any = APIKeyHeader(name="Authorization")
 
 
-async def get_current_user(token: str = Depends(api_key_header)) -> UserDB:
-    r = requests.post(
-        f"{settings.AUTH_SERVICE}/users/check-token",
-        headers={"Authorization": token},
-        timeout=5,
-    )
-    if r.status_code == 401:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
-    user_data = r.json()
+async def get_current_user(
+    token: str = Depends(api_key_header),
+    auth_client: AuthClient = Depends(get_auth_client),
+) -> UserDB:
+    user_data = await auth_client.check_token(token)
     return user_data
 
 
+def moving_error(shards: ShardRouter) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Habits are being moved, retry later",
+        headers={"Retry-After": str(int(shards.refresh))},
+    )
+
+
+async def get_user_database(
+    user: UserDB = Depends(get_current_user),
+    shards: ShardRouter = Depends(get_shard_router),
+) -> Database:
+    """
+    Database of the shard holding the current user's habits,
+    503 while rebalance.py moves the user to another shard
+    """
+    if await shards.moving(user["id"]):
+        raise moving_error(shards)
+    return await shards.database(user["id"])
+
+
+async def get_user_read_database(
+    user: UserDB = Depends(get_current_user),
+    shards: ShardRouter = Depends(get_shard_router),
+    cache: ResponseCache = Depends(get_response_cache),
+) -> Database:
+    """
+    Read replica of the current user's shard, for handlers that never write.
+    The shard itself for REPLICA_MAX_LAG seconds after the user's last write,
+    a lagging replica's response would be cached under the new epoch
+    """
+    replica = await shards.read_database(user["id"])
+    primary = await shards.database(user["id"])
+    if replica is not primary and await cache.written_recently(user["id"]):
+        return primary
+    return replica
+
+
+def get_tracker_window(
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    period: Optional[str] = Query(None, regex="^(week|month)$"),
+) -> Tuple[date, date]:
+    """
+    Trackers date window, last TRACKER_WINDOW_DAYS days by default,
+    period=week|month for the current calendar week or month
+    """
+    if period is not None and date_from is None:
+        today_day = date.today()
+        if period == "week":
+            date_from = today_day - timedelta(days=today_day.weekday())
+        else:
+            date_from = today_day.replace(day=1)
+    if date_from is None:
+        date_from = date.today() - timedelta(days=settings.TRACKER_WINDOW_DAYS)
+    if date_to is None:
+        date_to = date.max
+    return date_from, date_to
+
+
+def get_bounded_tracker_window(
+    window: Tuple[date, date] = Depends(get_tracker_window),
+) -> Tuple[date, date]:
+    """
+    Trackers date window of at most TRACKER_MAX_WINDOW_DAYS days up to today,
+    for reads returning every day of the window
+    """
+    date_from, date_to = window
+    days = (min(date_to, date.today()) - date_from).days + 1
+    if days > settings.TRACKER_MAX_WINDOW_DAYS:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Window longer than {settings.TRACKER_MAX_WINDOW_DAYS} days",
+        )
+    return window
+
+
+def materialize_trackers(
+    habit_id: int,
+    rows: List[Any],
+    date_from: date,
+    date_to: date,
+    limit: Optional[int] = None,
+) -> List[dict]:
+    """
+    Tracker rows of a habit ordered by date, every missing day of the window
+    up to today synthesized as status 0 without an id
+    """
+    trackers = {
+        str(row["date"]): {
+            "id": row["id"],
+            "habit_id": habit_id,
+            "date": str(row["date"]),
+            "status": row["status"],
+        }
+        for row in rows
+    }
+    last_day = min(date_to, date.today())
+    if limit is not None:
+        last_day = min(last_day, date_from + timedelta(days=limit - 1))
+    day = date_from
+    while day <= last_day:
+        trackers.setdefault(
+            day.isoformat(),
+            {"id": None, "habit_id": habit_id, "date": day.isoformat(), "status": 0},
+        )
+        day += timedelta(days=1)
+    return [trackers[key] for key in sorted(trackers)][:limit]
+
+
 async def get_habit_or_404(
     user_id: int, habit_id: int, database: Database = Depends(get_database)
 ) -> HabitBase:
-    query = "SELECT id, user_id, title, description FROM habits WHERE user_id = :user_id AND id = :habit_id"
     habit_db = await database.fetch_one(
-        query=query, values={"user_id": user_id, "habit_id": habit_id}
+        query=queries.habit(database.url.dialect),
+        values={"user_id": user_id, "id": habit_id},
     )
     if habit_db is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
@@ -57,15 +186,33 @@ async def get_habit_or_404(
 @habits_router.get("/habit/{id}")
 async def get_users_habit(
     id: int,
+    after: Optional[date] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    window: Tuple[date, date] = Depends(get_tracker_window),
     user: dict = Depends(get_current_user),
-    database: Database = Depends(get_database),
+    database: Database = Depends(get_user_read_database),
+    cache: ResponseCache = Depends(get_response_cache),
+    if_none_match: Optional[str] = Header(None),
 ) -> HabitFull:
     """
-    Get current_user habit by habit id
+    Get current_user habit by habit id,
+    trackers from the date window paginated by date (cursor in X-Next-Cursor),
+    304 when If-None-Match holds the current ETag
     """
-    query = """SELECT * FROM habits WHERE user_id = :user_id AND id = :id"""
+    # Missing days are synthesized up to today, the response changes daily
+    last_day = min(window[1], date.today())
+    key = cache.key(user["id"], "habit", id, *window, last_day, after, limit)
+    epoch = await cache.epoch(user["id"])
+    etag = cache.etag(key, epoch)
+    if etag_matches(etag, if_none_match):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag}
+        )
+    cached = await cache.get(key, epoch)
+    if cached is not None:
+        return cached
     habit_db = await database.fetch_one(
-        query=query,
+        query=queries.habit(database.url.dialect),
         values={
             "user_id": user["id"],
             "id": id,
@@ -73,10 +220,33 @@ async def get_users_habit(
     )
     if habit_db is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
-    query = "SELECT * FROM trackers WHERE habit_id = :id"
-    tracker_db = await database.fetch_all(query=query, values={"id": id})
-    habit_output = HabitFull(**habit_db, tracker=tracker_db)
-    return habit_output
+    date_from, date_to = window
+    if after is not None:
+        date_from = max(date_from, after + timedelta(days=1))
+    if settings.TRACKER_STORAGE == "bitmap":
+        # Decode only the days of this page
+        date_to = min(date_to, date_from + timedelta(days=limit))
+        habit_trackers = await bitmaps.fetch_trackers(
+            database, [id], date_from, date_to
+        )
+        tracker_db = habit_trackers[id][: limit + 1]
+    else:
+        rows_db = await database.fetch_all(
+            query=queries.habit_trackers_page(database.url.dialect),
+            values={
+                "id": id,
+                "date_from": date_from,
+                "date_to": date_to,
+                "limit": limit + 1,
+            },
+        )
+        tracker_db = materialize_trackers(id, rows_db, date_from, date_to, limit + 1)
+    headers = {"ETag": etag}
+    if len(tracker_db) > limit:
+        tracker_db = tracker_db[:limit]
+        headers["X-Next-Cursor"] = str(tracker_db[-1]["date"])
+    habit_output = habit_full(habit_db, tracker_db)
+    return await cache.set(key, epoch, habit_output, headers)
 
 
 @habits_router.post(
@@ -85,41 +255,61 @@ async def get_users_habit(
 async def create_habit(
     habit: HabitCreate,
     user: UserDB = Depends(get_current_user),
-    database: Database = Depends(get_database),
+    database: Database = Depends(get_user_database),
+    cache: ResponseCache = Depends(get_response_cache),
 ) -> HabitDB:
     """
-    Create a new habit for current_user
+    Create a new habit for current_user, trackers are written on check-in only
     """
-    query = """
-        INSERT INTO habits(user_id, title, description)
-        VALUES (:user_id, :title, :description)
-        """
-    new_habit = await database.execute(
-        query=query,
-        values={
-            "user_id": user["id"],
-            "title": habit.title,
-            "description": habit.description,
-        },
-    )
-    today_day = datetime.today().strftime("%d-%m-%Y")
-    trackers_query = """
-        INSERT INTO trackers(habit_id, date, status)
-        VALUES (:habit_id, :date, :status)
-        """
-    await database.execute(
-        query=trackers_query,
-        values={
-            "habit_id": new_habit,
-            "date": today_day,
-            "status": 0,
-        },
-    )
-    refresh_query = "SELECT * FROM habits WHERE id = :id"
-    refresh_habit = await database.fetch_one(
-        query=refresh_query, values={"id": new_habit}
-    )
-    return refresh_habit
+    dialect = database.url.dialect
+    async with database.transaction():
+        new_habit = await database.fetch_one(
+            query=queries.insert_habits(dialect, 1),
+            values={
+                "user_id": user["id"],
+                "title_0": habit.title,
+                "description_0": habit.description,
+                "created_at": date.today(),
+            },
+        )
+        await database.execute(
+            query=queries.insert_habit_stats(dialect, 1),
+            values={"habit_id_0": new_habit["id"]},
+        )
+    await cache.invalidate(user["id"])
+    return new_habit
+
+
+@habits_router.post(
+    "/habits", response_model=List[HabitDB], status_code=status.HTTP_201_CREATED
+)
+async def create_habits(
+    batch: HabitCreateBatch,
+    user: UserDB = Depends(get_current_user),
+    database: Database = Depends(get_user_database),
+    cache: ResponseCache = Depends(get_response_cache),
+):
+    """
+    Create many habits for current_user in one transaction
+    """
+    dialect = database.url.dialect
+    habits_values: dict = {"user_id": user["id"], "created_at": date.today()}
+    for i, habit in enumerate(batch.habits):
+        habits_values.update(
+            {f"title_{i}": habit.title, f"description_{i}": habit.description}
+        )
+    async with database.transaction():
+        new_habits = await database.fetch_all(
+            query=queries.insert_habits(dialect, len(batch.habits)),
+            values=habits_values,
+        )
+        habit_ids = {f"habit_id_{i}": habit["id"] for i, habit in enumerate(new_habits)}
+        await database.execute(
+            query=queries.insert_habit_stats(dialect, len(new_habits)),
+            values=habit_ids,
+        )
+    await cache.invalidate(user["id"])
+    return sorted(new_habits, key=lambda habit: habit["id"])
 
 
 @habits_router.put(
@@ -129,24 +319,23 @@ async def update_habit(
     id: int,
     habit: HabitUpdate,
     user: UserDB = Depends(get_current_user),
-    database: Database = Depends(get_database),
+    database: Database = Depends(get_user_database),
+    cache: ResponseCache = Depends(get_response_cache),
 ):
     """
     Update existing current_user habit by id
     """
     habit_db = await get_habit_or_404(user["id"], id, database)
-    query = (
-        "UPDATE habits SET title = :title, description = :description WHERE id = :id"
-    )
     await database.execute(
-        query=query,
+        query=queries.update_habit(database.url.dialect),
         values={
             "title": habit.title,
             "description": habit.description,
-            "id": habit_db["id"],
+            "habit_id": habit_db["id"],
         },
     )
     refresh_habit = await get_habit_or_404(user["id"], id, database)
+    await cache.invalidate(user["id"])
     return refresh_habit
 
 
@@ -155,69 +344,345 @@ async def tracker_update(
     tracker_id: int,
     status: bool,
     user: UserDB = Depends(get_current_user),
-    database: Database = Depends(get_database),
+    database: Database = Depends(get_user_database),
+    cache: ResponseCache = Depends(get_response_cache),
 ):
     """
     Update tracker by id
     """
+    dialect = database.url.dialect
     # From trackers find habit_id
-    query = "SELECT habit_id FROM trackers WHERE id = :id"
-    tracker_db = await database.fetch_one(query=query, values={"id": tracker_id})
+    tracker_db = await database.fetch_one(
+        query=queries.tracker(dialect), values={"id": tracker_id}
+    )
+    # Bitmap storage has no tracker rows, check in via PUT /trackers
+    if tracker_db is None:
+        raise HTTPException(status_code=404, detail="Wrong tracker id")
 
     # From habits find user_id by habit_id
-    query = "SELECT user_id FROM habits WHERE id = :id"
     habit_db = await database.fetch_one(
-        query=query, values={"id": tracker_db["habit_id"]}
+        query=queries.habit_owner(dialect), values={"id": tracker_db["habit_id"]}
     )
 
     # Check user id in response and user_id from habits
+    if habit_db is None:
+        raise HTTPException(status_code=404, detail="Wrong tracker id")
     if user["id"] != habit_db["user_id"]:
         raise HTTPException(status_code=409, detail="Wrong tracker id")
 
-    query = "UPDATE trackers SET status = :status WHERE id = :id"
-    await database.execute(query=query, values={"status": status, "id": tracker_id})
+    async with database.transaction():
+        await database.execute(
+            query=queries.update_tracker_status(dialect),
+            values={"status": status, "tracker_id": tracker_id},
+        )
+        day = tracker_db["date"]
+        if isinstance(day, str):
+            day = date.fromisoformat(day)
+        await stats.update_habit_stats(
+            database, {(tracker_db["habit_id"], day): int(status)}
+        )
 
-    query = "SELECT * FROM trackers WHERE id = :id"
-    tracker_refresh = await database.fetch_one(query=query, values={"id": tracker_id})
+    tracker_refresh = await database.fetch_one(
+        query=queries.tracker(dialect), values={"id": tracker_id}
+    )
 
+    await cache.invalidate(user["id"])
     return tracker_refresh
 
 
+@habits_router.put(
+    "/trackers", response_model=List[TrackerDB], status_code=status.HTTP_200_OK
+)
+async def trackers_check_in(
+    batch: TrackerCheckInBatch,
+    user: UserDB = Depends(get_current_user),
+    database: Database = Depends(get_user_database),
+    cache: ResponseCache = Depends(get_response_cache),
+):
+    """
+    Upsert many trackers by (habit_id, date) in one transaction
+    """
+    # Last entry wins for repeated (habit_id, date)
+    entries = {(t.habit_id, t.date): t.status for t in batch.trackers}
+    habit_ids = sorted({habit_id for habit_id, _ in entries})
+    values: dict = {"user_id": user["id"]}
+    values.update({f"habit_id_{i}": habit_id for i, habit_id in enumerate(habit_ids)})
+    upsert_values = {}
+    for i, ((habit_id, day), tracker_status) in enumerate(entries.items()):
+        upsert_values.update(
+            {f"habit_id_{i}": habit_id, f"date_{i}": day, f"status_{i}": tracker_status}
+        )
+    dialect = database.url.dialect
+    async with database.transaction():
+        owned_db = await database.fetch_all(
+            query=queries.owned_habit_ids(dialect, len(habit_ids)), values=values
+        )
+        if len(owned_db) != len(habit_ids):
+            raise HTTPException(status_code=409, detail="Wrong habit id")
+        if settings.TRACKER_STORAGE == "bitmap":
+            trackers_db = await bitmaps.set_statuses(database, entries)
+        else:
+            trackers_db = await database.fetch_all(
+                query=queries.upsert_trackers(dialect, len(entries)),
+                values=upsert_values,
+            )
+            await stats.update_habit_stats(database, entries)
+    await cache.invalidate(user["id"])
+    return trackers_db
+
+
+@habits_router.get("/trackers", response_model=List[TrackerDB])
+async def get_user_trackers(
+    habit_id: Optional[int] = None,
+    window: Tuple[date, date] = Depends(get_bounded_tracker_window),
+    user: UserDB = Depends(get_current_user),
+    database: Database = Depends(get_user_read_database),
+    cache: ResponseCache = Depends(get_response_cache),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Get current_user trackers from the date window, of one habit or all habits,
+    an index range scan on (habit_id, date), days without a tracker as status 0
+    """
+    # Missing days are synthesized up to today, the response changes daily
+    last_day = min(window[1], date.today())
+    key = cache.key(user["id"], "trackers", *window, last_day, habit_id)
+    epoch = await cache.epoch(user["id"])
+    etag = cache.etag(key, epoch)
+    if etag_matches(etag, if_none_match):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag}
+        )
+    cached = await cache.get(key, epoch)
+    if cached is not None:
+        return cached
+    date_from, date_to = window
+    dialect = database.url.dialect
+    one_habit = habit_id is not None
+    habits_values = {"user_id": user["id"]}
+    if one_habit:
+        habits_values["habit_id"] = habit_id
+    habits_db = await database.fetch_all(
+        query=queries.user_habit_ids(dialect, one_habit), values=habits_values
+    )
+    if not habits_db:
+        return await cache.set(key, epoch, [], {"ETag": etag})
+    if settings.TRACKER_STORAGE == "bitmap":
+        habit_trackers = await bitmaps.fetch_trackers(
+            database, [habit["id"] for habit in habits_db], date_from, date_to
+        )
+        trackers_output = [
+            {"id": None, **tracker}
+            for habit in habits_db
+            for tracker in habit_trackers[habit["id"]]
+        ]
+        return await cache.set(key, epoch, trackers_output, {"ETag": etag})
+    trackers_db = await database.fetch_all(
+        query=queries.user_trackers(dialect, one_habit),
+        values={**habits_values, "date_from": date_from, "date_to": date_to},
+    )
+    habit_trackers = {habit["id"]: [] for habit in habits_db}
+    for tracker in trackers_db:
+        habit_trackers[tracker["habit_id"]].append(tracker)
+    trackers_output = [
+        tracker
+        for habit in habits_db
+        for tracker in materialize_trackers(
+            habit["id"], habit_trackers[habit["id"]], date_from, date_to
+        )
+    ]
+    return await cache.set(key, epoch, trackers_output, {"ETag": etag})
+
+
 @habits_router.delete("/habit/{id}", status_code=status.HTTP_200_OK)
 async def delete_habit(
     id: int,
     user: UserDB = Depends(get_current_user),
-    database: Database = Depends(get_database),
+    database: Database = Depends(get_user_database),
+    cache: ResponseCache = Depends(get_response_cache),
 ):
     """
-    Delete current_user habit by id
+    Delete current_user habit by id with its trackers and stats,
+    in soft delete mode mark it for the purger
     """
-    habit_db = await get_habit_or_404(user["id"], id, database)
-    query = "DELETE FROM trackers WHERE habit_id = :habit_id"
-    await database.execute(query=query, values={"habit_id": habit_db[0]})
-    query = "DELETE FROM habits WHERE id = :id"
-    await database.execute(query=query, values={"id": habit_db[0]})
+    habit_db = await database.fetch_one(
+        query=queries.delete_habit(
+            database.url.dialect, settings.DELETE_MODE == "soft"
+        ),
+        values={"habit_id": id, "user_id": user["id"]},
+    )
+    if habit_db is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    await cache.invalidate(user["id"])
     return {"deleted": habit_db[0]}
 
 
 @habits_router.get("/list")
 async def get_user_habits_list(
+    after: int = 0,
+    limit: int = Query(100, ge=1, le=500),
+    window: Tuple[date, date] = Depends(get_bounded_tracker_window),
+    user: UserDB = Depends(get_current_user),
+    database: Database = Depends(get_user_read_database),
+    cache: ResponseCache = Depends(get_response_cache),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Get current_user habits list paginated by habit id (cursor in X-Next-Cursor),
+    trackers from the date window, 304 when If-None-Match holds the current ETag
+    """
+    # Missing days are synthesized up to today, the response changes daily
+    last_day = min(window[1], date.today())
+    key = cache.key(user["id"], "list", *window, last_day, after, limit)
+    epoch = await cache.epoch(user["id"])
+    etag = cache.etag(key, epoch)
+    if etag_matches(etag, if_none_match):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag}
+        )
+    cached = await cache.get(key, epoch)
+    if cached is not None:
+        return cached
+    dialect = database.url.dialect
+    habits_db = await database.fetch_all(
+        query=queries.habits_page(dialect),
+        values={"user_id": user["id"], "after": after, "limit": limit + 1},
+    )
+    headers = {"ETag": etag}
+    if len(habits_db) > limit:
+        habits_db = habits_db[:limit]
+        headers["X-Next-Cursor"] = str(habits_db[-1]["id"])
+    if not habits_db:
+        return await cache.set(key, epoch, [], headers)
+    date_from, date_to = window
+    if settings.TRACKER_STORAGE == "bitmap":
+        habit_trackers = await bitmaps.fetch_trackers(
+            database, [habit["id"] for habit in habits_db], date_from, date_to
+        )
+        habits_output = [
+            habit_full(habit, habit_trackers[habit["id"]]) for habit in habits_db
+        ]
+        return await cache.set(key, epoch, habits_output, headers)
+    trackers_db = await database.fetch_all(
+        query=queries.habits_page_trackers(dialect),
+        values={
+            "user_id": user["id"],
+            "after": after,
+            "last_id": habits_db[-1]["id"],
+            "date_from": date_from,
+            "date_to": date_to,
+        },
+    )
+    habit_trackers: dict = {habit["id"]: [] for habit in habits_db}
+    for tracker in trackers_db:
+        habit_trackers.setdefault(tracker["habit_id"], []).append(tracker)
+    habits_output = [
+        habit_full(
+            habit,
+            materialize_trackers(
+                habit["id"], habit_trackers[habit["id"]], date_from, date_to
+            ),
+        )
+        for habit in habits_db
+    ]
+    return await cache.set(key, epoch, habits_output, headers)
+
+
+@habits_router.get("/stats", response_model=List[HabitStats])
+async def get_user_habits_stats(
+    user: UserDB = Depends(get_current_user),
+    database: Database = Depends(get_user_read_database),
+):
+    """
+    Get current_user habits streaks, completion rates and weekday histograms
+    """
+    if settings.TRACKER_STORAGE == "bitmap":
+        return await stats.bitmap_habit_stats(database, user["id"], date.today())
+    query = stats.stats_query(database.url.dialect)
+    stats_db = await database.fetch_all(
+        query=query, values={"user_id": user["id"], "today": date.today()}
+    )
+    return [stats.habit_stats(row) for row in stats_db]
+
+
+@habits_router.get("/summary", response_model=List[HabitSummary])
+async def get_user_habits_summary(
+    user: UserDB = Depends(get_current_user),
+    database: Database = Depends(get_user_read_database),
+):
+    """
+    Get current_user habits streaks and totals from the habit_stats summary
+    """
+    if settings.TRACKER_STORAGE == "bitmap":
+        return await stats.bitmap_habit_summaries(database, user["id"], date.today())
+    summaries_db = await database.fetch_all(
+        query=queries.habit_summaries(database.url.dialect),
+        values={"user_id": user["id"]},
+    )
+    today_day = date.today()
+    return [stats.habit_summary(row, today_day) for row in summaries_db]
+
+
+@habits_router.get("/export")
+async def export_user_habits(
+    format: str = Query("ndjson", regex="^(ndjson|csv)$"),
     user: UserDB = Depends(get_current_user),
-    database: Database = Depends(get_database),
+    database: Database = Depends(get_user_read_database),
+    shards: ShardRouter = Depends(get_shard_router),
 ):
     """
-    Get current_user habits list
+    Stream current_user full habits history as NDJSON or CSV
     """
-    habits = []
-    query = "SELECT * FROM habits WHERE user_id = :user_id"
-    habits_db = await database.fetch_all(query=query, values={"user_id": user["id"]})
-    for habit in habits_db:
-        query = (
-            "SELECT id, habit_id, date, status FROM trackers WHERE habit_id = :habit_id"
+    shard = await shards.shard(user["id"])
+
+    async def check() -> None:
+        # rebalance.py deletes the old shard's rows a map refresh after the
+        # switch, a stream running across it may have missed rows
+        if await shards.shard(user["id"]) != shard:
+            raise RuntimeError(f"User {user['id']} moved shards during the export")
+
+    rows = export.export_rows(database, user["id"], settings.TRACKER_STORAGE, check)
+    if format == "csv":
+        return StreamingResponse(
+            export.encode_csv(rows),
+            media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="habits.csv"'},
         )
-        tracker_db = await database.fetch_all(
-            query=query, values={"habit_id": habit["id"]}
+    return StreamingResponse(
+        export.encode_ndjson(rows),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="habits.ndjson"'},
+    )
+
+
+@habits_router.post("/import")
+async def import_user_habits(
+    request: Request,
+    format: str = Query("ndjson", regex="^(ndjson|csv)$"),
+    user: UserDB = Depends(get_current_user),
+    database: Database = Depends(get_user_database),
+    cache: ResponseCache = Depends(get_response_cache),
+    shards: ShardRouter = Depends(get_shard_router),
+):
+    """
+    Import current_user habits history streamed as NDJSON or CSV request body,
+    503 when rebalance.py starts moving the user during the import
+    """
+
+    async def check() -> None:
+        if await shards.moving(user["id"]):
+            raise moving_error(shards)
+
+    parse = importer.parse_csv if format == "csv" else importer.parse_ndjson
+    try:
+        report = await importer.import_trackers(
+            database,
+            user["id"],
+            parse(request.stream()),
+            settings.TRACKER_STORAGE,
+            check=check,
         )
-        habit_full = HabitFull(**habit, tracker=tracker_db)
-        habits.append(habit_full)
-    return habits
+    finally:
+        # Chunks committed before a failure are visible too
+        await cache.invalidate(user["id"])
+    return report
@@ -1,13 +1,64 @@
+from typing import Dict, List, Optional
+
 from pydantic import BaseSettings
 
 
 class Settings(BaseSettings):
     debug = True
     database_habits: str
+    DATABASE_SHARDS: List[str] = []  # shard URLs, database_habits alone if empty
+    SHARD_MAP_REFRESH: float = 30
+    SHARD_ID_RANGE: int = 100_000_000  # habit and tracker ids per shard
+    DATABASE_REPLICAS: Dict[int, List[str]] = {}  # shard -> read replica URLs
+    REPLICA_HEALTH_INTERVAL: float = 5
+    REPLICA_HEALTH_TIMEOUT: float = 1
+    REPLICA_MAX_LAG: float = 5  # reads of a user go to the primary after a write
+    DB_POOL_MIN_SIZE: int = 5
+    DB_POOL_MAX_SIZE: int = 20
+    DB_CONNECT_TIMEOUT: float = 10
+    DB_COMMAND_TIMEOUT: Optional[float] = None
+    DB_STATEMENT_CACHE_SIZE: int = 100  # 0 behind pgbouncer in transaction mode
+    SQLITE_JOURNAL_MODE: str = "WAL"
+    SQLITE_SYNCHRONOUS: str = "NORMAL"
+    SQLITE_BUSY_TIMEOUT: float = 5
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024
+    SQLITE_FOREIGN_KEYS: bool = True
+    SLOW_QUERY_MS: float = 100
+    SLOW_REQUEST_MS: float = 500
     BACKEND: str
     AUTH_SERVICE: str
+    AUTH_TIMEOUT: float = 5
+    AUTH_MAX_CONNECTIONS: int = 100
+    AUTH_CACHE_SIZE: int = 10000
+    AUTH_CACHE_TTL: float = 60
+    AUTH_NEGATIVE_CACHE_TTL: float = 10
+    AUTH_MODE: str = "remote"  # remote | jwt
+    AUTH_JWT_SECRET: Optional[str] = None
+    AUTH_JWT_KEYS_FILE: Optional[str] = None  # PEM public key or JWKS
+    AUTH_JWT_KEYS_RELOAD: float = 60
+    AUTH_JWT_ALGORITHMS: List[str] = ["HS256", "RS256", "ES256"]
+    AUTH_JWT_AUDIENCE: Optional[str] = None
+    AUTH_JWT_ISSUER: Optional[str] = None
+    AUTH_JWT_LEEWAY: float = 30
+    TRACKER_WINDOW_DAYS: int = 30
+    TRACKER_MAX_WINDOW_DAYS: int = 366  # /list and /trackers, not paginated by date
+    TRACKER_STORAGE: str = "rows"  # rows | bitmap
+    DELETE_MODE: str = "hard"  # hard | soft
+    PURGE_BATCH_ROWS: int = 1000
+    PURGE_PAUSE: float = 0.05
+    PURGE_INTERVAL: float = 60
+    CACHE_BACKEND: str = "memory"  # memory | redis
+    CACHE_URL: str = "redis://localhost:6379/0"
+    CACHE_SIZE: int = 10000
+    CACHE_TTL: float = 300
     Rabbit_host: str
     Rabbit_chanel: str
+    Rabbit_prefetch: int = 200
+    Rabbit_batch_size: int = 100
+    Rabbit_batch_timeout: float = 0.5
+    Rabbit_max_attempts: int = 5
+    Rabbit_retry_backoff: float = 1
+    Rabbit_retry_backoff_max: float = 60
 
     class Config:
-        env_file = ".env"
\ No newline at end of file
+        env_file = ".env"
@@ -0,0 +1,162 @@
+"""
+Horizontal sharding of habit data by user_id.
+
+Every habit, tracker, bitmap and stats row of a user lives in one of the
+DATABASE_SHARDS databases, SQLite files or PostgreSQL DSNs. A user lives on
+shard user_id % N unless rebalance.py moved or pinned it, moves are recorded
+in the user_shards table of the first shard and reloaded every
+SHARD_MAP_REFRESH seconds. Adding a shard changes N, see rebalance.py for the
+procedure. A user being moved keeps its entry on the old shard with the moving
+flag set, the API rejects the user's writes until the move switches it.
+Without DATABASE_SHARDS there is one shard, the database_habits one.
+Reads may go to the DATABASE_REPLICAS of the user's shard, see db.ReplicaPool.
+"""
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from databases import Database
+
+import queries
+from db import ReplicaPool, create_database, database
+from metrics import InstrumentedDatabase
+from settings import Settings
+
+
+settings = Settings()
+
+
+class ShardRouter:
+    """
+    user_id -> Database of the shard holding the user's rows
+    """
+
+    def __init__(
+        self,
+        databases: List[Database],
+        refresh: float = 30,
+        timer: Callable[[], float] = time.monotonic,
+        replicas: Optional[Dict[int, List[Database]]] = None,
+        health_interval: float = 5,
+        health_timeout: float = 1,
+    ) -> None:
+        self.databases = databases
+        self.refresh = refresh
+        self._timer = timer
+        self.pools = [
+            ReplicaPool(
+                shard_database,
+                (replicas or {}).get(shard, []),
+                health_interval,
+                health_timeout,
+                timer,
+            )
+            for shard, shard_database in enumerate(databases)
+        ]
+        self._moved: Dict[int, int] = {}
+        self._moving: Set[int] = set()
+        self._loaded_at: Optional[float] = None
+
+    @property
+    def directory(self) -> Database:
+        return self.databases[0]
+
+    @property
+    def size(self) -> int:
+        return len(self.databases)
+
+    def home(self, user_id: int) -> int:
+        return user_id % self.size
+
+    async def connect(self) -> None:
+        for pool in self.pools:
+            await pool.connect()
+
+    async def disconnect(self) -> None:
+        for pool in self.pools:
+            await pool.disconnect()
+
+    async def load_map(self) -> None:
+        self._loaded_at = self._timer()
+        rows = await self.directory.fetch_all(
+            query=queries.user_shards_map(self.directory.url.dialect)
+        )
+        self._moved = {row["user_id"]: row["shard"] for row in rows}
+        self._moving = {row["user_id"] for row in rows if row["moving"]}
+
+    async def _refresh(self) -> None:
+        if self._loaded_at is None or self._timer() - self._loaded_at >= self.refresh:
+            await self.load_map()
+
+    async def shard(self, user_id: int) -> int:
+        if self.size == 1:
+            return 0
+        await self._refresh()
+        return self._moved.get(user_id, self.home(user_id))
+
+    async def moving(self, user_id: int) -> bool:
+        if self.size == 1:
+            return False
+        await self._refresh()
+        return user_id in self._moving
+
+    async def database(self, user_id: int) -> Database:
+        return self.databases[await self.shard(user_id)]
+
+    async def read_database(self, user_id: int) -> Database:
+        """
+        A healthy replica of the user's shard, the shard itself without one
+        """
+        return await self.pools[await self.shard(user_id)].read()
+
+    async def group(self, user_ids: List[int]) -> List[Tuple[Database, List[int]]]:
+        """
+        user_ids split by shard, shards without users left out
+        """
+        groups: Dict[int, List[int]] = {}
+        for user_id in user_ids:
+            groups.setdefault(await self.shard(user_id), []).append(user_id)
+        return [(self.databases[shard], ids) for shard, ids in sorted(groups.items())]
+
+    async def set_shard(self, user_id: int, shard: int, moving: bool = False) -> None:
+        """
+        Record user_id on shard in the directory, a user back home has no entry
+        unless moving
+        """
+        dialect = self.directory.url.dialect
+        if shard == self.home(user_id) and not moving:
+            await self.directory.execute(
+                query=queries.delete_user_shard(dialect), values={"user_id": user_id}
+            )
+        else:
+            await self.directory.execute(
+                query=queries.set_user_shard(dialect),
+                values={"user_id": user_id, "shard": shard, "moving": moving},
+            )
+        await self.load_map()
+
+
+def create_shard_router() -> ShardRouter:
+    # The first shard is the db.py database
+    databases = [database] + [
+        InstrumentedDatabase(create_database(url))
+        for url in settings.DATABASE_SHARDS[1:]
+    ]
+    replicas = {
+        shard: [InstrumentedDatabase(create_database(url)) for url in urls]
+        for shard, urls in settings.DATABASE_REPLICAS.items()
+    }
+    return ShardRouter(
+        databases,  # type: ignore
+        settings.SHARD_MAP_REFRESH,
+        replicas=replicas,  # type: ignore
+        health_interval=settings.REPLICA_HEALTH_INTERVAL,
+        health_timeout=settings.REPLICA_HEALTH_TIMEOUT,
+    )
+
+
+shard_router = create_shard_router()
+
+
+# Dependency
+def get_shard_router() -> ShardRouter:
+    return shard_router
@@ -0,0 +1,400 @@
+"""
+Habit statistics computed in SQL over the trackers table,
+and the habit_stats summary table maintained on tracker writes.
+Bitmap tracker storage has neither, its statistics are computed from
+habit_bitmaps on read.
+
+    python stats.py rebuild    # regenerate habit_stats from trackers
+"""
+import asyncio
+import sys
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from databases import Database
+
+import bitmaps
+from shards import get_shard_router
+
+
+DIALECT_DAY = {
+    "sqlite": "CAST(julianday({}) AS INTEGER)",
+    "postgresql": "(CAST({} AS DATE) - DATE '2000-01-01')",
+}
+DIALECT_WEEKDAY = {
+    "sqlite": "CAST(strftime('%w', {}) AS INTEGER)",
+    "postgresql": "CAST(EXTRACT(DOW FROM CAST({} AS DATE)) AS INTEGER)",
+}
+RATE_WINDOWS = (7, 30, 365)
+SUMMARY_COLUMNS = (
+    "habit_id",
+    "current_streak",
+    "longest_streak",
+    "last_checkin",
+    "total_completions",
+)
+USER_BITMAPS = """
+    SELECT h.id, h.created_at, b.year, b.bits
+    FROM habits h LEFT JOIN habit_bitmaps b ON b.habit_id = h.id
+    WHERE h.user_id = :user_id AND h.deleted_at IS NULL
+    ORDER BY h.id
+    """
+
+
+@lru_cache()
+def stats_query(dialect: str) -> str:
+    """
+    Streaks, completion rates and weekday histogram of every user habit, one query.
+    Streaks are islands of consecutive done days: day - row_number() is constant
+    along an island.
+    """
+    day = DIALECT_DAY[dialect]
+    weekday = DIALECT_WEEKDAY[dialect]
+    today = day.format(":today")
+    done_in_window = ",\n".join(
+        f"SUM(CASE WHEN status = 1 AND day > {today} - {n} THEN 1 ELSE 0 END) AS done_{n}"
+        for n in RATE_WINDOWS
+    )
+    created = day.format("h.created_at")
+    # Check-ins backdated before the habit was created start the rates earlier
+    tracked_days = (
+        f"{today} - CASE WHEN t.first_day < {created} THEN t.first_day"
+        f" ELSE {created} END + 1 AS tracked_days"
+    )
+    totals = ", ".join(
+        [tracked_days]
+        + [f"COALESCE(t.done_{n}, 0) AS done_{n}" for n in RATE_WINDOWS]
+        + [f"t.weekday_{n}" for n in range(7)]
+    )
+    weekdays = ",\n".join(
+        f"SUM(CASE WHEN status = 1 AND weekday = {n} THEN 1 ELSE 0 END) AS weekday_{n}"
+        for n in range(7)
+    )
+    return f"""
+        WITH days AS (
+            SELECT t.habit_id, t.status,
+                {day.format("t.date")} AS day,
+                {weekday.format("t.date")} AS weekday
+            FROM trackers t JOIN habits h ON h.id = t.habit_id
+            WHERE h.user_id = :user_id AND h.deleted_at IS NULL AND t.date <= :today
+        ),
+        islands AS (
+            SELECT habit_id, day,
+                day - ROW_NUMBER() OVER (PARTITION BY habit_id ORDER BY day) AS island
+            FROM days WHERE status = 1
+        ),
+        streaks AS (
+            SELECT habit_id, COUNT(*) AS length, MAX(day) AS last_day
+            FROM islands GROUP BY habit_id, island
+        ),
+        habit_streaks AS (
+            SELECT habit_id,
+                MAX(length) AS longest_streak,
+                MAX(CASE WHEN last_day >= {today} - 1 THEN length ELSE 0 END)
+                    AS current_streak
+            FROM streaks GROUP BY habit_id
+        ),
+        totals AS (
+            SELECT habit_id, MIN(day) AS first_day,
+            {done_in_window},
+            {weekdays}
+            FROM days GROUP BY habit_id
+        )
+        SELECT h.id AS habit_id,
+            COALESCE(s.current_streak, 0) AS current_streak,
+            COALESCE(s.longest_streak, 0) AS longest_streak,
+            {totals}
+        FROM habits h
+        LEFT JOIN habit_streaks s ON s.habit_id = h.id
+        LEFT JOIN totals t ON t.habit_id = h.id
+        WHERE h.user_id = :user_id AND h.deleted_at IS NULL
+        ORDER BY h.id
+        """
+
+
+def habit_stats(row) -> dict:
+    """
+    Stats query row as a HabitStats dict, weekdays from Monday
+    """
+    # A habit created on the server's tomorrow has no tracked day yet
+    tracked_days = max(row["tracked_days"] or 0, 0)
+    completion = {
+        f"completion_{n}": (
+            row[f"done_{n}"] / min(n, tracked_days) if tracked_days else 0.0
+        )
+        for n in RATE_WINDOWS
+    }
+    weekdays = [row[f"weekday_{n}"] or 0 for n in (1, 2, 3, 4, 5, 6, 0)]
+    return {
+        "habit_id": row["habit_id"],
+        "current_streak": row["current_streak"],
+        "longest_streak": row["longest_streak"],
+        **completion,
+        "weekdays": weekdays,
+    }
+
+
+def rebuild_query(dialect: str, habit_ids_in: Optional[str] = None) -> str:
+    """
+    habit_stats rows regenerated from trackers, for habit ids placeholders or every habit
+    """
+    day = DIALECT_DAY[dialect]
+    trackers_filter = f"AND habit_id IN ({habit_ids_in})" if habit_ids_in else ""
+    habits_filter = f"WHERE h.id IN ({habit_ids_in})" if habit_ids_in else ""
+    return f"""
+        INSERT INTO habit_stats
+            (habit_id, current_streak, longest_streak, last_checkin, total_completions)
+        WITH islands AS (
+            SELECT habit_id, date,
+                {day.format("date")}
+                    - ROW_NUMBER() OVER (PARTITION BY habit_id ORDER BY date) AS island
+            FROM trackers
+            WHERE status = 1 {trackers_filter}
+        ),
+        streaks AS (
+            SELECT habit_id, COUNT(*) AS length, MAX(date) AS last_date
+            FROM islands GROUP BY habit_id, island
+        ),
+        habit_streaks AS (
+            SELECT habit_id, length, last_date,
+                MAX(last_date) OVER (PARTITION BY habit_id) AS last_checkin
+            FROM streaks
+        ),
+        totals AS (
+            SELECT habit_id,
+                MAX(CASE WHEN last_date = last_checkin THEN length ELSE 0 END)
+                    AS current_streak,
+                MAX(length) AS longest_streak,
+                MAX(last_checkin) AS last_checkin,
+                SUM(length) AS total_completions
+            FROM habit_streaks GROUP BY habit_id
+        )
+        SELECT h.id,
+            COALESCE(t.current_streak, 0),
+            COALESCE(t.longest_streak, 0),
+            t.last_checkin,
+            COALESCE(t.total_completions, 0)
+        FROM habits h LEFT JOIN totals t ON t.habit_id = h.id
+        {habits_filter}
+        """
+
+
+async def rebuild_habit_stats(
+    database: Database, habit_ids: Optional[Iterable[int]] = None
+) -> None:
+    """
+    Regenerate habit_stats from trackers, for habit_ids or every habit
+    """
+    values: dict = {}
+    habit_ids_in = None
+    query = "DELETE FROM habit_stats"
+    if habit_ids is not None:
+        values = {f"habit_id_{i}": habit_id for i, habit_id in enumerate(habit_ids)}
+        if not values:
+            return
+        habit_ids_in = ", ".join(f":{key}" for key in values)
+        query += f" WHERE habit_id IN ({habit_ids_in})"
+    async with database.transaction():
+        await database.execute(query=query, values=values)
+        await database.execute(
+            query=rebuild_query(database.url.dialect, habit_ids_in), values=values
+        )
+
+
+async def update_habit_stats(
+    database: Database, entries: Dict[Tuple[int, date], int]
+) -> None:
+    """
+    Apply (habit_id, date) -> status tracker writes to habit_stats.
+    Check-ins after a habit's last check-in extend or restart its streak in place,
+    any earlier write rebuilds that habit from trackers. Call inside a transaction
+    """
+    habit_ids = sorted({habit_id for habit_id, _ in entries})
+    values = {f"habit_id_{i}": habit_id for i, habit_id in enumerate(habit_ids)}
+    query = "SELECT * FROM habit_stats WHERE habit_id IN ({})".format(
+        ", ".join(f":{key}" for key in values)
+    )
+    if database.url.dialect == "postgresql":
+        # Concurrent check-ins of a habit on other days would both update it
+        query += " FOR UPDATE"
+    summaries = {
+        row["habit_id"]: dict(row._mapping)
+        for row in await database.fetch_all(query=query, values=values)
+    }
+    rebuild = set(habit_ids) - set(summaries)
+    for (habit_id, day), status in sorted(entries.items()):
+        if habit_id in rebuild:
+            continue
+        summary = summaries[habit_id]
+        last_checkin = summary["last_checkin"]
+        if isinstance(last_checkin, str):
+            last_checkin = date.fromisoformat(last_checkin)
+        if last_checkin is not None and day <= last_checkin:
+            rebuild.add(habit_id)
+            continue
+        if not status:
+            continue
+        if last_checkin is not None and day == last_checkin + timedelta(days=1):
+            summary["current_streak"] += 1
+        else:
+            summary["current_streak"] = 1
+        summary["longest_streak"] = max(
+            summary["longest_streak"], summary["current_streak"]
+        )
+        summary["last_checkin"] = day
+        summary["total_completions"] += 1
+        summary["changed"] = True
+    changed = [
+        summary
+        for habit_id, summary in summaries.items()
+        if summary.get("changed") and habit_id not in rebuild
+    ]
+    if changed:
+        rows = []
+        values = {}
+        for i, summary in enumerate(changed):
+            rows.append(
+                f"(:habit_id_{i}, :current_streak_{i}, :longest_streak_{i}, "
+                f":last_checkin_{i}, :total_completions_{i})"
+            )
+            values.update({f"{key}_{i}": summary[key] for key in SUMMARY_COLUMNS})
+        query = """
+            INSERT INTO habit_stats
+                (habit_id, current_streak, longest_streak, last_checkin, total_completions)
+            VALUES {}
+            ON CONFLICT (habit_id) DO UPDATE SET
+                current_streak = excluded.current_streak,
+                longest_streak = excluded.longest_streak,
+                last_checkin = excluded.last_checkin,
+                total_completions = excluded.total_completions
+            """.format(
+            ", ".join(rows)
+        )
+        await database.execute(query=query, values=values)
+    if rebuild:
+        await rebuild_habit_stats(database, sorted(rebuild))
+
+
+def habit_summary(row, today: date) -> dict:
+    """
+    habit_stats row as a HabitSummary dict, a streak not extended since
+    yesterday is over
+    """
+    last_checkin = row["last_checkin"]
+    if isinstance(last_checkin, str):
+        last_checkin = date.fromisoformat(last_checkin)
+    current_streak = row["current_streak"]
+    if last_checkin is None or last_checkin < today - timedelta(days=1):
+        current_streak = 0
+    return {
+        "habit_id": row["habit_id"],
+        "current_streak": current_streak,
+        "longest_streak": row["longest_streak"],
+        "last_checkin": last_checkin,
+        "total_completions": row["total_completions"],
+    }
+
+
+async def bitmap_done_days(
+    database: Database, user_id: int
+) -> Dict[int, Tuple[date, List[date]]]:
+    """
+    habit id -> created_at and sorted done days of every user habit,
+    from habit_bitmaps
+    """
+    habits: Dict[int, Tuple[date, List[date]]] = {}
+    rows = await database.fetch_all(query=USER_BITMAPS, values={"user_id": user_id})
+    for row in rows:
+        created_at = row["created_at"]
+        if isinstance(created_at, str):
+            created_at = date.fromisoformat(created_at)
+        _, days = habits.setdefault(row["id"], (created_at, []))
+        if row["bits"] is not None:
+            days.extend(bitmaps.done_days(row["year"], bytes(row["bits"])))
+    for _, days in habits.values():
+        days.sort()
+    return habits
+
+
+def streaks(days: List[date]) -> List[Tuple[int, date]]:
+    """
+    Length and last day of every run of consecutive days, days sorted
+    """
+    runs: List[Tuple[int, date]] = []
+    for day in days:
+        if runs and day - runs[-1][1] == timedelta(days=1):
+            runs[-1] = (runs[-1][0] + 1, day)
+        else:
+            runs.append((1, day))
+    return runs
+
+
+async def bitmap_habit_stats(
+    database: Database, user_id: int, today: date
+) -> List[dict]:
+    """
+    HabitStats dicts of every user habit from habit_bitmaps, as habit_stats
+    builds them from stats_query rows
+    """
+    stats = []
+    habits = await bitmap_done_days(database, user_id)
+    for habit_id, (created_at, habit_days) in habits.items():
+        days = [day for day in habit_days if day <= today]
+        runs = streaks(days)
+        yesterday = today - timedelta(days=1)
+        first_days = [day for day in (created_at, *days[:1]) if day is not None]
+        row = {
+            "habit_id": habit_id,
+            "current_streak": max(
+                [length for length, last_day in runs if last_day >= yesterday],
+                default=0,
+            ),
+            "longest_streak": max([length for length, _ in runs], default=0),
+            "tracked_days": (today - min(first_days)).days + 1 if first_days else 0,
+        }
+        for n in RATE_WINDOWS:
+            row[f"done_{n}"] = sum(day > today - timedelta(days=n) for day in days)
+        for n in range(7):
+            # stats_query numbers weekdays from Sunday
+            row[f"weekday_{n}"] = sum((day.weekday() + 1) % 7 == n for day in days)
+        stats.append(habit_stats(row))
+    return stats
+
+
+async def bitmap_habit_summaries(
+    database: Database, user_id: int, today: date
+) -> List[dict]:
+    """
+    HabitSummary dicts of every user habit from habit_bitmaps
+    """
+    summaries = []
+    habits = await bitmap_done_days(database, user_id)
+    for habit_id, (_, days) in habits.items():
+        runs = streaks(days)
+        row = {
+            "habit_id": habit_id,
+            "current_streak": runs[-1][0] if runs else 0,
+            "longest_streak": max([length for length, _ in runs], default=0),
+            "last_checkin": days[-1] if days else None,
+            "total_completions": len(days),
+        }
+        summaries.append(habit_summary(row, today))
+    return summaries
+
+
+async def main(command: str) -> None:
+    shards = get_shard_router()
+    await shards.connect()
+    try:
+        if command == "rebuild":
+            for shard, database in enumerate(shards.databases):
+                await rebuild_habit_stats(database)
+                count = await database.fetch_val("SELECT COUNT(*) FROM habit_stats")
+                print(f"Habit stats rebuilt on shard {shard}: {count}")
+    finally:
+        await shards.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "rebuild"))
@@ -3,10 +3,20 @@ import random
 from typing import Any
 from datetime import datetime, timedelta
 
+import httpx
 import pytest
+import pytest_asyncio
 import requests
-
+import sqlalchemy
+from databases import Database
+
+from cache import LRUBackend, ResponseCache, get_response_cache  # type: ignore
+from db import create_database, get_database, metadata  # type: ignore
+from main import app  # type: ignore
+from queries import NEXT_ID  # type: ignore
+from routers.habits import get_current_user  # type: ignore
 from settings import Settings  # type: ignore
+from shards import ShardRouter, get_shard_router  # type: ignore
 
 
 settings: Any = Settings()
@@ -75,7 +85,7 @@ def new_habit(database, user):
     habit_db = cur.execute(
         "SELECT id, title, description FROM habits WHERE title = ?", (data["title"],)
     ).fetchone()
-    today_day = datetime.today().strftime("%d-%m-%Y")
+    today_day = datetime.today().strftime("%Y-%m-%d")
     cur.execute(
         "INSERT INTO trackers(habit_id, date, status) VALUES (?, ?, ?)",
         (habit_db[0], today_day, 0),
@@ -88,7 +98,7 @@ def new_habit(database, user):
 def inserted_habits(database, user):
     count = 6
     habits = []
-    # today_day = datetime.today().strftime("%d-%m-%Y")
+    # today_day = datetime.today().strftime("%Y-%m-%d")
     today_day = datetime.today()
     cur = database.cursor()
     for i in range(count):
@@ -104,7 +114,92 @@ def inserted_habits(database, user):
         ).fetchone()
         cur.execute(
             "INSERT INTO trackers (habit_id, date, status) VALUES (?, ?, ?)",
-            (habit_db[0], date.strftime("%d-%m-%Y"), 0),
+            (habit_db[0], date.strftime("%Y-%m-%d"), 0),
         )
         database.commit()
     return count
+
+
+class QueryCounter:
+    """
+    Records every query issued through a databases.Database
+    """
+
+    def __init__(self, database: Database) -> None:
+        self.queries: list = []
+        for name in ("fetch_all", "fetch_one", "fetch_val", "execute", "execute_many"):
+            setattr(database, name, self._wrap(name, getattr(database, name)))
+
+    def _wrap(self, name, method):
+        async def wrapper(query, values=None, *args, **kwargs):
+            self.queries.append((query, values))
+            return await method(query, values, *args, **kwargs)
+
+        return wrapper
+
+    def reset(self) -> None:
+        self.queries.clear()
+
+    def __len__(self) -> int:
+        return len(self.queries)
+
+
+@pytest.fixture(scope="function")
+def local_user():
+    return {"id": 1, "email": "pytest@ppp.com", "username": "pytest"}
+
+
+@pytest_asyncio.fixture(scope="function")
+async def local_database(tmp_path):
+    url = f"sqlite:///{tmp_path / 'habits.db'}"
+    metadata.create_all(sqlalchemy.create_engine(url))
+    database = create_database(url)
+    await database.connect()
+    yield database
+    await database.disconnect()
+
+
+@pytest.fixture(scope="function")
+def response_cache():
+    return ResponseCache(LRUBackend(maxsize=100), ttl=60)
+
+
+@pytest_asyncio.fixture(scope="function")
+async def client(local_database, local_user, response_cache):
+    app.dependency_overrides[get_database] = lambda: local_database
+    app.dependency_overrides[get_shard_router] = lambda: ShardRouter([local_database])
+    app.dependency_overrides[get_current_user] = lambda: local_user
+    app.dependency_overrides[get_response_cache] = lambda: response_cache
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+        yield c
+    app.dependency_overrides.clear()
+
+
+async def seed_habits(database: Database, user_id: int, count: int, days: int = 1):
+    """
+    Insert count habits for user_id, each with one tracker per day for days,
+    ids from the shard's id range like the app's inserts
+    """
+    habit_ids = []
+    today_day = datetime.today()
+    next_habit_id = NEXT_ID.format(table="habits", offset=0)
+    next_tracker_id = NEXT_ID.format(table="trackers", offset=0)
+    for i in range(count):
+        habit_id = await database.execute(
+            f"INSERT INTO habits(id, user_id, title, description) VALUES ({next_habit_id}, :user_id, :title, :description)",
+            values={"user_id": user_id, "title": f"test_{i}", "description": None},
+        )
+        await database.execute_many(
+            f"INSERT INTO trackers(id, habit_id, date, status) VALUES ({next_tracker_id}, :habit_id, :date, :status)",
+            values=[
+                {
+                    "habit_id": habit_id,
+                    "date": (today_day - timedelta(days=day)).strftime("%Y-%m-%d"),
+                    "status": day % 2,
+                }
+                for day in range(days)
+            ],
+        )
+        habit_ids.append(habit_id)
+    return habit_ids
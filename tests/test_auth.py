@@ -0,0 +1,232 @@
+import asyncio
+import json
+import os
+import time
+
+import httpx
+import jwt
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import HTTPException
+
+from auth import AuthClient, JWTVerifier, TokenCache  # type: ignore
+
+USER = {"id": 1, "email": "pytest@ppp.com", "username": "pytest"}
+SECRET = "habits-test-secret-of-32-bytes-ok"
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_client(
+    calls: list, clock: Clock, delay: float = 0, verifier: JWTVerifier = None
+) -> AuthClient:
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.headers["Authorization"])
+        await asyncio.sleep(delay)
+        if request.headers["Authorization"] == "Bearer valid":
+            return httpx.Response(200, json=USER)
+        return httpx.Response(401, json={"detail": "Unauthorized"})
+
+    cache = TokenCache(maxsize=2, ttl=60, negative_ttl=10, timer=clock)
+    return AuthClient(
+        "http://auth",
+        cache,
+        transport=httpx.MockTransport(handler),
+        verifier=verifier,
+    )
+
+
+def make_token(key, algorithm: str = "HS256", kid: str = None, **claims) -> str:
+    payload = {**USER, "exp": int(time.time()) + 60, **claims}
+    headers = {"kid": kid} if kid else None
+    return "Bearer " + jwt.encode(payload, key, algorithm=algorithm, headers=headers)
+
+
+def rsa_key() -> rsa.RSAPrivateKey:
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def write_jwks(path, keys: dict) -> None:
+    jwks = []
+    for kid, key in keys.items():
+        jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(key.public_key()))
+        jwks.append({**jwk, "kid": kid, "alg": "RS256"})
+    path.write_text(json.dumps({"keys": jwks}))
+    # Rewrites within the filesystem timestamp resolution still count as changes
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+@pytest.mark.asyncio
+async def test_check_token_cached() -> None:
+    """
+    GIVEN a valid token checked twice
+    WHEN AuthClient.check_token
+    THEN check the auth service is called once until the TTL expires
+    """
+    calls: list = []
+    clock = Clock()
+    client = make_client(calls, clock)
+
+    assert await client.check_token("Bearer valid") == USER
+    assert await client.check_token("Bearer valid") == USER
+    assert len(calls) == 1
+
+    clock.now = 61
+    assert await client.check_token("Bearer valid") == USER
+    assert len(calls) == 2
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_check_token_coalesced() -> None:
+    """
+    GIVEN many concurrent checks of the same token
+    WHEN AuthClient.check_token
+    THEN check only one request reaches the auth service
+    """
+    calls: list = []
+    client = make_client(calls, Clock(), delay=0.05)
+
+    users = await asyncio.gather(
+        *[client.check_token("Bearer valid") for _ in range(20)]
+    )
+
+    assert users == [USER] * 20
+    assert len(calls) == 1
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_check_token_negative_cache() -> None:
+    """
+    GIVEN an invalid token checked twice
+    WHEN AuthClient.check_token
+    THEN check 401 both times, auth service called once within negative TTL
+    """
+    calls: list = []
+    clock = Clock()
+    client = make_client(calls, clock)
+
+    for _ in range(2):
+        with pytest.raises(HTTPException) as exc:
+            await client.check_token("Bearer invalid")
+        assert exc.value.status_code == 401
+    assert len(calls) == 1
+
+    clock.now = 11
+    with pytest.raises(HTTPException):
+        await client.check_token("Bearer invalid")
+    assert len(calls) == 2
+    await client.close()
+
+
+def test_token_cache_lru_eviction() -> None:
+    """
+    GIVEN a full cache
+    WHEN a new token is stored
+    THEN check the least recently used token is evicted
+    """
+    cache = TokenCache(maxsize=2, ttl=60, negative_ttl=10, timer=Clock())
+    cache.set("a", USER)
+    cache.set("b", USER)
+    cache.get("a")
+    cache.set("c", USER)
+
+    assert cache.get("a") == (True, USER)
+    assert cache.get("b") == (False, None)
+    assert len(cache) == 2
+
+
+@pytest.mark.asyncio
+async def test_jwt_verified_locally() -> None:
+    """
+    GIVEN a verifier with the shared secret
+    WHEN valid, expired and foreign HS256 tokens checked
+    THEN check the user built from claims without an auth service call, 401 otherwise
+    """
+    calls: list = []
+    client = make_client(calls, Clock(), verifier=JWTVerifier(secret=SECRET))
+
+    assert await client.check_token(make_token(SECRET)) == USER
+    for token in (
+        make_token(SECRET, exp=int(time.time()) - 60),
+        make_token(SECRET[::-1]),
+        make_token(SECRET, email=None),
+    ):
+        with pytest.raises(HTTPException) as exc:
+            await client.check_token(token)
+        assert exc.value.status_code == 401
+    assert calls == []
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_opaque_token_checked_remotely() -> None:
+    """
+    GIVEN a verifier with the shared secret
+    WHEN an opaque token checked
+    THEN check it is sent to the auth service
+    """
+    calls: list = []
+    client = make_client(calls, Clock(), verifier=JWTVerifier(secret=SECRET))
+
+    assert await client.check_token("Bearer valid") == USER
+    assert calls == ["Bearer valid"]
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_jwt_public_key_file(tmp_path) -> None:
+    """
+    GIVEN a verifier with a PEM public key file
+    WHEN RS256 tokens signed with the matching and another private key checked
+    THEN check the first verified locally and the second rejected
+    """
+    key = rsa_key()
+    path = tmp_path / "public.pem"
+    path.write_bytes(
+        key.public_key().public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo,
+        )
+    )
+    client = make_client([], Clock(), verifier=JWTVerifier(keys_file=str(path)))
+
+    assert await client.check_token(make_token(key, "RS256")) == USER
+    with pytest.raises(HTTPException):
+        await client.check_token(make_token(rsa_key(), "RS256"))
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_jwks_key_rotation(tmp_path) -> None:
+    """
+    GIVEN a verifier with a JWKS file holding key k1
+    WHEN k2 is added to the file and a token signed with k2 checked
+    THEN check the file is re-read on the unknown kid and the token verified locally
+    """
+    calls: list = []
+    k1, k2 = rsa_key(), rsa_key()
+    path = tmp_path / "jwks.json"
+    write_jwks(path, {"k1": k1})
+    verifier = JWTVerifier(keys_file=str(path), reload_interval=3600)
+    client = make_client(calls, Clock(), verifier=verifier)
+
+    assert await client.check_token(make_token(k1, "RS256", kid="k1")) == USER
+    write_jwks(path, {"k1": k1, "k2": k2})
+    assert await client.check_token(make_token(k2, "RS256", kid="k2")) == USER
+    assert calls == []
+
+    # A kid still unknown after the reload is left to the auth service
+    with pytest.raises(HTTPException):
+        await client.check_token(make_token(rsa_key(), "RS256", kid="k3"))
+    assert len(calls) == 1
+    await client.close()
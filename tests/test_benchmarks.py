@@ -0,0 +1,28 @@
+import pytest
+
+from benchmarks import suite
+from routers.habits import habits_router  # type: ignore
+
+
+@pytest.mark.asyncio
+async def test_benchmark_suite_smoke() -> None:
+    """
+    GIVEN a tiny seeded database and the auth stand-in
+    WHEN the benchmark suite drives every route
+    THEN check every habits route reported without errors, one auth call per user
+    """
+    report = await suite.run(
+        users=2, habits=2, days=10, requests=4, concurrency=2, auth_latency=0
+    )
+
+    routes = {
+        f"{method} /habits{route.path}"
+        for route in habits_router.routes
+        for method in route.methods
+    }
+    assert set(report["routes"]) == routes
+    for name, result in report["routes"].items():
+        assert result["requests"] == 4, name
+        assert result["errors"] == 0, name
+        assert result["queries_per_request"] >= 0, name
+    assert report["auth_calls"] == 2
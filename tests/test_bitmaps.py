@@ -0,0 +1,128 @@
+from datetime import date, timedelta
+
+import pytest
+
+import bitmaps  # type: ignore
+from routers import habits as habits_routes  # type: ignore
+from tests.conftest import seed_habits
+
+
+def test_set_bit_decode() -> None:
+    """
+    GIVEN an empty year bitmap
+    WHEN bits set and cleared by day of the year
+    THEN check decode returns TrackerBase shaped days with matching statuses
+    """
+    bits = b""
+    for day in (date(2024, 1, 1), date(2024, 2, 29), date(2024, 12, 31)):
+        bits = bitmaps.set_bit(bits, bitmaps.day_index(day), 1)
+    bits = bitmaps.set_bit(bits, bitmaps.day_index(date(2024, 2, 29)), 0)
+
+    trackers = bitmaps.decode(1, {2024: bits}, date(2023, 12, 31), date(2025, 1, 1))
+
+    assert len(bits) == bitmaps.YEAR_BYTES
+    assert len(trackers) == 368
+    assert [t["date"] for t in trackers if t["status"]] == ["2024-01-01", "2024-12-31"]
+    assert trackers[0] == {"habit_id": 1, "date": "2023-12-31", "status": 0}
+
+
+@pytest.mark.asyncio
+async def test_migrate_rows_to_bitmaps(local_database, local_user) -> None:
+    """
+    GIVEN habits with tracker rows, every other day done
+    WHEN bitmaps.migrate
+    THEN check decoded bitmaps match the rows
+    """
+    habit_ids = await seed_habits(local_database, local_user["id"], 3, days=400)
+    date_from = date.today() - timedelta(days=399)
+
+    migrated = await bitmaps.migrate(local_database, batch_size=2)
+    habit_trackers = await bitmaps.fetch_trackers(
+        local_database, habit_ids, date_from, date.today()
+    )
+    rows = await local_database.fetch_all(
+        "SELECT habit_id, date, status FROM trackers ORDER BY habit_id, date"
+    )
+
+    assert migrated == 3
+    assert [
+        (t["habit_id"], t["date"], t["status"])
+        for habit_id in habit_ids
+        for t in habit_trackers[habit_id]
+    ] == [tuple(row) for row in rows]
+
+
+@pytest.mark.asyncio
+async def test_bitmap_storage_endpoints(
+    client, local_database, local_user, monkeypatch
+) -> None:
+    """
+    GIVEN bitmap tracker storage
+    WHEN PUT "/habits/trackers" then GET "/habits/habit/{id}" and "/habits/list"
+    THEN check checked in days read back as status 1, other days as status 0,
+         no tracker rows written
+    """
+    monkeypatch.setattr(habits_routes.settings, "TRACKER_STORAGE", "bitmap")
+    r = await client.post("/habits/habit", json={"title": "pytest"})
+    habit_id = r.json()["id"]
+    today_day = date.today()
+    entries = [
+        {
+            "habit_id": habit_id,
+            "date": str(today_day - timedelta(days=day)),
+            "status": 1,
+        }
+        for day in (0, 2, 40)
+    ]
+
+    r_check_in = await client.put("/habits/trackers", json={"trackers": entries})
+    r_habit = await client.get(f"/habits/habit/{habit_id}")
+    r_list = await client.get("/habits/list")
+    rows_count = await local_database.fetch_val("SELECT COUNT(*) FROM trackers")
+
+    assert r_check_in.status_code == 200
+    assert len(r_check_in.json()) == 3
+    tracker = r_habit.json()["tracker"]
+    assert len(tracker) == 31
+    assert [t["date"] for t in tracker if t["status"]] == [
+        str(today_day - timedelta(days=2)),
+        str(today_day),
+    ]
+    assert r_list.json()[0]["tracker"] == tracker
+    assert rows_count == 0
+
+
+@pytest.mark.asyncio
+async def test_bitmap_storage_stats(client, monkeypatch) -> None:
+    """
+    GIVEN bitmap tracker storage and a habit checked in today, yesterday
+          and 5 days ago
+    WHEN GET "/habits/stats" and "/habits/summary"
+    THEN check streaks, rates and totals are computed from the bitmaps
+    """
+    monkeypatch.setattr(habits_routes.settings, "TRACKER_STORAGE", "bitmap")
+    r = await client.post("/habits/habit", json={"title": "pytest"})
+    habit_id = r.json()["id"]
+    today_day = date.today()
+    days = [today_day - timedelta(days=day) for day in (0, 1, 5)]
+    entries = [{"habit_id": habit_id, "date": str(day), "status": 1} for day in days]
+    await client.put("/habits/trackers", json={"trackers": entries})
+
+    r_stats = await client.get("/habits/stats")
+    r_summary = await client.get("/habits/summary")
+
+    stats = r_stats.json()[0]
+    assert stats["habit_id"] == habit_id
+    assert (stats["current_streak"], stats["longest_streak"]) == (2, 2)
+    assert stats["completion_7"] == pytest.approx(3 / 6)
+    assert sum(stats["weekdays"]) == 3
+    assert stats["weekdays"][today_day.weekday()] >= 1
+    assert r_summary.json() == [
+        {
+            "habit_id": habit_id,
+            "current_streak": 2,
+            "longest_streak": 2,
+            "last_checkin": str(today_day),
+            "total_completions": 3,
+        }
+    ]
@@ -0,0 +1,191 @@
+from datetime import date, timedelta
+
+import pytest
+
+import routers.habits  # type: ignore
+from cache import LRUBackend, RedisBackend, ResponseCache  # type: ignore
+from tests.conftest import QueryCounter, seed_habits
+
+
+class FakeRedis:
+    """
+    Local stand-in for the redis.asyncio client commands the cache uses
+    """
+
+    def __init__(self) -> None:
+        self.data: dict = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    async def incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "backend",
+    [LRUBackend(maxsize=100), RedisBackend(FakeRedis())],
+    ids=["lru", "redis"],
+)
+async def test_response_cache_invalidate(backend) -> None:
+    """
+    GIVEN cached responses of two users
+    WHEN ResponseCache.invalidate for one user
+    THEN check only that user's entries unreachable, hit/miss counters updated
+    """
+    cache = ResponseCache(backend, ttl=60)
+    for user_id in (1, 2):
+        epoch = await cache.epoch(user_id)
+        key = cache.key(user_id, "list")
+        await cache.set(key, epoch, [{"id": user_id}], {"X-Next-Cursor": "7"})
+
+    await cache.invalidate(1)
+    cached_1 = await cache.get(cache.key(1, "list"), await cache.epoch(1))
+    cached_2 = await cache.get(cache.key(2, "list"), await cache.epoch(2))
+
+    assert cached_1 is None
+    assert cached_2.body == b'[{"id":2}]'
+    assert cached_2.headers["X-Next-Cursor"] == "7"
+    assert cache.stats() == {"hits": 1, "misses": 1}
+
+
+@pytest.mark.asyncio
+async def test_response_cache_skips_stale_set() -> None:
+    """
+    GIVEN a response computed before the user's data changed
+    WHEN ResponseCache.set with the epoch read before the change, after the bump
+    THEN check the response is returned but never served at the new epoch
+    """
+    cache = ResponseCache(LRUBackend(maxsize=100), ttl=60)
+    key = cache.key(1, "list")
+    epoch = await cache.epoch(1)
+    await cache.invalidate(1)
+
+    response = await cache.set(key, epoch, [])
+
+    assert response.body == b"[]"
+    assert await cache.get(key, await cache.epoch(1)) is None
+
+
+@pytest.mark.asyncio
+async def test_lru_backend_eviction() -> None:
+    """
+    GIVEN a full LRU backend
+    WHEN a new key is set
+    THEN check the least recently used key is evicted
+    """
+    backend = LRUBackend(maxsize=2)
+    await backend.set("a", b"1", 60)
+    await backend.set("b", b"2", 60)
+    await backend.get("a")
+    await backend.set("c", b"3", 60)
+
+    assert await backend.get("b") is None
+    assert list(backend._entries) == ["a", "c"]
+
+
+@pytest.mark.asyncio
+async def test_habits_list_cached(
+    client, local_database, local_user, response_cache
+) -> None:
+    """
+    GIVEN user habits list requested twice
+    WHEN the user updates a habit and requests the list again
+    THEN check the second read served from cache without queries,
+         the read after the write sees the update
+    """
+    habit_ids = await seed_habits(local_database, local_user["id"], 3, days=2)
+    counter = QueryCounter(local_database)
+
+    r_first = await client.get("/habits/list")
+    counter.reset()
+    r_cached = await client.get("/habits/list")
+    cached_query_count = len(counter)
+    await client.put(
+        f"/habits/habit/{habit_ids[0]}", json={"title": "updated", "description": "d"}
+    )
+    r_updated = await client.get("/habits/list")
+
+    assert r_cached.json() == r_first.json()
+    assert cached_query_count == 0
+    assert r_updated.json()[0]["title"] == "updated"
+    assert response_cache.stats() == {"hits": 1, "misses": 2}
+
+
+@pytest.mark.asyncio
+async def test_habits_list_not_modified(client, local_database, local_user) -> None:
+    """
+    GIVEN user habits list with its ETag
+    WHEN GET "/habits/list" with If-None-Match, before and after a tracker write
+    THEN check 304 without queries while unchanged, 200 with a new ETag after the write
+    """
+    habit_ids = await seed_habits(local_database, local_user["id"], 2, days=1)
+    r = await client.get("/habits/list")
+    etag = r.headers["ETag"]
+    counter = QueryCounter(local_database)
+
+    r_not_modified = await client.get("/habits/list", headers={"If-None-Match": etag})
+    not_modified_query_count = len(counter)
+    r_habit = await client.get(
+        f"/habits/habit/{habit_ids[0]}", headers={"If-None-Match": etag}
+    )
+    entries = [{"habit_id": habit_ids[0], "date": "2024-01-01", "status": 1}]
+    await client.put("/habits/trackers", json={"trackers": entries})
+    r_modified = await client.get("/habits/list", headers={"If-None-Match": etag})
+
+    assert r_not_modified.status_code == 304
+    assert r_not_modified.headers["ETag"] == etag
+    assert r_not_modified.content == b""
+    assert not_modified_query_count == 0
+    assert r_habit.status_code == 200
+    assert r_modified.status_code == 200
+    assert r_modified.headers["ETag"] != etag
+
+
+@pytest.mark.asyncio
+async def test_missing_habit_not_modified_wildcard(client, local_database) -> None:
+    """
+    GIVEN no habit 9999
+    WHEN GET "/habits/habit/9999" with If-None-Match: *
+    THEN check 404, not 304
+    """
+    r = await client.get("/habits/habit/9999", headers={"If-None-Match": "*"})
+
+    assert r.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_habits_list_etag_changes_daily(
+    client, local_database, local_user, monkeypatch
+) -> None:
+    """
+    GIVEN user habits list of the current week with its ETag
+    WHEN GET "/habits/list?period=week" with If-None-Match on the next day
+    THEN check 200 with a new ETag and the new day, not the cached body
+    """
+    await seed_habits(local_database, local_user["id"], 1, days=0)
+    today_day = date.today() - timedelta(days=date.today().weekday())
+
+    class Today(date):
+        @classmethod
+        def today(cls):
+            return today_day
+
+    monkeypatch.setattr(routers.habits, "date", Today)
+    r = await client.get("/habits/list", params={"period": "week"})
+    today_day += timedelta(days=1)
+    r_next_day = await client.get(
+        "/habits/list",
+        params={"period": "week"},
+        headers={"If-None-Match": r.headers["ETag"]},
+    )
+
+    assert r_next_day.status_code == 200
+    assert r_next_day.headers["ETag"] != r.headers["ETag"]
+    assert len(r.json()[0]["tracker"]) == 1
+    assert len(r_next_day.json()[0]["tracker"]) == 2
@@ -0,0 +1,65 @@
+import csv
+import io
+import json
+
+import pytest
+
+import export  # type: ignore
+from routers import habits as habits_routes  # type: ignore
+from tests.conftest import seed_habits
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("storage", ["rows", "bitmap"])
+async def test_export_ndjson_csv(
+    client, local_database, local_user, monkeypatch, storage
+) -> None:
+    """
+    GIVEN user with 3 habits x 400 days of trackers, another user's habits,
+          rows and bitmap storage
+    WHEN GET "/habits/export" as NDJSON and CSV
+    THEN check every done tracker of the user exported once, in both formats
+    """
+    habit_ids = await seed_habits(local_database, local_user["id"], 3, days=400)
+    await seed_habits(local_database, local_user["id"] + 1, 2, days=10)
+    if storage == "bitmap":
+        import bitmaps  # type: ignore
+
+        await bitmaps.migrate(local_database)
+        monkeypatch.setattr(habits_routes.settings, "TRACKER_STORAGE", "bitmap")
+    done_db = await local_database.fetch_all(
+        "SELECT habit_id, date FROM trackers WHERE status = 1 AND habit_id IN "
+        "(SELECT id FROM habits WHERE user_id = :user_id) ORDER BY habit_id, date",
+        values={"user_id": local_user["id"]},
+    )
+
+    r_ndjson = await client.get("/habits/export")
+    r_csv = await client.get("/habits/export", params={"format": "csv"})
+    ndjson_rows = [json.loads(line) for line in r_ndjson.text.splitlines()]
+    csv_rows = list(csv.DictReader(io.StringIO(r_csv.text)))
+
+    assert r_ndjson.headers["content-type"] == "application/x-ndjson"
+    assert r_csv.headers["content-type"].startswith("text/csv")
+    assert {row["habit_id"] for row in ndjson_rows} == set(habit_ids)
+    assert len(csv_rows) == len(ndjson_rows)
+    assert [
+        (row["habit_id"], row["date"]) for row in ndjson_rows if row["status"] == 1
+    ] == [tuple(row) for row in done_db]
+
+
+@pytest.mark.asyncio
+async def test_encode_ndjson_chunks() -> None:
+    """
+    GIVEN 1200 rows
+    WHEN export.encode_ndjson with 500 rows per chunk
+    THEN check three chunks yielded, every row encoded once
+    """
+
+    async def rows():
+        for i in range(1200):
+            yield {"habit_id": i, "date": "2024-01-01", "status": 1}
+
+    chunks = [chunk async for chunk in export.encode_ndjson(rows(), chunk_rows=500)]
+
+    assert len(chunks) == 3
+    assert sum(chunk.count(b"\n") for chunk in chunks) == 1200
@@ -1,9 +1,12 @@
+from datetime import date, timedelta
 from typing import Any
 
 import pytest
 import requests
 
+import stats  # type: ignore
 from settings import Settings  # type: ignore
+from tests.conftest import QueryCounter, seed_habits
 
 
 settings: Any = Settings()
@@ -44,7 +47,7 @@ def test_user_create_habit(user, database, title, description, status, bool) ->
 
     assert r.status_code == status
     assert habit_db[0] is bool
-    assert tracker_db[0] is bool
+    assert tracker_db[0] == 0
 
 
 def test_user_create_many_habits(many_habits, user, database) -> None:
@@ -71,7 +74,7 @@ def test_user_create_many_habits(many_habits, user, database) -> None:
     ).fetchall()
 
     assert len(habits_db) == len(many_habits)
-    assert len(trackers_db) == len(many_habits)
+    assert len(trackers_db) == 0
 
 
 def test_user_get_habit_by_id(user, new_habit, database) -> None:
@@ -155,3 +158,609 @@ def test_delete_habit(user, new_habit, database) -> None:
     assert r.status_code == 200
     assert r_body["deleted"] == new_habit[0]
     assert habit_db is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("count", [1, 5, 50])
+async def test_get_habits_list_query_count(
+    client, local_database, local_user, count
+) -> None:
+    """
+    GIVEN user with 1, 5 and 50 habits
+    WHEN GET "/habits/list"
+    THEN check every habit with every window day in response, query count does not grow with habits
+    """
+    await seed_habits(local_database, local_user["id"], count, days=3)
+    await seed_habits(local_database, local_user["id"] + 1, 2, days=3)
+    counter = QueryCounter(local_database)
+
+    r = await client.get("/habits/list")
+    r_body = r.json()
+
+    assert r.status_code == 200
+    assert len(r_body) == count
+    assert all(
+        len(habit["tracker"]) == settings.TRACKER_WINDOW_DAYS + 1 for habit in r_body
+    )
+    assert all(
+        [t["status"] for t in habit["tracker"][-3:]] == [0, 1, 0] for habit in r_body
+    )
+    assert len(counter) == 2
+
+
+@pytest.mark.asyncio
+async def test_get_habit_tracker_window(client, local_database, local_user) -> None:
+    """
+    GIVEN habit with 100 days of trackers
+    WHEN GET "habits/habit/{id}" with default and explicit date window
+    THEN check only trackers inside the window returned, last 30 days by default
+    """
+    habit_ids = await seed_habits(local_database, local_user["id"], 1, days=100)
+    today_day = date.today()
+
+    r = await client.get(f"/habits/habit/{habit_ids[0]}")
+    r_body = r.json()
+    r_window = await client.get(
+        f"/habits/habit/{habit_ids[0]}",
+        params={
+            "from": str(today_day - timedelta(days=60)),
+            "to": str(today_day - timedelta(days=51)),
+        },
+    )
+    r_window_body = r_window.json()
+
+    assert r.status_code == 200
+    assert len(r_body["tracker"]) == 31
+    assert r_body["tracker"][0]["date"] == str(today_day - timedelta(days=30))
+    assert len(r_window_body["tracker"]) == 10
+
+
+@pytest.mark.asyncio
+async def test_virtual_trackers(client, local_database, local_user) -> None:
+    """
+    GIVEN new habit without tracker rows
+    WHEN GET "/habits/habit/{id}" before and after a check-in two days ago
+    THEN check every window day read as status 0, the check-in as status 1,
+         one tracker row written
+    """
+    r = await client.post("/habits/habit", json={"title": "pytest"})
+    habit_id = r.json()["id"]
+    day = str(date.today() - timedelta(days=2))
+
+    r_before = await client.get(f"/habits/habit/{habit_id}")
+    await client.put(
+        "/habits/trackers",
+        json={"trackers": [{"habit_id": habit_id, "date": day, "status": 1}]},
+    )
+    r_after = await client.get(f"/habits/habit/{habit_id}")
+    rows_count = await local_database.fetch_val("SELECT COUNT(*) FROM trackers")
+
+    tracker_before = r_before.json()["tracker"]
+    tracker_after = r_after.json()["tracker"]
+    assert len(tracker_before) == settings.TRACKER_WINDOW_DAYS + 1
+    assert all(t["status"] == 0 for t in tracker_before)
+    assert [t["date"] for t in tracker_after] == [t["date"] for t in tracker_before]
+    assert [t["date"] for t in tracker_after if t["status"]] == [day]
+    assert rows_count == 1
+
+
+@pytest.mark.asyncio
+async def test_get_habit_tracker_pagination(client, local_database, local_user) -> None:
+    """
+    GIVEN habit with 30 days of trackers
+    WHEN GET "habits/habit/{id}" following X-Next-Cursor
+    THEN check every day of the default window returned once, in date order,
+         the day without a tracker as status 0
+    """
+    habit_ids = await seed_habits(local_database, local_user["id"], 1, days=30)
+    dates: list = []
+    params: dict = {"limit": 7}
+    while True:
+        r = await client.get(f"/habits/habit/{habit_ids[0]}", params=params)
+        dates.extend(tracker["date"] for tracker in r.json()["tracker"])
+        if "X-Next-Cursor" not in r.headers:
+            break
+        params["after"] = r.headers["X-Next-Cursor"]
+
+    assert len(dates) == settings.TRACKER_WINDOW_DAYS + 1
+    assert dates == sorted(set(dates))
+    assert dates[0] == str(date.today() - timedelta(days=settings.TRACKER_WINDOW_DAYS))
+
+
+@pytest.mark.asyncio
+async def test_tracker_window_bounded(client, local_database, local_user) -> None:
+    """
+    GIVEN a user habit
+    WHEN GET "/habits/list", "/habits/trackers" and "/habits/habit/{id}" from 1900
+    THEN check 422 for the unpaginated list and trackers, a single page of
+         100 days for the habit
+    """
+    habit_ids = await seed_habits(local_database, local_user["id"], 1, days=1)
+    params = {"from": "1900-01-01"}
+    last_day = str(date.today())
+
+    r_list = await client.get("/habits/list", params=params)
+    r_trackers = await client.get("/habits/trackers", params=params)
+    r_habit = await client.get(f"/habits/habit/{habit_ids[0]}", params=params)
+    r_year = await client.get(
+        "/habits/trackers",
+        params={"from": str(date.today() - timedelta(days=365)), "to": last_day},
+    )
+
+    assert r_list.status_code == 422
+    assert r_trackers.status_code == 422
+    assert r_habit.status_code == 200
+    assert len(r_habit.json()["tracker"]) == 100
+    assert r_habit.headers["X-Next-Cursor"] == "1900-04-10"
+    assert r_year.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_get_habits_list_pagination(client, local_database, local_user) -> None:
+    """
+    GIVEN user with 12 habits
+    WHEN GET "/habits/list" following X-Next-Cursor
+    THEN check every habit returned once, query count per page stays constant
+    """
+    habit_ids = await seed_habits(local_database, local_user["id"], 12, days=2)
+    counter = QueryCounter(local_database)
+    ids: list = []
+    params: dict = {"limit": 5}
+    while True:
+        counter.reset()
+        r = await client.get("/habits/list", params=params)
+        ids.extend(habit["id"] for habit in r.json())
+        assert len(counter) == 2
+        if "X-Next-Cursor" not in r.headers:
+            break
+        params["after"] = r.headers["X-Next-Cursor"]
+
+    assert ids == habit_ids
+
+
+@pytest.mark.asyncio
+async def test_get_user_trackers_range(client, local_database, local_user) -> None:
+    """
+    GIVEN user with 2 habits x 40 days of trackers, another user's habits
+    WHEN GET "/habits/trackers" for this week, this month and an explicit range
+    THEN check only the user's trackers inside each range returned, dates ISO
+    """
+    await seed_habits(local_database, local_user["id"] + 1, 2, days=40)
+    habit_ids = await seed_habits(local_database, local_user["id"], 2, days=40)
+    today_day = date.today()
+    date_from = today_day - timedelta(days=20)
+
+    r_week = await client.get("/habits/trackers", params={"period": "week"})
+    r_month = await client.get("/habits/trackers", params={"period": "month"})
+    r_range = await client.get(
+        "/habits/trackers",
+        params={
+            "habit_id": habit_ids[1],
+            "from": str(date_from),
+            "to": str(date_from + timedelta(days=9)),
+        },
+    )
+
+    assert len(r_week.json()) == 2 * (today_day.weekday() + 1)
+    assert len(r_month.json()) == 2 * today_day.day
+    assert [t["date"] for t in r_range.json()] == [
+        str(date_from + timedelta(days=day)) for day in range(10)
+    ]
+    assert {t["habit_id"] for t in r_range.json()} == {habit_ids[1]}
+
+
+@pytest.mark.asyncio
+async def test_router_queries_use_indexes(client, local_database, local_user) -> None:
+    """
+    GIVEN every habits router endpoint called by user
+    WHEN EXPLAIN QUERY PLAN for each issued query
+    THEN check habits and trackers are searched by an equality lookup on an index,
+         never scanned or range-scanned over every user's rows
+    """
+    await seed_habits(local_database, local_user["id"] + 1, 20, days=40)
+    habit_ids = await seed_habits(local_database, local_user["id"], 3, days=40)
+    tracker_id = await local_database.fetch_val(
+        "SELECT id FROM trackers WHERE habit_id = :habit_id",
+        values={"habit_id": habit_ids[0]},
+    )
+    counter = QueryCounter(local_database)
+
+    await client.post("/habits/habit", json={"title": "pytest", "description": None})
+    await client.get(f"/habits/habit/{habit_ids[0]}")
+    await client.put(
+        f"/habits/habit/{habit_ids[0]}", json={"title": "t", "description": "d"}
+    )
+    await client.put(f"/habits/tracker/{tracker_id}/1")
+    await client.get("/habits/list")
+    await client.get("/habits/trackers", params={"period": "week"})
+    await client.delete(f"/habits/habit/{habit_ids[1]}")
+    queries = list(counter.queries)
+    counter.reset()
+
+    assert len(queries) > 10
+    for query, values in queries:
+        plan = await local_database.fetch_all(
+            "EXPLAIN QUERY PLAN " + query, values=values
+        )
+        for row in plan:
+            detail = row["detail"]
+            if "habits" not in detail and "trackers" not in detail:
+                continue
+            assert detail.startswith("SEARCH"), f"{query} -> {detail}"
+            assert "=?" in detail, f"{query} -> {detail}"
+
+
+@pytest.mark.asyncio
+async def test_trackers_check_in(client, local_database, local_user) -> None:
+    """
+    GIVEN user habits with existing trackers
+    WHEN PUT "/habits/trackers" with a week of entries for two habits
+    THEN check existing trackers updated, missing ones inserted, query count constant:
+         ownership, upsert, habit_stats lookup and rebuild of the backfilled habits
+    """
+    habit_ids = await seed_habits(local_database, local_user["id"], 2, days=3)
+    today_day = date.today()
+    entries = [
+        {
+            "habit_id": habit_id,
+            "date": str(today_day - timedelta(days=day)),
+            "status": 1,
+        }
+        for habit_id in habit_ids
+        for day in range(7)
+    ]
+    counter = QueryCounter(local_database)
+
+    r = await client.put("/habits/trackers", json={"trackers": entries})
+    r_body = r.json()
+    query_count = len(counter)
+    trackers_db = await local_database.fetch_all(
+        "SELECT habit_id, date, status FROM trackers WHERE habit_id IN (:a, :b)",
+        values={"a": habit_ids[0], "b": habit_ids[1]},
+    )
+
+    assert r.status_code == 200
+    assert len(r_body) == 14
+    assert query_count == 5
+    assert len(trackers_db) == 14
+    assert all(tracker["status"] == 1 for tracker in trackers_db)
+
+
+@pytest.mark.asyncio
+async def test_trackers_check_in_wrong_habit(
+    client, local_database, local_user
+) -> None:
+    """
+    GIVEN entries for own habit and another user's habit
+    WHEN PUT "/habits/trackers"
+    THEN check status_code == 409, no tracker written
+    """
+    habit_ids = await seed_habits(local_database, local_user["id"], 1, days=1)
+    other_ids = await seed_habits(local_database, local_user["id"] + 1, 1, days=1)
+    yesterday = str(date.today() - timedelta(days=1))
+    entries = [
+        {"habit_id": habit_ids[0], "date": yesterday, "status": 1},
+        {"habit_id": other_ids[0], "date": yesterday, "status": 1},
+    ]
+
+    r = await client.put("/habits/trackers", json={"trackers": entries})
+    count = await local_database.fetch_val("SELECT COUNT(*) FROM trackers")
+
+    assert r.status_code == 409
+    assert count == 2
+
+
+@pytest.mark.asyncio
+async def test_trackers_check_in_future_date(
+    client, local_database, local_user
+) -> None:
+    """
+    GIVEN a user habit
+    WHEN PUT "/habits/trackers" for tomorrow, then for a date years ahead
+    THEN check tomorrow accepted as timezone leeway, the far date 422 and not
+         recorded as the last check-in
+    """
+    habit_ids = await seed_habits(local_database, local_user["id"], 1, days=1)
+    tomorrow = str(date.today() + timedelta(days=1))
+
+    r_tomorrow = await client.put(
+        "/habits/trackers",
+        json={"trackers": [{"habit_id": habit_ids[0], "date": tomorrow, "status": 1}]},
+    )
+    r_future = await client.put(
+        "/habits/trackers",
+        json={
+            "trackers": [
+                {"habit_id": habit_ids[0], "date": "2099-01-01", "status": 1}
+            ]
+        },
+    )
+    summary = await client.get("/habits/summary")
+
+    assert r_tomorrow.status_code == 200
+    assert r_future.status_code == 422
+    assert summary.json()[0]["last_checkin"] == tomorrow
+
+
+@pytest.mark.asyncio
+async def test_create_habit_transaction(client, local_database, local_user) -> None:
+    """
+    GIVEN new habit payload
+    WHEN POST "/habits/habit"
+    THEN check status_code == 201, habit returned from insert without tracker rows,
+         two queries issued
+    """
+    counter = QueryCounter(local_database)
+
+    payload = {"title": "Running", "description": None}
+    r = await client.post("/habits/habit", json=payload)
+    r_body = r.json()
+    query_count = len(counter)
+    tracker_db = await local_database.fetch_one(
+        "SELECT habit_id, date, status FROM trackers WHERE habit_id = :id",
+        values={"id": r_body["id"]},
+    )
+
+    assert r.status_code == 201
+    assert r_body["title"] == "Running"
+    assert r_body["user_id"] == local_user["id"]
+    assert query_count == 2
+    assert tracker_db is None
+
+
+@pytest.mark.asyncio
+async def test_create_many_habits_batch(client, local_database, local_user) -> None:
+    """
+    GIVEN many habits payload
+    WHEN POST "/habits/habits"
+    THEN check status_code == 201, every habit created without tracker rows,
+         two queries issued
+    """
+    many_habits = [{"title": f"test_{i}", "description": None} for i in range(7)]
+    counter = QueryCounter(local_database)
+
+    r = await client.post("/habits/habits", json={"habits": many_habits})
+    r_body = r.json()
+    query_count = len(counter)
+    trackers_count = await local_database.fetch_val(
+        "SELECT COUNT(*) FROM trackers WHERE habit_id IN "
+        "(SELECT id FROM habits WHERE user_id = :user_id)",
+        values={"user_id": local_user["id"]},
+    )
+
+    assert r.status_code == 201
+    assert [habit["title"] for habit in r_body] == [h["title"] for h in many_habits]
+    assert query_count == 2
+    assert trackers_count == 0
+
+
+@pytest.mark.asyncio
+async def test_get_habits_stats(client, local_database, local_user) -> None:
+    """
+    GIVEN habit with done streaks of 3 (up to today) and 5 days over 20 tracked days,
+          habit without trackers
+    WHEN GET "/habits/stats"
+    THEN check streaks, completion rates and weekday histogram, one query issued
+    """
+    habit_ids = await seed_habits(local_database, local_user["id"], 2, days=0)
+    today_day = date.today()
+    done_days = {0, 1, 2, 5, 6, 7, 8, 9}
+    await local_database.execute_many(
+        "INSERT INTO trackers(habit_id, date, status) VALUES (:habit_id, :date, :status)",
+        values=[
+            {
+                "habit_id": habit_ids[0],
+                "date": str(today_day - timedelta(days=day)),
+                "status": int(day in done_days),
+            }
+            for day in range(20)
+        ],
+    )
+    weekdays = [0] * 7
+    for day in done_days:
+        weekdays[(today_day - timedelta(days=day)).weekday()] += 1
+    counter = QueryCounter(local_database)
+
+    r = await client.get("/habits/stats")
+    r_body = r.json()
+
+    assert r.status_code == 200
+    assert len(counter) == 1
+    assert r_body[0] == {
+        "habit_id": habit_ids[0],
+        "current_streak": 3,
+        "longest_streak": 5,
+        "completion_7": 5 / 7,
+        "completion_30": 8 / 20,
+        "completion_365": 8 / 20,
+        "weekdays": weekdays,
+    }
+    assert r_body[1]["current_streak"] == 0
+    assert r_body[1]["completion_7"] == 0
+    assert r_body[1]["weekdays"] == [0] * 7
+
+
+@pytest.mark.asyncio
+async def test_habits_stats_from_created_at(client, local_database, local_user) -> None:
+    """
+    GIVEN habit created today and habit created 10 days ago, each done today only
+    WHEN GET "/habits/stats"
+    THEN check the rates count the days since the habit was created
+    """
+    habit_ids = await seed_habits(local_database, local_user["id"], 2, days=0)
+    today_day = date.today()
+    await local_database.execute(
+        "UPDATE habits SET created_at = :created_at WHERE id = :id",
+        values={"created_at": today_day - timedelta(days=9), "id": habit_ids[1]},
+    )
+    await local_database.execute(
+        "UPDATE habits SET created_at = :created_at WHERE id = :id",
+        values={"created_at": today_day, "id": habit_ids[0]},
+    )
+    await client.put(
+        "/habits/trackers",
+        json={
+            "trackers": [
+                {"habit_id": habit_id, "date": str(today_day), "status": 1}
+                for habit_id in habit_ids
+            ]
+        },
+    )
+
+    r = await client.get("/habits/stats")
+    r_body = r.json()
+
+    assert r.status_code == 200
+    assert [habit["completion_7"] for habit in r_body] == [1.0, 1 / 7]
+    assert [habit["completion_30"] for habit in r_body] == [1.0, 1 / 10]
+
+
+@pytest.mark.asyncio
+async def test_habit_summary_incremental(client, local_database, local_user) -> None:
+    """
+    GIVEN new habit
+    WHEN PUT "/habits/trackers" day by day, then a backfill and an unmark
+    THEN check "/habits/summary" streaks and totals, forward check-ins update
+         habit_stats in place without a rebuild
+    """
+    r = await client.post("/habits/habit", json={"title": "pytest"})
+    habit_id = r.json()["id"]
+    today_day = date.today()
+
+    async def check_in(days_ago: int, status: int = 1) -> int:
+        counter = QueryCounter(local_database)
+        day = str(today_day - timedelta(days=days_ago))
+        entries = [{"habit_id": habit_id, "date": day, "status": status}]
+        await client.put("/habits/trackers", json={"trackers": entries})
+        return len(counter)
+
+    async def summary() -> tuple:
+        r = await client.get("/habits/summary")
+        habit = r.json()[0]
+        return (
+            habit["current_streak"],
+            habit["longest_streak"],
+            habit["total_completions"],
+        )
+
+    forward_counts = [await check_in(days_ago) for days_ago in (2, 1, 0)]
+    assert forward_counts == [4, 4, 4]
+    assert await summary() == (3, 3, 3)
+    assert await check_in(4) == 5
+    assert await summary() == (3, 3, 4)
+    await check_in(1, status=0)
+    assert await summary() == (1, 1, 3)
+
+
+@pytest.mark.asyncio
+async def test_rebuild_habit_stats(client, local_database, local_user) -> None:
+    """
+    GIVEN habits with a year of trackers and no habit_stats rows
+    WHEN stats.rebuild_habit_stats
+    THEN check "/habits/summary" streaks match "/habits/stats" computed from trackers
+    """
+    await seed_habits(local_database, local_user["id"], 4, days=365)
+    await local_database.execute(
+        "UPDATE trackers SET status = 1 WHERE (habit_id + id) % 7 != 0"
+    )
+
+    await stats.rebuild_habit_stats(local_database)
+    r_summary = await client.get("/habits/summary")
+    r_stats = await client.get("/habits/stats")
+
+    assert len(r_summary.json()) == 4
+    for summary, habit_stats in zip(r_summary.json(), r_stats.json()):
+        assert summary["current_streak"] == habit_stats["current_streak"]
+        assert summary["longest_streak"] == habit_stats["longest_streak"]
+        assert summary["last_checkin"] == str(date.today())
+
+
+@pytest.mark.asyncio
+async def test_habit_full_matches_model(local_database, local_user) -> None:
+    """
+    GIVEN habit and tracker records from the database
+    WHEN serialized through habit_full and through the HabitFull model
+    THEN check the same JSON document
+    """
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse, ORJSONResponse
+
+    from models.habits import HabitFull, habit_full  # type: ignore
+
+    habit_ids = await seed_habits(local_database, local_user["id"], 1, days=5)
+    habit_db = await local_database.fetch_one(
+        "SELECT * FROM habits WHERE id = :id", values={"id": habit_ids[0]}
+    )
+    trackers_db = await local_database.fetch_all(
+        "SELECT * FROM trackers WHERE habit_id = :id ORDER BY date",
+        values={"id": habit_ids[0]},
+    )
+
+    fast = ORJSONResponse(habit_full(habit_db, trackers_db))
+    model = JSONResponse(jsonable_encoder(HabitFull(**habit_db, tracker=trackers_db)))
+
+    assert fast.body == model.body
+
+
+@pytest.mark.asyncio
+async def test_habit_delete_cascade(client, local_database, local_user) -> None:
+    """
+    GIVEN habit with trackers and stats
+    WHEN DELETE "/habits/habit/{id}" twice
+    THEN check one query removing habit, trackers and stats by cascade, then 404
+    """
+    habit_ids = await seed_habits(local_database, local_user["id"], 2, days=5)
+    await stats.rebuild_habit_stats(local_database)
+    counter = QueryCounter(local_database)
+
+    r = await client.delete(f"/habits/habit/{habit_ids[0]}")
+    query_count = len(counter)
+    r_again = await client.delete(f"/habits/habit/{habit_ids[0]}")
+    trackers_db = await local_database.fetch_all(
+        "SELECT DISTINCT habit_id FROM trackers"
+    )
+    stats_db = await local_database.fetch_all("SELECT habit_id FROM habit_stats")
+
+    assert r.status_code == 200
+    assert r.json() == {"deleted": habit_ids[0]}
+    assert query_count == 1
+    assert r_again.status_code == 404
+    assert [tracker["habit_id"] for tracker in trackers_db] == [habit_ids[1]]
+    assert [row["habit_id"] for row in stats_db] == [habit_ids[1]]
+
+
+@pytest.mark.asyncio
+async def test_habit_soft_delete(
+    client, local_database, local_user, monkeypatch
+) -> None:
+    """
+    GIVEN DELETE_MODE soft and two habits with trackers
+    WHEN DELETE "/habits/habit/{id}"
+    THEN check habit hidden from reads and check-ins, rows kept for the purger
+    """
+    from routers import habits as habits_module  # type: ignore
+
+    monkeypatch.setattr(habits_module.settings, "DELETE_MODE", "soft")
+    habit_ids = await seed_habits(local_database, local_user["id"], 2, days=5)
+
+    r = await client.delete(f"/habits/habit/{habit_ids[0]}")
+    r_habit = await client.get(f"/habits/habit/{habit_ids[0]}")
+    r_list = await client.get("/habits/list")
+    r_check_in = await client.put(
+        "/habits/trackers",
+        json={
+            "trackers": [
+                {"habit_id": habit_ids[0], "date": str(date.today()), "status": 1}
+            ]
+        },
+    )
+    trackers_count = await local_database.fetch_val(
+        "SELECT COUNT(*) FROM trackers WHERE habit_id = :id",
+        values={"id": habit_ids[0]},
+    )
+
+    assert r.status_code == 200
+    assert r_habit.status_code == 404
+    assert [habit["id"] for habit in r_list.json()] == [habit_ids[1]]
+    assert r_check_in.status_code == 409
+    assert trackers_count == 5
@@ -0,0 +1,105 @@
+import json
+from datetime import date, timedelta
+
+import pytest
+import sqlalchemy
+
+import importer  # type: ignore
+from db import create_database, metadata  # type: ignore
+from shards import ShardRouter  # type: ignore
+from tests.conftest import seed_habits
+
+
+@pytest.mark.asyncio
+async def test_import_ndjson(client, local_database, local_user) -> None:
+    """
+    GIVEN NDJSON history of 2 habits x 30 days with a repeated day and invalid
+          rows, one dated in the future
+    WHEN POST "/habits/import"
+    THEN check habits created once, trackers deduplicated by (habit_id, date),
+         invalid rows reported, habit_stats rebuilt
+    """
+    today_day = date.today()
+    rows = [
+        {"title": title, "date": str(today_day - timedelta(days=day)), "status": 1}
+        for title in ("read", "run")
+        for day in range(30)
+    ]
+    rows.append({"title": "read", "date": str(today_day), "status": 0})
+    body = "\n".join(json.dumps(row) for row in rows)
+    body += '\n{"title": "read", "status": 3}\nnot json\n'
+    body += '{"title": "read", "date": "2099-01-01", "status": 1}\n'
+
+    r = await client.post("/habits/import", content=body.encode())
+    report = r.json()
+    trackers_count = await local_database.fetch_val("SELECT COUNT(*) FROM trackers")
+    summary = await client.get("/habits/summary")
+
+    assert r.status_code == 200
+    assert report["rows"] == 64
+    assert report["imported"] == 60
+    assert report["invalid"] == 3
+    assert [error["row"] for error in report["errors"]] == [62, 63, 64]
+    assert report["habits_created"] == 2
+    assert trackers_count == 60
+    assert [s["longest_streak"] for s in summary.json()] == [29, 30]
+    assert [s["current_streak"] for s in summary.json()] == [29, 30]
+
+
+@pytest.mark.asyncio
+async def test_import_exported_csv(client, local_database, local_user) -> None:
+    """
+    GIVEN user habits exported as CSV
+    WHEN the export imported again in chunks of 7 rows
+    THEN check no habits created, trackers unchanged, every row imported
+    """
+    await seed_habits(local_database, local_user["id"], 3, days=20)
+    r_export = await client.get("/habits/export", params={"format": "csv"})
+    before = await local_database.fetch_all(
+        "SELECT habit_id, date, status FROM trackers ORDER BY habit_id, date"
+    )
+
+    async def chunks():
+        for start in range(0, len(r_export.content), 100):
+            yield r_export.content[start : start + 100]
+
+    report = await importer.import_trackers(
+        local_database, local_user["id"], importer.parse_csv(chunks()), chunk_rows=7
+    )
+    after = await local_database.fetch_all(
+        "SELECT habit_id, date, status FROM trackers ORDER BY habit_id, date"
+    )
+
+    assert report["rows"] == report["imported"] == 60
+    assert report["habits_created"] == 0
+    assert [tuple(row) for row in after] == [tuple(row) for row in before]
+
+
+@pytest.mark.asyncio
+async def test_import_cli_invalidates_cache(
+    tmp_path, response_cache, monkeypatch
+) -> None:
+    """
+    GIVEN an NDJSON file of 3 check-ins
+    WHEN imported for user 1 by the importer CLI
+    THEN check the trackers stored and the user's cache epoch bumped
+    """
+    url = f"sqlite:///{tmp_path / 'habits.db'}"
+    metadata.create_all(sqlalchemy.create_engine(url))
+    database = create_database(url)
+    monkeypatch.setattr(importer, "get_shard_router", lambda: ShardRouter([database]))
+    monkeypatch.setattr(importer, "get_response_cache", lambda: response_cache)
+    path = tmp_path / "history.ndjson"
+    days = [date.today() - timedelta(days=day) for day in range(3)]
+    path.write_text(
+        "\n".join(json.dumps({"title": "read", "date": str(day)}) for day in days)
+    )
+    epoch = await response_cache.epoch(1)
+
+    await importer.main(1, str(path), "ndjson")
+    await database.connect()
+    trackers_count = await database.fetch_val("SELECT COUNT(*) FROM trackers")
+    await database.disconnect()
+
+    assert trackers_count == 3
+    assert await response_cache.epoch(1) == epoch + 1
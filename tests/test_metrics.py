@@ -0,0 +1,117 @@
+import logging
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+import metrics  # type: ignore
+from auth import AuthClient, TokenCache  # type: ignore
+from db import get_database  # type: ignore
+from main import app  # type: ignore
+from shards import ShardRouter, get_shard_router  # type: ignore
+from tests.conftest import seed_habits
+
+
+def series(histogram: metrics.Histogram, *label_values: str) -> list:
+    return list(
+        histogram._series.get(label_values, [0.0] * (len(histogram.buckets) + 2))
+    )
+
+
+@pytest.mark.asyncio
+async def test_request_query_count(client, local_database, local_user) -> None:
+    """
+    GIVEN an instrumented database and 3 habits
+    WHEN GET /habits/list and /habits/habit/{id}
+    THEN check one request and its query count recorded per route template
+    """
+    database = metrics.InstrumentedDatabase(local_database)
+    app.dependency_overrides[get_database] = lambda: database
+    app.dependency_overrides[get_shard_router] = lambda: ShardRouter([database])
+    habit_ids = await seed_habits(local_database, local_user["id"], 3)
+    before_list = series(metrics.request_queries, "GET", "/habits/list")
+    before_habit = series(metrics.request_queries, "GET", "/habits/habit/{id}")
+    before_duration = series(metrics.request_duration, "GET", "/habits/list", "200")
+
+    r_list = await client.get("/habits/list")
+    r_habit = await client.get(f"/habits/habit/{habit_ids[0]}")
+
+    after_list = series(metrics.request_queries, "GET", "/habits/list")
+    after_habit = series(metrics.request_queries, "GET", "/habits/habit/{id}")
+    after_duration = series(metrics.request_duration, "GET", "/habits/list", "200")
+    assert r_list.status_code == 200
+    assert r_habit.status_code == 200
+    assert after_list[-1] - before_list[-1] == 1
+    assert after_list[-2] - before_list[-2] == 2
+    assert after_habit[-1] - before_habit[-1] == 1
+    assert after_habit[-2] - before_habit[-2] == 2
+    assert after_duration[-1] - before_duration[-1] == 1
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint(client, local_database) -> None:
+    """
+    GIVEN a served request
+    WHEN GET /metrics
+    THEN check Prometheus text with request, query and cache metrics
+    """
+    database = metrics.InstrumentedDatabase(local_database)
+    app.dependency_overrides[get_database] = lambda: database
+    app.dependency_overrides[get_shard_router] = lambda: ShardRouter([database])
+    await client.get("/habits/list")
+
+    r = await client.get("/metrics")
+
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE habits_request_duration_seconds histogram" in r.text
+    assert (
+        'habits_request_duration_seconds_bucket{method="GET",route="/habits/list",'
+        'status="200",le="+Inf"}' in r.text
+    )
+    assert 'habits_query_duration_seconds_count{operation="fetch_all"}' in r.text
+    assert "habits_response_cache_misses_total " in r.text
+
+
+@pytest.mark.asyncio
+async def test_slow_query_logged(local_database, monkeypatch, caplog) -> None:
+    """
+    GIVEN SLOW_QUERY_MS of 0
+    WHEN a query through the instrumented database
+    THEN check the query logged as slow
+    """
+    monkeypatch.setattr(metrics.settings, "SLOW_QUERY_MS", 0)
+    database = metrics.InstrumentedDatabase(local_database)
+
+    with caplog.at_level(logging.WARNING, logger="habits.metrics"):
+        await database.fetch_val("SELECT count(*) FROM habits")
+
+    assert "Slow query" in caplog.text
+    assert "SELECT count(*) FROM habits" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_auth_duration_outcome() -> None:
+    """
+    GIVEN an auth service accepting one token
+    WHEN a valid and a rejected token checked
+    THEN check auth call durations recorded by outcome
+    """
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.headers["Authorization"] == "Bearer valid":
+            return httpx.Response(200, json={"id": 1})
+        return httpx.Response(401)
+
+    cache = TokenCache(maxsize=10, ttl=60, negative_ttl=10)
+    auth = AuthClient("http://auth", cache, transport=httpx.MockTransport(handler))
+    before_ok = series(metrics.auth_duration, "ok")
+    before_rejected = series(metrics.auth_duration, "rejected")
+
+    await auth.check_token("Bearer valid")
+    with pytest.raises(HTTPException):
+        await auth.check_token("Bearer invalid")
+    await auth.close()
+
+    assert series(metrics.auth_duration, "ok")[-1] - before_ok[-1] == 1
+    assert series(metrics.auth_duration, "rejected")[-1] - before_rejected[-1] == 1
@@ -0,0 +1,58 @@
+import pytest
+
+import purger  # type: ignore
+from recieve import delete_users  # type: ignore
+from tests.conftest import QueryCounter, seed_habits
+
+
+@pytest.mark.asyncio
+async def test_purge_in_bounded_batches(local_database, monkeypatch) -> None:
+    """
+    GIVEN user 1 soft-deleted with 2 habits of 5 trackers, user 2 kept
+    WHEN purge with batches of 4 rows
+    THEN check user 1 habits, trackers and stats gone, user 2 untouched,
+         no statement deleting more than 4 rows
+    """
+    for user_id in (1, 2):
+        habit_ids = await seed_habits(local_database, user_id, 2, days=5)
+        for habit_id in habit_ids:
+            await local_database.execute(
+                "INSERT INTO habit_stats VALUES (:habit_id, 0, 0, NULL, 0)",
+                values={"habit_id": habit_id},
+            )
+    await delete_users(local_database, [1], soft=True)
+    batches = []
+    purge_batch = purger.purge_batch
+
+    async def counted_batch(database, batch_rows):
+        batches.append(await purge_batch(database, batch_rows))
+        return batches[-1]
+
+    monkeypatch.setattr(purger, "purge_batch", counted_batch)
+
+    deleted = await purger.purge(local_database, batch_rows=4)
+    habits_db = await local_database.fetch_all("SELECT DISTINCT user_id FROM habits")
+    trackers_count = await local_database.fetch_val("SELECT COUNT(*) FROM trackers")
+    stats_count = await local_database.fetch_val("SELECT COUNT(*) FROM habit_stats")
+
+    assert deleted == 2 * 5 + 2
+    assert batches == [4, 4, 2, 2, 0]
+    assert [habit["user_id"] for habit in habits_db] == [2]
+    assert trackers_count == 2 * 5
+    assert stats_count == 2
+
+
+@pytest.mark.asyncio
+async def test_purge_nothing_deleted(local_database) -> None:
+    """
+    GIVEN habits without soft deletes
+    WHEN purge
+    THEN check nothing deleted with one statement per table
+    """
+    await seed_habits(local_database, 1, 2, days=5)
+    counter = QueryCounter(local_database)
+
+    deleted = await purger.purge(local_database, batch_rows=100)
+
+    assert deleted == 0
+    assert len(counter) == 2
@@ -0,0 +1,29 @@
+import pytest
+
+import queries  # type: ignore
+
+
+@pytest.mark.parametrize("dialect", ["sqlite", "postgresql"])
+def test_queries_compiled_once(dialect) -> None:
+    """
+    GIVEN the router statements of queries
+    WHEN compiled for sqlite and postgresql, twice
+    THEN check the same cached text is returned, with :name placeholders only
+    """
+    statements = [
+        queries.habit(dialect),
+        queries.habit_trackers_page(dialect),
+        queries.habits_page(dialect),
+        queries.insert_habits(dialect, 3),
+        queries.upsert_trackers(dialect, 3),
+        queries.owned_habit_ids(dialect, 3),
+        queries.user_trackers(dialect, True),
+    ]
+
+    assert queries.habit(dialect) is statements[0]
+    assert queries.upsert_trackers(dialect, 3) is statements[4]
+    assert all("?" not in s and "%(" not in s and "$1" not in s for s in statements)
+    assert "LIMIT :limit OFFSET 0" in statements[1]
+    assert ":habit_id_2, :date_2, :status_2" in statements[4]
+    assert "ON CONFLICT (habit_id, date) DO UPDATE" in statements[4]
+    assert "RETURNING" in statements[3]
@@ -0,0 +1,169 @@
+import asyncio
+import json
+
+import pytest
+
+from recieve import DeletionConsumer  # type: ignore
+from shards import ShardRouter  # type: ignore
+from tests.conftest import QueryCounter, seed_habits
+
+
+class InMemoryMessage:
+    def __init__(self, body: bytes) -> None:
+        self.body = body
+        self.state = "pending"
+
+    async def ack(self) -> None:
+        self.state = "acked"
+
+    async def nack(self, requeue: bool = True) -> None:
+        self.state = "requeued" if requeue else "nacked"
+
+    async def reject(self, requeue: bool = False) -> None:
+        self.state = "requeued" if requeue else "rejected"
+
+
+class InMemoryQueue:
+    """
+    Stand-in for an aio_pika queue with manual acks
+    """
+
+    def __init__(self) -> None:
+        self.messages: list = []
+        self._callback = None
+
+    async def consume(self, callback) -> None:
+        self._callback = callback
+
+    async def publish(self, body: bytes) -> InMemoryMessage:
+        message = InMemoryMessage(body)
+        self.messages.append(message)
+        await self._callback(message)
+        return message
+
+    async def wait_settled(self) -> None:
+        while any(message.state == "pending" for message in self.messages):
+            await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_consumer_deletes_users_in_batches(local_database) -> None:
+    """
+    GIVEN five deleted users with habits and one remaining user
+    WHEN DeletionConsumer drains messages in batches of three
+    THEN check deleted users habits and trackers removed, messages acked,
+         one delete statement per batch
+    """
+    for user_id in range(1, 7):
+        await seed_habits(local_database, user_id, 3, days=5)
+    counter = QueryCounter(local_database)
+    queue = InMemoryQueue()
+    consumer = DeletionConsumer(
+        ShardRouter([local_database]), batch_size=3, batch_timeout=0.05
+    )
+    task = asyncio.create_task(consumer.run(queue))
+
+    await asyncio.sleep(0)
+    for user_id in range(1, 6):
+        await queue.publish(json.dumps({"deleted": user_id}).encode())
+    await queue.publish(b"not json")
+    await asyncio.wait_for(queue.wait_settled(), timeout=5)
+    task.cancel()
+    query_count = len(counter)
+    habits_db = await local_database.fetch_all("SELECT DISTINCT user_id FROM habits")
+    trackers_count = await local_database.fetch_val("SELECT COUNT(*) FROM trackers")
+
+    assert [habit["user_id"] for habit in habits_db] == [6]
+    assert trackers_count == 3 * 5
+    assert [message.state for message in queue.messages] == ["acked"] * 5 + ["rejected"]
+    assert query_count == 2
+
+
+@pytest.mark.asyncio
+async def test_consumer_requeues_on_failure(local_database) -> None:
+    """
+    GIVEN database without habits table
+    WHEN DeletionConsumer handles a batch
+    THEN check messages requeued after the retry backoff, not acked
+    """
+    await local_database.execute("DROP TABLE habits")
+    queue = InMemoryQueue()
+    consumer = DeletionConsumer(
+        ShardRouter([local_database]),
+        batch_size=10,
+        batch_timeout=0.05,
+        retry_backoff=0.2,
+    )
+    task = asyncio.create_task(consumer.run(queue))
+
+    await asyncio.sleep(0)
+    await queue.publish(json.dumps({"deleted": 1}).encode())
+    await asyncio.sleep(0.1)
+    during_backoff = queue.messages[0].state
+    await asyncio.wait_for(queue.wait_settled(), timeout=5)
+    task.cancel()
+
+    assert during_backoff == "pending"
+    assert queue.messages[0].state == "requeued"
+
+
+@pytest.mark.asyncio
+async def test_consumer_isolates_failing_message(local_database) -> None:
+    """
+    GIVEN users 1 and 3 with habits and a user_id SQLite cannot store
+    WHEN the three deletions fail as one batch and the consumer allows 1 attempt
+    THEN check users 1 and 3 deleted and acked, the failing message dead-lettered
+    """
+    for user_id in (1, 3):
+        await seed_habits(local_database, user_id, 1)
+    queue = InMemoryQueue()
+    consumer = DeletionConsumer(
+        ShardRouter([local_database]),
+        batch_size=3,
+        batch_timeout=0.05,
+        max_attempts=1,
+    )
+    task = asyncio.create_task(consumer.run(queue))
+
+    await asyncio.sleep(0)
+    for user_id in (1, 2**70, 3):
+        await queue.publish(json.dumps({"deleted": user_id}).encode())
+    await asyncio.wait_for(queue.wait_settled(), timeout=5)
+    task.cancel()
+    habits_count = await local_database.fetch_val("SELECT COUNT(*) FROM habits")
+
+    assert habits_count == 0
+    assert [message.state for message in queue.messages] == [
+        "acked",
+        "rejected",
+        "acked",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_consumer_soft_deletes_users(local_database) -> None:
+    """
+    GIVEN two users with habits and a consumer in soft delete mode
+    WHEN user 1 deletion handled
+    THEN check user 1 habits marked deleted with their trackers kept for the purger
+    """
+    for user_id in (1, 2):
+        await seed_habits(local_database, user_id, 2, days=3)
+    queue = InMemoryQueue()
+    consumer = DeletionConsumer(
+        ShardRouter([local_database]), batch_size=10, batch_timeout=0.05, soft=True
+    )
+    task = asyncio.create_task(consumer.run(queue))
+
+    await asyncio.sleep(0)
+    await queue.publish(json.dumps({"deleted": 1}).encode())
+    await asyncio.wait_for(queue.wait_settled(), timeout=5)
+    task.cancel()
+    habits_db = await local_database.fetch_all(
+        "SELECT user_id, deleted_at IS NOT NULL AS deleted FROM habits ORDER BY id"
+    )
+    trackers_count = await local_database.fetch_val("SELECT COUNT(*) FROM trackers")
+
+    assert [tuple(habit) for habit in habits_db] == [(1, 1), (1, 1), (2, 0), (2, 0)]
+    assert trackers_count == 4 * 3
+    assert queue.messages[0].state == "acked"
@@ -0,0 +1,79 @@
+import pytest
+import pytest_asyncio
+import sqlalchemy
+
+from cache import LRUBackend, ResponseCache, get_response_cache  # type: ignore
+from db import ReplicaPool, create_database, metadata  # type: ignore
+from main import app  # type: ignore
+from shards import ShardRouter, get_shard_router  # type: ignore
+from tests.conftest import seed_habits
+
+
+@pytest_asyncio.fixture(scope="function")
+async def replica_database(tmp_path):
+    url = f"sqlite:///{tmp_path / 'replica.db'}"
+    metadata.create_all(sqlalchemy.create_engine(url))
+    database = create_database(url)
+    await database.connect()
+    yield database
+    await database.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_replica_round_robin(local_database, replica_database, tmp_path):
+    """
+    GIVEN a primary, a healthy replica and a replica whose directory is missing
+    WHEN reads picked before and after the directory exists and a health check
+    THEN check the failing replica skipped until it passes a health check,
+         the primary used once no replica is healthy
+    """
+    now = [0.0]
+    down = create_database(f"sqlite:///{tmp_path / 'down' / 'replica.db'}")
+    pool = ReplicaPool(
+        local_database, [replica_database, down], interval=5, timer=lambda: now[0]
+    )
+
+    skipped = [await pool.read() for _ in range(3)]
+    (tmp_path / "down").mkdir()
+    now[0] = 5
+    recovered = [await pool.read() for _ in range(3)]
+    await down.disconnect()
+    gone = create_database(f"sqlite:///{tmp_path / 'gone' / 'replica.db'}")
+    fallback = await ReplicaPool(local_database, [gone]).read()
+
+    assert skipped == [replica_database] * 3
+    assert recovered == [down, replica_database, down]
+    assert fallback is local_database
+
+
+@pytest.mark.asyncio
+async def test_reads_from_replica(client, local_database, replica_database) -> None:
+    """
+    GIVEN a shard with one replica holding a habit the primary does not have,
+          writes remembered for 5 seconds
+    WHEN POST /habits/habit then GET /habits/list, at once and 5 seconds later
+    THEN check the habit written to and re-selected from the primary,
+         the list read from the primary right after the write,
+         from the replica once the replica lag bound passed
+    """
+    now = [0.0]
+    await seed_habits(replica_database, 1, 1)
+    app.dependency_overrides[get_shard_router] = lambda: ShardRouter(
+        [local_database], replicas={0: [replica_database]}
+    )
+    cache = ResponseCache(
+        LRUBackend(maxsize=100, timer=lambda: now[0]), ttl=60, write_window=5
+    )
+    app.dependency_overrides[get_response_cache] = lambda: cache
+
+    r_create = await client.post("/habits/habit", json={"title": "primary"})
+    r_list = await client.get("/habits/list")
+    now[0] = 5
+    r_list_later = await client.get("/habits/list", params={"limit": 10})
+    primary_titles = await local_database.fetch_all("SELECT title FROM habits")
+
+    assert r_create.status_code == 201
+    assert r_create.json()["title"] == "primary"
+    assert [row["title"] for row in primary_titles] == ["primary"]
+    assert [habit["title"] for habit in r_list.json()] == ["primary"]
+    assert [habit["title"] for habit in r_list_later.json()] == ["test_0"]
@@ -0,0 +1,339 @@
+import asyncio
+import json
+
+import pytest
+import pytest_asyncio
+import sqlalchemy
+
+import rebalance  # type: ignore
+from db import create_database, metadata  # type: ignore
+from main import app  # type: ignore
+from recieve import DeletionConsumer  # type: ignore
+from shards import ShardRouter, get_shard_router  # type: ignore
+from tests.conftest import QueryCounter, seed_habits
+from tests.test_recieve import InMemoryQueue
+
+
+@pytest_asyncio.fixture(scope="function")
+async def shard_databases(tmp_path):
+    databases = []
+    for shard in range(2):
+        url = f"sqlite:///{tmp_path / f'shard_{shard}.db'}"
+        metadata.create_all(sqlalchemy.create_engine(url))
+        databases.append(create_database(url))
+        await databases[-1].connect()
+    yield databases
+    for database in databases:
+        await database.disconnect()
+
+
+async def user_ids(database) -> list:
+    rows = await database.fetch_all("SELECT DISTINCT user_id FROM habits ORDER BY 1")
+    return [row["user_id"] for row in rows]
+
+
+async def user_tracker_ids(database, user_id: int) -> list:
+    rows = await database.fetch_all(
+        """
+        SELECT t.id FROM habits h JOIN trackers t ON t.habit_id = h.id
+        WHERE h.user_id = :user_id ORDER BY t.id
+        """,
+        values={"user_id": user_id},
+    )
+    return [row["id"] for row in rows]
+
+
+@pytest.mark.asyncio
+async def test_shard_map(shard_databases) -> None:
+    """
+    GIVEN two shards and a router refreshing its map every 30 seconds
+    WHEN user 3 moved to shard 0, another process moving user 5, then user 3 home
+    THEN check home shards by user_id, moves seen at once by the mover,
+         by others after the refresh, no directory entry for users at home
+    """
+    now = [0.0]
+    shards = ShardRouter(shard_databases, refresh=30, timer=lambda: now[0])
+    other = ShardRouter(shard_databases, refresh=30, timer=lambda: now[0])
+
+    assert [await shards.shard(user_id) for user_id in (2, 3, 4, 5)] == [0, 1, 0, 1]
+    await shards.set_shard(3, 0)
+    await other.set_shard(5, 0)
+    moved = (await shards.shard(3), await shards.shard(5))
+    now[0] = 30
+    refreshed = await shards.shard(5)
+    await shards.set_shard(3, 1)
+    entries = await shard_databases[0].fetch_all(
+        "SELECT user_id, shard FROM user_shards"
+    )
+
+    assert moved == (0, 1)
+    assert refreshed == 0
+    assert await shards.shard(3) == 1
+    assert [tuple(entry) for entry in entries] == [(5, 0)]
+    assert await shards.database(5) is shard_databases[0]
+
+
+@pytest.mark.asyncio
+async def test_habits_written_to_user_shard(client, local_user, shard_databases):
+    """
+    GIVEN two shards and user 1
+    WHEN POST /habits/habit and GET /habits/list
+    THEN check the habit stored and listed from shard 1 only
+    """
+    app.dependency_overrides[get_shard_router] = lambda: ShardRouter(shard_databases)
+
+    r_create = await client.post("/habits/habit", json={"title": "pytest"})
+    r_list = await client.get("/habits/list")
+
+    assert r_create.status_code == 201
+    assert [habit["title"] for habit in r_list.json()] == ["pytest"]
+    assert await user_ids(shard_databases[0]) == []
+    assert await user_ids(shard_databases[1]) == [local_user["id"]]
+
+
+@pytest.mark.asyncio
+async def test_consumer_deletes_per_shard(shard_databases) -> None:
+    """
+    GIVEN users 1 to 4 spread over two shards
+    WHEN users 1, 2 and 3 deleted in one batch
+    THEN check one delete statement per shard and user 4 kept
+    """
+    for user_id in range(1, 5):
+        await seed_habits(shard_databases[user_id % 2], user_id, 2, days=2)
+    counters = [QueryCounter(database) for database in shard_databases]
+    queue = InMemoryQueue()
+    consumer = DeletionConsumer(
+        ShardRouter(shard_databases), batch_size=3, batch_timeout=0.05
+    )
+    task = asyncio.create_task(consumer.run(queue))
+
+    await asyncio.sleep(0)
+    for user_id in (1, 2, 3):
+        await queue.publish(json.dumps({"deleted": user_id}).encode())
+    await asyncio.wait_for(queue.wait_settled(), timeout=5)
+    task.cancel()
+    deletes = [
+        [query for query, _ in counter.queries if query.startswith("DELETE")]
+        for counter in counters
+    ]
+
+    assert [len(shard_deletes) for shard_deletes in deletes] == [1, 1]
+    assert await user_ids(shard_databases[0]) == [4]
+    assert await user_ids(shard_databases[1]) == []
+
+
+@pytest.mark.asyncio
+async def test_move_user(shard_databases) -> None:
+    """
+    GIVEN user 1 with 2 habits of 3 trackers on shard 1, a habit added and
+          a tracker status changed while the move waits for the map refresh,
+          and user 3 on shard 1
+    WHEN user 1 moved to shard 0
+    THEN check the user marked moving during the wait,
+         all 3 habits, trackers and stats on shard 0 under the same ids with
+         the changed status, nothing of user 1 left on shard 1, user 3
+         untouched, user 1 routed to 0
+    """
+    shards = ShardRouter(shard_databases)
+    await rebalance.set_id_ranges(shards, 1000)
+    await seed_habits(shard_databases[0], 2, 1)
+    old_ids = await seed_habits(shard_databases[1], 1, 2, days=3)
+    await seed_habits(shard_databases[1], 3, 1, days=3)
+    await shard_databases[1].execute(
+        "INSERT INTO habit_stats VALUES (:habit_id, 1, 2, NULL, 2)",
+        values={"habit_id": old_ids[0]},
+    )
+    set_shard = shards.set_shard
+    marked = []
+    tracker_ids = []
+
+    async def write_during_grace(user_id, shard, moving=False):
+        await set_shard(user_id, shard, moving)
+        if not moving:
+            return
+        marked.append(await shards.moving(user_id))
+        # Written by a process not seeing the moving flag yet
+        old_ids.extend(await seed_habits(shard_databases[1], 1, 1, days=1))
+        await shard_databases[1].execute(
+            "UPDATE trackers SET status = 1 WHERE habit_id = :habit_id",
+            values={"habit_id": old_ids[0]},
+        )
+        tracker_ids.extend(await user_tracker_ids(shard_databases[1], 1))
+
+    shards.set_shard = write_during_grace  # type: ignore
+
+    report = await rebalance.move_user(shards, 1, 0, grace=0)
+    moved = await shard_databases[0].fetch_all(
+        """
+        SELECT h.id, h.title, COUNT(t.id) AS trackers, SUM(t.status) AS done
+        FROM habits h
+        LEFT JOIN trackers t ON t.habit_id = h.id
+        WHERE h.user_id = 1 GROUP BY h.id ORDER BY h.id
+        """
+    )
+    total_completions = await shard_databases[0].fetch_val(
+        "SELECT total_completions FROM habit_stats WHERE habit_id = :habit_id",
+        values={"habit_id": moved[0]["id"]},
+    )
+
+    assert report["habit_ids"] == old_ids
+    assert [row["id"] for row in moved] == old_ids
+    assert await user_tracker_ids(shard_databases[0], 1) == tracker_ids
+    assert [(row["title"], row["trackers"]) for row in moved] == [
+        ("test_0", 3),
+        ("test_1", 3),
+        ("test_0", 1),
+    ]
+    assert moved[0]["done"] == 3
+    assert total_completions == 3
+    assert marked == [True]
+    assert await user_ids(shard_databases[1]) == [3]
+    assert await shards.shard(1) == 0
+    with pytest.raises(ValueError):
+        await rebalance.move_user(shards, 1, 0)
+
+
+@pytest.mark.asyncio
+async def test_moving_user_writes_rejected(client, local_user, shard_databases) -> None:
+    """
+    GIVEN user 1 on shard 1 marked moving in the directory
+    WHEN POST /habits/habit and GET /habits/list
+    THEN check 503 with Retry-After for the write, the list still served
+    """
+    shards = ShardRouter(shard_databases)
+    await seed_habits(shard_databases[1], local_user["id"], 1)
+    await shards.set_shard(local_user["id"], 1, moving=True)
+    app.dependency_overrides[get_shard_router] = lambda: shards
+
+    r_create = await client.post("/habits/habit", json={"title": "pytest"})
+    r_list = await client.get("/habits/list")
+
+    assert r_create.status_code == 503
+    assert r_create.headers["Retry-After"] == "30"
+    assert [habit["title"] for habit in r_list.json()] == ["test_0"]
+
+
+@pytest.mark.asyncio
+async def test_import_stops_when_move_starts(
+    client, local_user, shard_databases
+) -> None:
+    """
+    GIVEN user 1 on shard 1, marked moving after the import request started
+    WHEN POST /habits/import
+    THEN check 503 with Retry-After and no chunk written to shard 1
+    """
+    shards = ShardRouter(shard_databases)
+    await shards.set_shard(local_user["id"], 1)
+    moving = shards.moving
+    calls = []
+
+    async def moving_after_start(user_id):
+        calls.append(user_id)
+        # The request dependency sees the user settled, the first chunk moving
+        return len(calls) > 1 or await moving(user_id)
+
+    shards.moving = moving_after_start  # type: ignore
+    app.dependency_overrides[get_shard_router] = lambda: shards
+    body = json.dumps({"title": "read", "date": "2024-01-01", "status": 1})
+
+    r = await client.post("/habits/import", content=body)
+
+    assert r.status_code == 503
+    assert r.headers["Retry-After"] == "30"
+    assert await user_ids(shard_databases[1]) == []
+
+
+@pytest.mark.asyncio
+async def test_export_fails_when_user_moved(
+    client, local_user, shard_databases
+) -> None:
+    """
+    GIVEN user 1 with a habit on shard 1, moved to shard 0 while exported
+    WHEN GET /habits/export
+    THEN check the stream fails instead of ending short
+    """
+    shards = ShardRouter(shard_databases)
+    await seed_habits(shard_databases[1], local_user["id"], 1, days=3)
+    await shards.set_shard(local_user["id"], 1)
+    shard = shards.shard
+    calls = []
+
+    async def moved_after_start(user_id):
+        calls.append(user_id)
+        return 0 if len(calls) > 3 else await shard(user_id)
+
+    shards.shard = moved_after_start  # type: ignore
+    app.dependency_overrides[get_shard_router] = lambda: shards
+
+    # Raised from the response task group, wrapped on some anyio versions
+    with pytest.raises(Exception) as error:
+        await client.get("/habits/export")
+
+    raised = getattr(error.value, "exceptions", [error.value])[0]
+    assert "moved shards during the export" in str(raised)
+
+
+@pytest.mark.asyncio
+async def test_id_ranges(client, local_user, shard_databases) -> None:
+    """
+    GIVEN two shards with habits of users 1 and 2 taking the same ids
+    WHEN user 1 moved to shard 0, then id ranges of 1000 set twice
+         and habits, trackers created on both shards
+    THEN check the move refused, ids from 1000 on shard 0 and 2000 on shard 1,
+         ranges kept by the second run
+    """
+    shards = ShardRouter(shard_databases)
+    app.dependency_overrides[get_shard_router] = lambda: shards
+    await seed_habits(shard_databases[0], 2, 1)
+    await seed_habits(shard_databases[1], 1, 1)
+
+    with pytest.raises(ValueError):
+        await rebalance.move_user(shards, 1, 0, grace=0)
+    await rebalance.set_id_ranges(shards, 1000)
+    r_create = await client.post("/habits/habit", json={"title": "pytest"})
+    habit_id = r_create.json()["id"]
+    entries = [{"habit_id": habit_id, "date": "2024-01-01", "status": 1}]
+    r_check_in = await client.put("/habits/trackers", json={"trackers": entries})
+    home_ids = await seed_habits(shard_databases[0], 2, 1)
+    report = await rebalance.set_id_ranges(shards, 1000)
+
+    assert habit_id == 2000
+    assert r_check_in.json()[0]["id"] == 2000
+    assert home_ids == [1000]
+    assert await user_tracker_ids(shard_databases[0], 2) == [1, 1000]
+    assert [entry["next_id"] for entry in report] == [1001, 1001, 2001, 2001]
+
+
+@pytest.mark.asyncio
+async def test_pin_users(shard_databases, tmp_path) -> None:
+    """
+    GIVEN users 1 to 6 on their home shards of two, user 7 moved to shard 0
+          and user 8 with habits on both shards
+    WHEN users pinned for three shards and a third shard added
+    THEN check every user routed to the shard holding its habits,
+         only users whose home changes pinned, user 8 reported split, not pinned
+    """
+    shards = ShardRouter(shard_databases)
+    for user_id in range(1, 7):
+        await seed_habits(shard_databases[user_id % 2], user_id, 1)
+    await seed_habits(shard_databases[0], 7, 1)
+    await shards.set_shard(7, 0)
+    await seed_habits(shard_databases[0], 8, 1)
+    await seed_habits(shard_databases[1], 8, 1)
+    url = f"sqlite:///{tmp_path / 'shard_2.db'}"
+    metadata.create_all(sqlalchemy.create_engine(url))
+    added = create_database(url)
+
+    report = await rebalance.pin_users(shards, 3)
+    grown = ShardRouter([*shard_databases, added])
+    routed = [await grown.shard(user_id) for user_id in range(1, 8)]
+    entries = await shard_databases[0].fetch_all(
+        "SELECT user_id FROM user_shards ORDER BY user_id"
+    )
+
+    assert routed == [1, 0, 1, 0, 1, 0, 0]
+    assert [entry["user_id"] for entry in entries] == [2, 3, 4, 5, 7]
+    assert report == {
+        "pinned": [{"shard": 0, "users": 2}, {"shard": 1, "users": 2}],
+        "split": [8],
+    }